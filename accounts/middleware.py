@@ -0,0 +1,36 @@
+from django.contrib.auth.models import User
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject
+
+from .models import Profile
+
+
+def get_profile(user):
+    """The user's Profile, or None for anonymous users and users without one."""
+    if not user.is_authenticated:
+        return None
+    return getattr(user, 'profile', None)
+
+
+async def aload_user(request):
+    """
+    Load request.user (and with it request.profile) in an async view, before
+    a template or anything else synchronous touches it.
+    """
+    user = request.user = await request.auser()
+    if user.is_authenticated and not User.profile.is_cached(user):
+        # Sessions logged in through ModelBackend get the user without its profile
+        profile = await Profile.objects.filter(user=user).afirst()
+        User.profile.related.set_cached_value(user, profile)
+    request.profile = get_profile(user)
+    return user
+
+
+class ProfileMiddleware(MiddlewareMixin):
+    """
+    Sets request.profile, resolved on first use. Test it for truth rather
+    than against None: it is a lazy wrapper.
+    """
+
+    def process_request(self, request):
+        request.profile = SimpleLazyObject(lambda: get_profile(request.user))
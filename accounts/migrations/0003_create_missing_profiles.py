@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:02
+
+from django.conf import settings
+from django.db import migrations
+
+
+def create_missing_profiles(apps, schema_editor):
+    """Tenants used to sign up without a profile; give them one."""
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    Profile = apps.get_model('accounts', 'Profile')
+    Profile.objects.bulk_create(
+        Profile(user_id=pk, user_type='tenant')
+        for pk in User.objects.filter(profile__isnull=True).values_list('pk', flat=True)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_profile_image_profile_is_verified'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(create_missing_profiles, migrations.RunPython.noop),
+    ]
@@ -15,3 +15,7 @@ class Profile(models.Model):
 
     def __str__(self):
         return f"{self.user.username} – {self.user_type}"
+
+    @property
+    def is_landlord(self):
+        return self.user_type == 'landlord'
@@ -1,3 +1,76 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
 
-# Create your tests here.
+from listings.models import Property
+from .models import Profile
+
+
+class ProfileQueryTests(TestCase):
+    """The role comes with the user: one session and one user query per request, no writes."""
+
+    def setUp(self):
+        cache.clear()
+        self.tenant = User.objects.create_user('tenant', password='pass12345')
+        Profile.objects.create(user=self.tenant, user_type='tenant')
+        self.landlord = User.objects.create_user('landlord', password='pass12345')
+        Profile.objects.create(user=self.landlord, user_type='landlord')
+        Property.objects.create(title='Flat', description='Nice flat', location='Kilimani', price=10000,
+                                bedrooms='One bedroom', owner_name='landlord', owner_phone='0700000000')
+
+    def test_signup_creates_tenant_profile(self):
+        self.client.post(reverse('signup'), {
+            'username': 'newtenant', 'password1': 'Xy7!pass-word', 'password2': 'Xy7!pass-word',
+            'user_type': 'tenant',
+        })
+        self.assertEqual(Profile.objects.get(user__username='newtenant').user_type, 'tenant')
+
+    def test_existing_model_backend_sessions_stay_logged_in(self):
+        self.client.force_login(self.landlord, backend='django.contrib.auth.backends.ModelBackend')
+        self.assertEqual(self.client.get(reverse('my_properties')).status_code, 200)
+        # The async views load the profile themselves; it doesn't come with the user here
+        for url in (reverse('home'), reverse('home') + '?show=all'):
+            self.assertContains(self.client.get(url), reverse('my_properties'))
+        detail = reverse('property_detail', args=[Property.objects.get().pk])
+        self.assertEqual(self.client.get(detail).status_code, 200)
+        # New logins use ProfileBackend
+        self.client.login(username='tenant', password='pass12345')
+        self.assertEqual(self.client.session['_auth_user_backend'], 'accounts.backends.ProfileBackend')
+
+    @override_settings(PAGE_CACHE_TIMEOUT=600)
+    def test_home(self):
+        url = reverse('home') + '?show=all'
+        for user, is_landlord in ((self.landlord, True), (self.tenant, False)):
+            self.client.force_login(user)
+            self.client.get(url)  # fill the listing grid cache for this role
+            with self.assertNumQueries(2):
+                response = self.client.get(url)
+            self.assertEqual(reverse('my_properties') in response.content.decode(), is_landlord)
+
+    def test_home_without_profile_never_writes(self):
+        User.objects.create_user('legacy', password='pass12345')
+        self.client.login(username='legacy', password='pass12345')
+        with self.assertNumQueries(2):
+            self.client.get(reverse('home'))
+        self.assertFalse(Profile.objects.filter(user__username='legacy').exists())
+
+    def test_my_properties(self):
+        self.client.force_login(self.landlord)
+        with self.assertNumQueries(3):  # session, user, listings page
+            self.assertContains(self.client.get(reverse('my_properties')), 'Flat')
+
+        self.client.force_login(self.tenant)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('my_properties'))
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+
+    def test_landlord_upload(self):
+        self.client.force_login(self.landlord)
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(reverse('landlord_upload')).status_code, 200)
+
+        self.client.force_login(self.tenant)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('landlord_upload'))
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
@@ -15,12 +15,11 @@ def signup(request):
             user = form.save()
             user_type = form.cleaned_data.get('user_type')
 
-            # Create profile for landlords
-            if user_type == 'landlord':
-                Profile.objects.create(user=user, user_type='landlord')
+            # Every account gets a profile, so requests only ever read it
+            Profile.objects.create(user=user, user_type=user_type)
 
             # Log the user in
-            login(request, user)
+            login(request, user, backend='accounts.backends.ProfileBackend')
 
             # For landlords: show loading banner in signup.html
             if user_type == 'landlord':
@@ -0,0 +1,62 @@
+"""
+Cache backend selection.
+
+CACHE_URL picks the cache every worker shares:
+
+    redis://host:6379/0   Redis (or anything speaking its protocol); needs
+                          the redis package
+    file:///var/cache/x   a directory all workers on the host can reach
+    (unset)               a private in-memory cache per process; settings
+                          turn page caching off, since versions bumped in
+                          one process never reach the others
+"""
+import fcntl
+import os
+from contextlib import contextmanager
+
+from django.core.cache.backends.filebased import FileBasedCache
+
+
+class SharedFileBasedCache(FileBasedCache):
+    """
+    FileBasedCache whose add() and incr() are atomic across processes, so
+    claims, locks and version counters behave as they do on Redis.
+    """
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self._dir, exist_ok=True)
+        with open(os.path.join(self._dir, '.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def add(self, *args, **kwargs):
+        with self._locked():
+            return super().add(*args, **kwargs)
+
+    def incr(self, *args, **kwargs):
+        with self._locked():
+            return super().incr(*args, **kwargs)
+
+
+def caches_from_url(url):
+    """The CACHES setting for a CACHE_URL."""
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        default = {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': url,
+        }
+    elif url.startswith('file://'):
+        default = {
+            'BACKEND': 'config.cache_backends.SharedFileBasedCache',
+            'LOCATION': url[len('file://'):],
+        }
+    elif not url:
+        default = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    else:
+        raise ValueError(f"Unsupported CACHE_URL: {url}")
+    default['KEY_PREFIX'] = 'irent'
+    return {'default': default}
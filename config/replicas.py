@@ -0,0 +1,97 @@
+"""
+Primary/replica database routing.
+
+Every alias besides 'default' is a read replica of it, kept in sync by
+something outside Django. Reads of listing data made while serving a GET
+or HEAD go to a random replica; everything else goes to the primary:
+
+    writes, and every read after a write in the same request
+    reads inside a transaction
+    reads of other apps (sessions, users, profiles), which must never lag
+    reads outside a request (commands, image jobs)
+    every read for a session that wrote in the last REPLICA_PIN_SECONDS,
+    so a landlord sees their own edit on the very next page
+    everything inside use_primary(): renders that fill the version-keyed
+    page and API caches, which would otherwise store replica rows under
+    a version bumped on the primary and serve them for the whole timeout
+
+ReadYourWritesMiddleware tracks the request and pins the session; it must
+come after SessionMiddleware.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.deprecation import MiddlewareMixin
+
+REPLICA_APPS = {'listings'}
+DEFAULT_PIN_SECONDS = 10
+PIN_SESSION_KEY = '_primary_until'
+
+# {'replica_ok': bool, 'wrote': bool} for the request being served, else None
+_request = ContextVar('db_request', default=None)
+
+
+def replica_aliases():
+    return [alias for alias in connections if alias != DEFAULT_DB_ALIAS]
+
+
+@contextmanager
+def use_primary():
+    """Read everything from the primary inside the block."""
+    state = _request.get()
+    if state is None:
+        yield
+        return
+    replica_ok, state['replica_ok'] = state['replica_ok'], False
+    try:
+        yield
+    finally:
+        state['replica_ok'] = replica_ok
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        state = _request.get()
+        if (state is None or not state['replica_ok'] or state['wrote']
+                or model._meta.app_label not in REPLICA_APPS
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        replicas = replica_aliases()
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _request.get()
+        if state is not None:
+            state['wrote'] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReadYourWritesMiddleware(MiddlewareMixin):
+
+    def process_request(self, request):
+        pinned = request.session.get(PIN_SESSION_KEY, 0) > time.time()
+        _request.set({
+            'replica_ok': request.method in ('GET', 'HEAD') and not pinned,
+            'wrote': False,
+        })
+
+    def process_response(self, request, response):
+        state = _request.get()
+        # Only deliberate changes pin; a GET that fills a lazy cache row doesn't
+        if state and state['wrote'] and request.method not in ('GET', 'HEAD'):
+            window = getattr(settings, 'REPLICA_PIN_SECONDS', DEFAULT_PIN_SECONDS)
+            request.session[PIN_SESSION_KEY] = time.time() + window
+        _request.set(None)
+        return response
@@ -10,8 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from config.cache_backends import caches_from_url
+from config.database import sqlite_database
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -48,6 +52,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'accounts.middleware.ProfileMiddleware',
+    'config.replicas.ReadYourWritesMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -76,13 +82,35 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# WAL, tuned pragmas, BEGIN IMMEDIATE and persistent connections; see
+# config/database.py. DB_CONN_MAX_AGE=0 closes connections after each request.
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': sqlite_database(BASE_DIR / 'db.sqlite3'),
 }
 
+# Read replicas of the primary, kept in sync outside Django (e.g. litestream):
+# DB_REPLICAS=/srv/irent/replica1.sqlite3,/srv/irent/replica2.sqlite3
+for number, path in enumerate(filter(None, os.environ.get('DB_REPLICAS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = sqlite_database(path)
+
+# Listing reads go to the replicas; see config/replicas.py
+DATABASE_ROUTERS = ['config.replicas.PrimaryReplicaRouter']
+REPLICA_PIN_SECONDS = 10
+
+# One cache shared by every worker: CACHE_URL=redis://localhost:6379/0 or
+# file:///var/tmp/irent_cache. Unset, each process keeps its own, and page
+# caching (PAGE_CACHE_TIMEOUT below) is off: a listing saved in another
+# worker or in process_images couldn't expire the pages this one cached.
+CACHE_URL = os.environ.get('CACHE_URL', '')
+CACHES = caches_from_url(CACHE_URL)
+
+
+# Loads the profile along with the user (request.profile, user.profile).
+# ModelBackend stays listed so sessions it logged in keep working.
+AUTHENTICATION_BACKENDS = [
+    'accounts.backends.ProfileBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -131,4 +159,30 @@ EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
 # uploaded files
 MEDIA_URL = '/media/'
-MEDIA_ROOT = BASE_DIR / 'media'
\ No newline at end of file
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Optional ESRGAN-lite style ONNX model (needs onnxruntime + numpy) used to
+# upscale small uploads; without it they are upscaled with LANCZOS
+UPSCALE_MODEL = os.environ.get('UPSCALE_MODEL') or None
+
+# On-demand thumbnails (/media/thumb/<hash>/<w>x<h>.<fmt>), cached under
+# THUMBNAIL_CACHE_DIR (default MEDIA_ROOT/thumb_cache). Only these boxes are
+# served; add one here before using it in a template
+THUMBNAIL_SIZES = [(160, 160), (360, 360), (720, 720), (1200, 1200)]
+THUMBNAIL_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# clamd Unix socket used to scan uploads (falls back to a header check if down)
+CLAMD_SOCKET = os.environ.get('CLAMD_SOCKET', '/var/run/clamav/clamd.ctl')
+
+# listing grids (home, my properties, monitor) are keyset-paginated
+LISTINGS_PAGE_SIZE = 24
+
+# Rendered home/detail/about pages are cached this long (seconds); signals
+# expire them as soon as a listing changes. 0 turns page caching off, as it
+# is without a shared CACHE_URL (see CACHES).
+PAGE_CACHE_TIMEOUT = 60 * 10 if CACHE_URL else 0
+
+# The listings API (/api/v1/) is public, read-only JSON
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': ['rest_framework.renderers.JSONRenderer'],
+}
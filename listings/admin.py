@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Property, PropertyImage
+from .models import ImageBlob, ImageJob, Property, PropertyImage, QueuedMail
+from .page_cache import touch_listing
 
 class PropertyImageInline(admin.TabularInline):
     model = PropertyImage
@@ -10,4 +11,31 @@ class PropertyAdmin(admin.ModelAdmin):
     list_display = ('title', 'location', 'price', 'bedrooms', 'available', 'created_at')
     list_filter = ('available', 'bedrooms', 'created_at')
     search_fields = ('title', 'location', 'owner_name')
-    inlines = [PropertyImageInline]
\ No newline at end of file
+    inlines = [PropertyImageInline]
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        form.instance.refresh_cover_image()
+        touch_listing(form.instance.pk)
+
+
+@admin.register(ImageJob)
+class ImageJobAdmin(admin.ModelAdmin):
+    list_display = ('property', 'status', 'attempts', 'created_at', 'updated_at')
+    list_filter = ('status',)
+    readonly_fields = ('created_at', 'updated_at')
+
+
+@admin.register(QueuedMail)
+class QueuedMailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'status', 'attempts', 'send_after', 'created_at')
+    list_filter = ('status',)
+    readonly_fields = ('created_at', 'updated_at')
+
+
+@admin.register(ImageBlob)
+class ImageBlobAdmin(admin.ModelAdmin):
+    list_display = ('hash', 'ref_count', 'near_duplicate_of', 'created_at')
+    list_filter = (('near_duplicate_of', admin.EmptyFieldListFilter),)
+    search_fields = ('hash',)
+    readonly_fields = ('hash', 'ref_count', 'near_duplicate_of', 'created_at')
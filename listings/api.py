@@ -0,0 +1,110 @@
+# api.py
+"""
+Read-only JSON API (v1) for listings and their photos.
+
+Responses carry an ETag built from the per-row Property.version, and a
+matching If-None-Match gets a 304 before anything is serialised. A
+single listing's version is one indexed lookup, and its ETag keys a cache
+of serialised payloads. Whole pages are cached under the shared listings
+version (bumped on any listing change), so a repeated page costs no query.
+Both read the primary database, never a replica that may not have caught
+up with the version yet.
+"""
+import hashlib
+
+from django.http import Http404
+from django.utils.cache import get_conditional_response
+from rest_framework import viewsets
+from rest_framework.pagination import CursorPagination
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+
+from config.replicas import use_primary
+from .cache_utils import get_or_compute
+from .models import Property
+from .page_cache import listings_version
+from .pagination import get_page_size
+from .serializers import PropertyDetailSerializer, PropertySerializer, requested_fields
+
+API_VERSION = 'v1'
+PAYLOAD_TIMEOUT = 60 * 10
+
+
+def _etag(*parts):
+    digest = hashlib.sha1(repr((API_VERSION, *parts)).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+class PropertyCursorPagination(CursorPagination):
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_page_size(self, request):
+        self.page_size = get_page_size()
+        return super().get_page_size(request)
+
+
+class PropertyViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    GET /api/v1/properties/       available listings, newest first
+    GET /api/v1/properties/<id>/  one listing with all of its photos
+
+    ?fields=id,title,price returns only those fields (and skips the joins
+    the others would need).
+    """
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    pagination_class = PropertyCursorPagination
+    lookup_value_regex = r'\d+'
+
+    def get_serializer_class(self):
+        return PropertyDetailSerializer if self.action == 'retrieve' else PropertySerializer
+
+    def get_queryset(self):
+        wanted = requested_fields(self.request)
+        if self.action == 'retrieve':
+            qs = Property.objects.all()
+            if wanted is None or 'images' in wanted:
+                qs = qs.prefetch_related('images')
+        else:
+            qs = Property.objects.filter(available=True).defer('description')
+        if wanted is None or 'cover_image' in wanted:
+            qs = qs.select_related('cover_image')
+        return qs
+
+    def _render_page(self):
+        page = self.paginate_queryset(self.get_queryset())
+        payload = {
+            'next': self.paginator.get_next_link(),
+            'previous': self.paginator.get_previous_link(),
+            'results': self.get_serializer(page, many=True).data,
+        }
+        return _etag(self.request.build_absolute_uri(), [(p.pk, p.version) for p in page]), payload
+
+    def list(self, request, *args, **kwargs):
+        # The URL includes the cursor, ?fields= and (links being absolute) the host
+        key = _etag(request.build_absolute_uri(), listings_version())
+        with use_primary():
+            etag, payload = get_or_compute(f'api_page_{key}', self._render_page, PAYLOAD_TIMEOUT)
+        response = get_conditional_response(request, etag=etag) or Response(payload)
+        response['ETag'] = etag
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        with use_primary():
+            return self._retrieve(request, kwargs['pk'])
+
+    def _retrieve(self, request, pk):
+        version = Property.objects.filter(pk=pk).values_list('version', flat=True).first()
+        if version is None:
+            raise Http404("No such listing.")
+        # Image URLs are absolute, so the host is part of the representation
+        etag = _etag(request.build_absolute_uri('/'), request.query_params.get('fields'), pk, version)
+        response = get_conditional_response(request, etag=etag) or Response(
+            get_or_compute(f'api_listing_{etag}', lambda: self.get_serializer(self.get_object()).data,
+                           PAYLOAD_TIMEOUT)
+        )
+        response['ETag'] = etag
+        return response
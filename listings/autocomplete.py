@@ -0,0 +1,162 @@
+# autocomplete.py
+"""
+Location suggestions from an in-process prefix trie.
+
+Every known location (gazetteer plus listed locations) is inserted under
+the start of each of its words, so "riv" finds "Athi River". Each node keeps
+its best MAX_SUGGESTIONS locations by listing count, so a lookup is a walk
+down the prefix and nothing more. Property signals apply count changes
+in place and bump a shared version, which tells other processes to rebuild.
+"""
+import threading
+from itertools import chain
+
+from django.core.cache import cache
+from django.db.models import Count, Min
+
+from .gazetteer import KENYA_LOCATIONS
+from .models import Property, normalize_location
+
+MAX_SUGGESTIONS = 8
+VERSION_CACHE_KEY = 'location_trie_version'
+
+
+class _Node:
+    __slots__ = ('children', 'keys', 'top')
+
+    def __init__(self):
+        self.children = {}
+        # Locations whose word starts end exactly here
+        self.keys = set()
+        # Best [(-count, name_key)] in this subtree
+        self.top = []
+
+
+class LocationTrie:
+
+    def __init__(self, limit=MAX_SUGGESTIONS):
+        self.limit = limit
+        self.root = _Node()
+        self.counts = {}
+        self.names = {}
+
+    @staticmethod
+    def _prefixes(key):
+        """Every word start of key: 'athi river' -> 'athi river', 'river'."""
+        words = key.split(' ')
+        return [' '.join(words[i:]) for i in range(len(words))]
+
+    def _rank(self, key):
+        return (-self.counts[key], key)
+
+    def _recompute(self, node):
+        candidates = {key for key in node.keys}
+        for child in node.children.values():
+            candidates.update(key for _, key in child.top)
+        node.top = sorted(self._rank(key) for key in candidates)[:self.limit]
+
+    def _update_paths(self, key):
+        for suffix in self._prefixes(key):
+            path = [self.root]
+            for char in suffix:
+                path.append(path[-1].children.setdefault(char, _Node()))
+            path[-1].keys.add(key)
+            for node in reversed(path):
+                self._recompute(node)
+
+    def set(self, key, name, count):
+        """Insert key or change its listing count."""
+        if not key:
+            return
+        self.names.setdefault(key, name)
+        self.counts[key] = max(count, 0)
+        self._update_paths(key)
+
+    def load(self, items):
+        """
+        Insert or update many (key, name, count) at once. Each node is ranked
+        once at the end, rather than every path on every insert as with set().
+        """
+        for key, name, count in items:
+            if not key:
+                continue
+            self.names.setdefault(key, name)
+            self.counts[key] = max(count, 0)
+            for suffix in self._prefixes(key):
+                node = self.root
+                for char in suffix:
+                    node = node.children.setdefault(char, _Node())
+                node.keys.add(key)
+        # Children before their parents
+        nodes, stack = [], [self.root]
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            stack.extend(node.children.values())
+        for node in reversed(nodes):
+            self._recompute(node)
+
+    def add(self, key, name, delta):
+        self.set(key, name, self.counts.get(key, 0) + delta)
+
+    def suggest(self, prefix):
+        """[(name, count), ...] for locations with a word starting with prefix."""
+        node = self.root
+        for char in normalize_location(prefix):
+            node = node.children.get(char)
+            if node is None:
+                return []
+        return [(self.names[key], self.counts[key]) for _, key in node.top]
+
+
+class LocationIndex:
+    """Process-wide trie, rebuilt when another process reports a change."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._trie = None
+        self._version = None
+
+    def _build(self):
+        trie = LocationTrie()
+        rows = (Property.objects.filter(available=True).values('location_key')
+                .annotate(n=Count('id'), name=Min('location')).values_list('location_key', 'name', 'n'))
+        trie.load(chain(((normalize_location(name), name, 0) for name in KENYA_LOCATIONS), rows))
+        return trie
+
+    def _is_current(self):
+        return self._trie is not None and cache.get_or_set(VERSION_CACHE_KEY, 0, None) == self._version
+
+    def suggest(self, prefix):
+        with self._lock:
+            if not self._is_current():
+                self._version = cache.get_or_set(VERSION_CACHE_KEY, 0, None)
+                self._trie = self._build()
+            return self._trie.suggest(prefix)
+
+    def apply(self, changes):
+        """
+        Apply [(location_key, name, delta), ...] for a change already
+        committed to the database, and flag other processes to rebuild.
+        """
+        with self._lock:
+            current = self._is_current()
+            if current:
+                for key, name, delta in changes:
+                    self._trie.add(key, name, delta)
+            try:
+                version = cache.incr(VERSION_CACHE_KEY)
+            except ValueError:
+                cache.set(VERSION_CACHE_KEY, 0, None)
+                version = None
+            if current and version == self._version + 1:
+                self._version = version
+            else:
+                # Stale or raced with another process: rebuild on next use
+                self._trie = None
+
+
+location_index = LocationIndex()
@@ -0,0 +1,85 @@
+# blobs.py
+"""
+Shared, reference-counted storage for encoded image variants.
+
+Every PropertyImage made from the same source file points at one ImageBlob,
+so identical uploads reuse the stored variants instead of re-encoding and
+re-storing them. Blobs whose last reference goes away are deleted together
+with their files.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F, ProtectedError
+
+from .cache_utils import release_hash
+from .models import ImageBlob, PropertyImage
+from .phash_utils import to_signed
+from .thumbnails import get_thumbnail_cache
+
+VARIANTS = ('desktop', 'mobile', 'webp', 'avif')
+DIMENSIONS = ('width', 'height', 'mobile_width', 'mobile_height')
+
+
+def store_blob(processed, original=''):
+    """
+    Save freshly encoded variants as a blob. If another worker stored the
+    same hash first, drop our copies and return its blob instead.
+
+    original is the storage name of the uploaded source file, kept so
+    thumbnails can be rendered from it later.
+    """
+    img_hash = processed["hash"]
+    blob = ImageBlob(hash=img_hash, original=original, **{v: processed.get(v) or '' for v in VARIANTS})
+    for field in DIMENSIONS:
+        setattr(blob, field, processed.get(field))
+    if processed.get("dhash") is not None:
+        blob.dhash = to_signed(processed["dhash"])
+    if processed.get("near_duplicate_of"):
+        blob.near_duplicate_of = ImageBlob.objects.filter(hash=processed["near_duplicate_of"]).first()
+    try:
+        with transaction.atomic():
+            blob.save()
+    except IntegrityError:
+        for variant in VARIANTS:
+            getattr(blob, variant).delete(save=False)
+        blob = ImageBlob.objects.get(hash=img_hash)
+    release_hash(img_hash)
+    return blob
+
+
+def attach_blob(prop, blob):
+    """Create the PropertyImage for prop that shares blob's files."""
+    with transaction.atomic():
+        image = PropertyImage.objects.create(
+            property=prop, blob=blob,
+            image=blob.desktop.name, mobile=blob.mobile.name, webp=blob.webp.name, avif=blob.avif.name,
+            **{field: getattr(blob, field) for field in DIMENSIONS},
+        )
+        ImageBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+    return image
+
+
+def release_blob(blob_id):
+    """Drop one reference; the blob is collected once the transaction commits."""
+    ImageBlob.objects.filter(pk=blob_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+    transaction.on_commit(lambda: collect_garbage([blob_id]))
+
+
+def collect_garbage(blob_ids=None):
+    """Delete unreferenced blobs and their files; returns how many were removed."""
+    blobs = ImageBlob.objects.filter(ref_count=0)
+    if blob_ids is not None:
+        blobs = blobs.filter(pk__in=blob_ids)
+
+    removed = 0
+    for blob in blobs:
+        try:
+            with transaction.atomic():
+                # PROTECT stops us if an upload attached to it in the meantime
+                blob.delete()
+        except ProtectedError:
+            continue
+        for variant in VARIANTS + ('original',):
+            getattr(blob, variant).delete(save=False)
+        get_thumbnail_cache().discard(blob.hash)
+        removed += 1
+    return removed
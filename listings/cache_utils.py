@@ -1,18 +1,121 @@
 # cache_utils.py
-import hashlib
-from django.core.cache import cache
+import asyncio
+import math
+import random
+import time
 
-HASH_TIMEOUT = 60 * 60 * 24 * 7  # 7 days
+from django.core.cache import cache
 
-def get_image_hash(file):
-    hasher = hashlib.sha256()
-    for chunk in file.chunks():
-        hasher.update(chunk)
-    file.seek(0)
-    return hasher.hexdigest()
+# In-flight claims only need to outlive one pipeline run; the persistent
+# dedup index is the ImageBlob table. Keep this below jobs.STALE_AFTER, so
+# a job requeued after its worker crashed never finds its own claim.
+CLAIM_TIMEOUT = 60 * 5  # 5 minutes
+# Face boxes depend only on the file's content
+FACE_BOXES_TIMEOUT = 60 * 60 * 24 * 30  # 30 days
+# get_or_compute: a computation holds its lock at most this long, waiters
+# poll this often, and a higher beta refreshes values earlier
+COMPUTE_LOCK_TIMEOUT = 30
+COMPUTE_POLL_INTERVAL = 0.05
+EARLY_EXPIRY_BETA = 1.0
 
 def check_hash_exists(image_hash):
-    return cache.get(f"img_hash_{image_hash}") is not None
+    from .models import ImageBlob
+    return ImageBlob.objects.filter(hash=image_hash).exists()
+
+def claim_hash(image_hash):
+    """Atomically reserve a hash; False if another upload is already encoding it."""
+    return cache.add(f"img_hash_{image_hash}", True, CLAIM_TIMEOUT)
+
+def release_hash(image_hash):
+    cache.delete(f"img_hash_{image_hash}")
+
+def get_face_boxes(image_hash):
+    """Cached face boxes for a file, or None if it hasn't been through detection."""
+    return cache.get(f"img_faces_{image_hash}")
+
+def set_face_boxes(image_hash, boxes):
+    cache.set(f"img_faces_{image_hash}", boxes, FACE_BOXES_TIMEOUT)
+
+
+def _store_computed(backend, key, compute, timeout):
+    started = time.monotonic()
+    value = compute()
+    took = time.monotonic() - started
+    backend.set(key, (value, took, time.time() + timeout), timeout)
+    return value
+
+
+def _is_fresh(entry, beta):
+    _, took, expires_at = entry
+    # -log(u) for u in (0, 1]: usually small, occasionally large
+    return time.time() - took * beta * math.log(1.0 - random.random()) < expires_at
+
+
+def get_or_compute(key, compute, timeout, beta=EARLY_EXPIRY_BETA,
+                   lock_timeout=COMPUTE_LOCK_TIMEOUT, backend=None):
+    """
+    The cached value for key, calling compute() to fill it in when missing.
+
+    Only one caller at a time computes a key, across every worker sharing
+    the cache; the rest wait for its result instead of all recomputing it.
+    Before the value expires, callers start refreshing it early at random,
+    sooner the slower compute() was (XFetch), so a popular key is usually
+    recomputed by one caller while everyone else still gets the old value.
+    """
+    backend = backend or cache
+    lock_key = f"compute_lock_{key}"
+    entry = backend.get(key)
+    if entry is not None:
+        if _is_fresh(entry, beta):
+            return entry[0]
+        if not backend.add(lock_key, True, lock_timeout):
+            return entry[0]  # someone else is already refreshing it
+    else:
+        deadline = time.monotonic() + lock_timeout
+        while not backend.add(lock_key, True, lock_timeout):
+            if time.monotonic() >= deadline:
+                break  # the holder died; compute it ourselves
+            time.sleep(COMPUTE_POLL_INTERVAL)
+            entry = backend.get(key)
+            if entry is not None:
+                return entry[0]
+    try:
+        return _store_computed(backend, key, compute, timeout)
+    finally:
+        backend.delete(lock_key)
+
+
+async def aget_or_compute(key, compute, timeout, beta=EARLY_EXPIRY_BETA,
+                          lock_timeout=COMPUTE_LOCK_TIMEOUT, backend=None):
+    """get_or_compute() for async callers: compute is a coroutine function."""
+    backend = backend or cache
+    lock_key = f"compute_lock_{key}"
+    entry = await backend.aget(key)
+    if entry is not None:
+        if _is_fresh(entry, beta):
+            return entry[0]
+        if not await backend.aadd(lock_key, True, lock_timeout):
+            return entry[0]
+    else:
+        deadline = time.monotonic() + lock_timeout
+        while not await backend.aadd(lock_key, True, lock_timeout):
+            if time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(COMPUTE_POLL_INTERVAL)
+            entry = await backend.aget(key)
+            if entry is not None:
+                return entry[0]
+    try:
+        started = time.monotonic()
+        value = await compute()
+        took = time.monotonic() - started
+        await backend.aset(key, (value, took, time.time() + timeout), timeout)
+        return value
+    finally:
+        await backend.adelete(lock_key)
+
 
-def store_hash(image_hash):
-    cache.set(f"img_hash_{image_hash}", True, HASH_TIMEOUT)
+def get_computed(key, default=None, backend=None):
+    """The value get_or_compute() cached for key, without computing it."""
+    entry = (backend or cache).get(key)
+    return default if entry is None else entry[0]
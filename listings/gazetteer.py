@@ -0,0 +1,12 @@
+# gazetteer.py
+"""Known towns and neighbourhoods offered as search locations."""
+
+KENYA_LOCATIONS = [
+    'Nairobi', 'Mombasa', 'Kisumu', 'Nakuru', 'Eldoret', 'Thika', 'Malindi', 'Kitale',
+    'Garissa', 'Kakamega', 'Meru', 'Nyeri', 'Kericho', 'Naivasha', 'Kilifi', 'Machakos',
+    'Bungoma', 'Embu', 'Kisii', 'Nanyuki', 'Kitui', 'Voi', 'Kapenguria', 'Moyale',
+    'Narok', 'Ruiru', 'Kiambu', 'Karen', 'Westlands', 'Kasarani', 'Embakasi', 'South C',
+    'South B', 'Langata', 'Eastleigh', 'Ngong', 'Limuru', 'Athi River', 'Kangundo Road',
+    'Utawala', 'Syokimau', 'Mlolongo', 'Kitengela', 'Rongai', 'Juja', 'Kahawa',
+    'Githurai', 'Kikuyu', 'Runda', 'Muthaiga', 'Lavington', 'Kilimani', 'Parklands',
+]
@@ -1,13 +1,52 @@
 # html_utils.py
+from django.utils.html import format_html
 
-def build_picture_tag(image_obj):
-    """
-    Generates <picture> tag using WebP, mobile JPG & desktop JPG.
+# Viewports at or below this width get the mobile JPEG
+MOBILE_BREAKPOINT = 768
+
+
+def _size_attrs(width, height):
+    if width and height:
+        return format_html(' width="{}" height="{}"', width, height)
+    return ""
+
+
+def build_picture_tag(image_obj, sizes="100vw", alt="Property image", css_class=""):
     """
-    return f"""
-    <picture>
-        <source srcset="{image_obj.webp.url}" type="image/webp">
-        <source srcset="{image_obj.mobile.url}" media="(max-width: 768px)">
-        <img src="{image_obj.desktop.url}" alt="Property image" loading="lazy">
-    </picture>
+    Generates <picture> tag using mobile JPG, AVIF, WebP & desktop JPG.
+
+    Small screens take the mobile source before the AVIF/WebP ones, so phones never
+    fetch the desktop-sized file. Explicit dimensions let the browser reserve
+    space before the lazily loaded image arrives. Images without variants
+    (e.g. uploaded through the admin) fall back to a plain <img>.
     """
+    desktop = image_obj.image
+    img_attrs = _size_attrs(image_obj.width, image_obj.height)
+
+    if not (image_obj.mobile and image_obj.webp):
+        return format_html(
+            '<img src="{}" class="{}" alt="{}"{} loading="lazy" decoding="async">',
+            desktop.url, css_class, alt, img_attrs,
+        )
+
+    srcset = format_html("{} {}w", image_obj.mobile.url, image_obj.mobile_width) if image_obj.mobile_width else ""
+    if srcset and (image_obj.width or 0) > image_obj.mobile_width:
+        srcset = format_html("{}, {} {}w", srcset, desktop.url, image_obj.width)
+    srcset_attr = format_html(' srcset="{}" sizes="{}"', srcset, sizes) if srcset else ""
+    avif_source = ""
+    if getattr(image_obj, "avif", None):
+        avif_source = format_html('<source type="image/avif" srcset="{}"{}>', image_obj.avif.url, img_attrs)
+
+    return format_html(
+        '<picture>'
+        '<source media="(max-width: {}px)" srcset="{}"{}>'
+        '{}'
+        '<source type="image/webp" srcset="{}"{}>'
+        '<img src="{}"{} class="{}" alt="{}"{} loading="lazy" decoding="async">'
+        '</picture>',
+        MOBILE_BREAKPOINT, image_obj.mobile.url,
+        _size_attrs(image_obj.mobile_width, image_obj.mobile_height),
+        avif_source,
+        image_obj.webp.url, img_attrs,
+        desktop.url, srcset_attr, css_class, alt, img_attrs,
+    )
@@ -1,113 +1,505 @@
-from PIL import Image, ImageEnhance
+# image_utils.py
+from PIL import Image, ImageEnhance, features
 from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from django.conf import settings
 from django.core.files import File
 import os
 import warnings
 
+# Local imports
+from .ingest_utils import ingest_upload, open_mapped
+from .cache_utils import check_hash_exists, claim_hash, get_face_boxes, release_hash, set_face_boxes
+from .upscale_utils import ai_upscale, get_upscaler
+from .phash_utils import MultiIndexHash, NEAR_DUPLICATE_DISTANCE, dhash, perceptual_index
+from .quality_utils import SSIMReference, ssim
+
+
 try:
     import face_recognition
+    import numpy
     FACE_LIB_AVAILABLE = True
 except ImportError:
     FACE_LIB_AVAILABLE = False
 
+try:
+    import pillow_avif  # noqa: F401  (registers AVIF on Pillow < 11.2)
+except ImportError:
+    pass
+AVIF_AVAILABLE = features.check("avif")
+
+
+DEFAULT_OPTIONS = {
+    "max_width": 1200,
+    "max_height": 1200,
+    "mobile_width": 720,
+    "mobile_height": 720,
+    # Fixed qualities: used as-is when the matching *_ssim target is None,
+    # otherwise the ceiling of the quality search
+    "jpeg_quality": 85,
+    "mobile_quality": 65,
+    "webp_quality": 70,
+    "avif_quality": 55,
+    # Each variant gets the lowest quality, up to its fixed one, whose SSIM
+    # meets its target
+    "desktop_ssim": 0.985,
+    "mobile_ssim": 0.975,
+    "avif": True,
+    "enhance_sharpness": True,
+    "use_face_preserve_crop": True,
+    # Known face boxes for this file (see detect_faces); None runs detection
+    "face_boxes": None,
+    "use_ai_upscale": True,
+    # ONNX super-resolution model; None upscales with LANCZOS
+    "upscale_model": None,
+}
+
+
+# A dHash match is confirmed on copies this size: at or above
+# NEAR_DUPLICATE_SSIM it is the same photo, not just the same layout
+COMPARE_SIZE = 512
+NEAR_DUPLICATE_SSIM = 0.9
+
+
+def _compare_copy(fp):
+    img = _decode_near(fp, (COMPARE_SIZE, COMPARE_SIZE)).convert("RGB")
+    img.thumbnail((COMPARE_SIZE, COMPARE_SIZE), Image.BILINEAR)
+    return img
+
 
-def resize_and_optimize_image(
-    image_file,
-    max_width=1200,
-    max_height=1200,
-    mobile_width=720,
-    mobile_height=720,
-    jpeg_quality=85,
-    mobile_quality=65,
-    webp_quality=70,
-    max_file_size_mb=8,
-    enhance_sharpness=True,
-    use_face_preserve_crop=True
-):
+def _upload_copy(upload):
+    with open_mapped(upload.path) as mapped:
+        return _compare_copy(mapped)
+
+
+def same_photo(a, b):
+    """Whether two compare copies show the same photo (crops never do)."""
+    if abs(a.width / a.height - b.width / b.height) > 0.02:
+        return False
+    return ssim(a, b) >= NEAR_DUPLICATE_SSIM
+
+
+def _near_duplicate_of(upload, img_dhash):
+    """Hash of the stored blob this upload is a resized/recompressed copy of, or None."""
+    similar = perceptual_index.nearest(img_dhash)
+    if similar is None:
+        return None
+    try:
+        with (similar.original or similar.desktop).open("rb") as f:
+            stored = _compare_copy(f)
+    except (OSError, ValueError):
+        return None
+    return similar.hash if same_photo(_upload_copy(upload), stored) else None
+
+
+def _check_upload(image_file, max_file_size_mb):
     """
-    Full image optimization pipeline:
-    - oversize file warning
-    - desktop JPG
-    - mobile JPG
-    - WebP
-    - optional face-preserving crop
-    - sharpness improvement
+    Steps that must see every upload in order: scan, hash and size check.
+    Returns (rejection, info); rejection is a result dict or None and info
+    holds the spooled upload, dhash, near-duplicate and warning for an
+    accepted upload.
     """
 
+    # ===========================
+    # 1. MALWARE SCANNING + HASH (one streaming pass)
+    # ===========================
+    upload = ingest_upload(image_file)
+    if upload.scan_result is not True:
+        upload.cleanup()
+        return {"error": upload.scan_result}, None  # Return malware reason
+
+    # ===========================
+    # 2. DEDUPLICATION
+    # ===========================
+    img_hash = upload.sha256
+
+    # Already stored, or being encoded by another upload right now: the
+    # caller reuses the blob instead of re-encoding (waiting for it if it
+    # isn't stored yet). Claiming is atomic, so concurrent workers can't
+    # both encode one image.
+    if check_hash_exists(img_hash) or not claim_hash(img_hash):
+        upload.cleanup()
+        return {"duplicate": True, "hash": img_hash}, None
+
+    # Resized / recompressed copies of a stored photo hash within a few bits.
+    # They are still encoded: the copy may belong to another listing, so the
+    # caller decides whether to reuse or just flag it.
+    try:
+        with open_mapped(upload.path) as mapped:
+            img_dhash = dhash(Image.open(mapped))
+    except Exception:
+        upload.cleanup()
+        release_hash(img_hash)
+        return {"error": "Unsupported or corrupt image file.", "hash": img_hash}, None
+    try:
+        near_duplicate_of = _near_duplicate_of(upload, img_dhash)
+    except BaseException:
+        upload.cleanup()
+        release_hash(img_hash)
+        raise
+
+    # ===========================
+    # 3. FILE SIZE CHECK
+    # ===========================
+    size_mb = upload.size / (1024 * 1024)
     warning = None
 
-    # --- 1. Oversized file warning ---
-    size_mb = image_file.size / (1024 * 1024)
     if size_mb > max_file_size_mb:
-        warning = (
-            f"Image is {size_mb:.2f}MB — exceeds recommended {max_file_size_mb}MB. "
-            "It has been compressed."
-        )
+        warning = f"Image is {size_mb:.2f}MB — will be compressed."
 
-    # --- 2. Load image ---
-    img = Image.open(image_file)
+    return None, {"upload": upload, "hash": img_hash, "dhash": img_dhash,
+                  "near_duplicate_of": near_duplicate_of, "warning": warning}
 
-    if img.mode in ("RGBA", "P"):
+
+@contextmanager
+def _open_source(source):
+    """render_variants accepts raw bytes or the path of a spooled upload."""
+    if isinstance(source, (bytes, bytearray)):
+        yield BytesIO(source)
+    else:
+        with open_mapped(source) as mapped:
+            yield mapped
+
+
+def _decode_near(fp, size):
+    """
+    Decode straight to near the size the image will have once fitted in
+    the size box, instead of at full resolution.
+
+    JPEGs use draft() so libjpeg does the DCT-domain downscale while decoding;
+    other formats are shrunk with a cheap integer reduce(). Both stop at or
+    above the fitted size (below twice it), so the final LANCZOS pass only
+    ever shrinks.
+    """
+    img = Image.open(fp)
+    scale = min(size[0] / img.width, size[1] / img.height)
+    if scale >= 1:
+        img.load()
+        return img
+    # draft() only scales down while both sides stay at or above the request,
+    # so ask for the fitted size rather than the (square) box
+    fitted = (max(round(img.width * scale), 1), max(round(img.height * scale), 1))
+    img.draft("RGB", fitted)
+    img.load()
+
+    factor = int(min(img.width / fitted[0], img.height / fitted[1]))
+    if factor >= 2:
+        img = img.reduce(factor)
+    return img
+
+
+def _flatten(img):
+    """RGB copy of img, with any transparency composited onto white."""
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
         rgb = Image.new("RGB", img.size, (255, 255, 255))
-        rgb.paste(img, mask=img.split()[-1] if img.mode == "RGBA" else None)
-        img = rgb
+        rgb.paste(img, mask=img.split()[-1])
+        return rgb
+    if img.mode != "RGB":
+        return img.convert("RGB")
+    return img
 
-    # --- 3. Face-aware cropping ---
-    if use_face_preserve_crop and FACE_LIB_AVAILABLE:
-        try:
-            import face_recognition
-            raw_img = face_recognition.load_image_file(image_file)
-            faces = face_recognition.face_locations(raw_img)
-
-            if faces:
-                top, right, bottom, left = faces[0]
-                padding = 200
-                left = max(left - padding, 0)
-                top = max(top - padding, 0)
-                right = min(right + padding, img.width)
-                bottom = min(bottom + padding, img.height)
-                img = img.crop((left, top, right, bottom))
 
-        except Exception:
-            warnings.warn("Face detection failed; continuing without crop.")
+# Detection runs on a copy no larger than this; HOG cost grows with pixel count
+FACE_DETECT_SIZE = 480
 
-    # --- 4. Sharpness enhancement ---
-    if enhance_sharpness:
-        enhancer = ImageEnhance.Sharpness(img)
-        img = enhancer.enhance(1.25)
 
-    base_name, _ = os.path.splitext(image_file.name)
+def detect_faces(img):
+    """
+    Find faces on a downscaled copy of an already decoded image.
+
+    Returns [(top, right, bottom, left), ...] as fractions of the image size,
+    so the boxes apply at any scale the image is later resized to.
+    """
+    small = img.convert("RGB")
+    small.thumbnail((FACE_DETECT_SIZE, FACE_DETECT_SIZE), Image.BILINEAR)
+    width, height = small.size
+    return [
+        (top / height, right / width, bottom / height, left / width)
+        for top, right, bottom, left in face_recognition.face_locations(numpy.asarray(small))
+    ]
+
+
+def _face_crop(img, boxes):
+    """Crop img around the first face, keeping one face-size of margin on each side."""
+    top, right, bottom, left = boxes[0]
+    pad_x, pad_y = (right - left) * img.width, (bottom - top) * img.height
+    return img.crop((
+        max(round(left * img.width - pad_x), 0),
+        max(round(top * img.height - pad_y), 0),
+        min(round(right * img.width + pad_x), img.width),
+        min(round(bottom * img.height + pad_y), img.height),
+    ))
 
-    # --- 5. Desktop version ---
-    desktop_img = img.copy()
-    desktop_img.thumbnail((max_width, max_height), Image.LANCZOS)
 
-    desktop_io = BytesIO()
-    desktop_img.save(desktop_io, "JPEG", quality=jpeg_quality)
-    desktop_io.seek(0)
+def _sharpen(img, enabled):
+    return ImageEnhance.Sharpness(img).enhance(1.25) if enabled else img
 
-    desktop_file = File(desktop_io, name=f"{base_name}_desktop.jpg")
 
-    # --- 6. Mobile version ---
-    mobile_img = img.copy()
-    mobile_img.thumbnail((mobile_width, mobile_height), Image.LANCZOS)
+MIN_QUALITY = 40
 
-    mobile_io = BytesIO()
-    mobile_img.save(mobile_io, "JPEG", quality=mobile_quality)
-    mobile_io.seek(0)
 
-    mobile_file = File(mobile_io, name=f"{base_name}_mobile.jpg")
+def encode_image(img, fmt, quality):
+    """Encode img as JPEG (progressive, optimized Huffman tables), WEBP or AVIF."""
+    out = BytesIO()
+    if fmt == "JPEG":
+        img.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+    elif fmt == "AVIF":
+        img.save(out, "AVIF", quality=quality, speed=8)
+    else:
+        img.save(out, fmt, quality=quality)
+    return out.getvalue()
 
-    # --- 7. WebP version ---
-    webp_io = BytesIO()
-    img.save(webp_io, "WEBP", quality=webp_quality)
-    webp_io.seek(0)
 
-    webp_file = File(webp_io, name=f"{base_name}.webp")
+def encode_to_target(img, fmt, target_ssim, quality, reference=None):
+    """
+    Binary-search the smallest quality, between MIN_QUALITY and the fixed
+    quality, whose decoded output scores at least target_ssim against img.
+    Returns (data, quality). The search only ever shrinks the output: if
+    even the fixed quality misses the target, the fixed quality is used,
+    as it is with no target.
+    """
+    if target_ssim is None:
+        return encode_image(img, fmt, quality), quality
+
+    reference = reference or SSIMReference(img)
+    lo, hi = min(MIN_QUALITY, quality), quality
+    best = None
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        data = encode_image(img, fmt, mid)
+        if reference.score(Image.open(BytesIO(data))) >= target_ssim:
+            best, hi = (data, mid), mid - 1
+        else:
+            lo = mid + 1
+    # Every probe missed: the last one was the fixed quality
+    return best or (data, mid)
 
+
+def render_variants(source, options=None):
+    """
+    CPU-bound half of the pipeline: decode, upscale, crop, sharpen and encode.
+
+    source is raw bytes or the path of a spooled upload, which is decoded
+    through a memory map. Output is plain bytes, so it can run in a worker
+    process without pickling anything Django-specific. Returns
+    {desktop, mobile, webp} bytes plus the desktop and mobile pixel sizes
+    and the face boxes found (None if detection didn't run).
+
+    Sizes cascade: the source is decoded near the desktop size, the mobile
+    variant is made from the desktop one, and sharpening runs only on the
+    final outputs.
+    """
+    opts = {**DEFAULT_OPTIONS, **(options or {})}
+    desktop_size = (opts["max_width"], opts["max_height"])
+
+    # ===========================
+    # 4. LOAD IMAGE
+    # ===========================
+    with _open_source(source) as fp:
+        img = _decode_near(fp, desktop_size)
+
+    # Convert transparent PNG/WebP → white JPEG
+    img = _flatten(img)
+
+    # Detect before upscaling, on the buffer we already have
+    faces = opts["face_boxes"]
+    if faces is None and opts["use_face_preserve_crop"] and FACE_LIB_AVAILABLE:
+        try:
+            faces = detect_faces(img)
+        except Exception:
+            warnings.warn("Face detection failed. Using original image.")
+
+    # ===========================
+    # 5. OPTIONAL AI UPSCALING (only sources smaller than the desktop box)
+    # ===========================
+    if opts["use_ai_upscale"]:
+        img = ai_upscale(img, desktop_size, get_upscaler(opts["upscale_model"]))
+
+    # ===========================
+    # 6. FACE-AWARE CROPPING
+    # ===========================
+    if faces and opts["use_face_preserve_crop"]:
+        img = _face_crop(img, faces)
+
+    # ===========================
+    # 7. DESKTOP VERSION
+    # ===========================
+    desktop = img
+    desktop.thumbnail(desktop_size, Image.LANCZOS)
+    desktop_sharp = _sharpen(desktop, opts["enhance_sharpness"])
+    desktop_ref = SSIMReference(desktop_sharp) if opts["desktop_ssim"] is not None else None
+    desk_data, _ = encode_to_target(
+        desktop_sharp, "JPEG", opts["desktop_ssim"], opts["jpeg_quality"], desktop_ref
+    )
+
+    # ===========================
+    # 8. MOBILE VERSION (from desktop)
+    # ===========================
+    mobile = desktop.copy()
+    mobile.thumbnail((opts["mobile_width"], opts["mobile_height"]), Image.LANCZOS)
+    mob_data, _ = encode_to_target(
+        _sharpen(mobile, opts["enhance_sharpness"]), "JPEG", opts["mobile_ssim"], opts["mobile_quality"]
+    )
+
+    # ===========================
+    # 9. WEBP + AVIF VERSIONS (desktop size)
+    # ===========================
+    web_data, _ = encode_to_target(
+        desktop_sharp, "WEBP", opts["desktop_ssim"], opts["webp_quality"], desktop_ref
+    )
+    avif_data = b""
+    if opts["avif"] and AVIF_AVAILABLE:
+        avif_data, _ = encode_to_target(
+            desktop_sharp, "AVIF", opts["desktop_ssim"], opts["avif_quality"], desktop_ref
+        )
+        # Browsers take the AVIF source over the WebP one, so keep it only if it's smaller
+        if len(avif_data) >= len(web_data):
+            avif_data = b""
+
+    return {
+        "desktop": desk_data,
+        "mobile": mob_data,
+        "webp": web_data,
+        "avif": avif_data,
+        "sizes": {"desktop": desktop.size, "mobile": mobile.size},
+        "faces": faces,
+    }
+
+
+def _render_options(options, info):
+    return {**options, "face_boxes": get_face_boxes(info["hash"])}
+
+
+def _build_result(name, variants, info):
+    if variants["faces"] is not None:
+        set_face_boxes(info["hash"], variants["faces"])
+    base, _ = os.path.splitext(os.path.basename(name))
     return {
-        "desktop": desktop_file,
-        "mobile": mobile_file,
-        "webp": webp_file,
-        "warning": warning
+        "desktop": File(BytesIO(variants["desktop"]), name=f"{base}_desktop.jpg"),
+        "mobile": File(BytesIO(variants["mobile"]), name=f"{base}_mobile.jpg"),
+        "webp": File(BytesIO(variants["webp"]), name=f"{base}.webp"),
+        "avif": File(BytesIO(variants["avif"]), name=f"{base}.avif") if variants["avif"] else None,
+        "width": variants["sizes"]["desktop"][0],
+        "height": variants["sizes"]["desktop"][1],
+        "mobile_width": variants["sizes"]["mobile"][0],
+        "mobile_height": variants["sizes"]["mobile"][1],
+        "warning": info["warning"],
+        "duplicate": False,
+        "hash": info["hash"],
+        "dhash": info["dhash"],
+        "near_duplicate_of": info["near_duplicate_of"],
     }
+
+
+def _with_settings(options):
+    # Worker processes may not have Django configured, so settings are
+    # resolved here and passed along as plain options
+    return {"upscale_model": getattr(settings, "UPSCALE_MODEL", None), **options}
+
+
+def resize_and_optimize_image(image_file, max_file_size_mb=8, **options):
+    """
+    FULL FEATURED image pipeline:
+    --------------------------------
+    ✔ Virus scanning
+    ✔ Detect duplicates (hash) and flag near-duplicates (dHash + SSIM)
+    ✔ Optional tiled AI-upscale for sources smaller than the output
+    ✔ Face-aware smart cropping
+    ✔ Desktop JPG + mobile JPG + WebP (+ AVIF) output, each at the lowest
+      quality meeting its SSIM target
+    ✔ Sharpness enhancement
+    ✔ Oversize file warnings
+    ✔ Returns: {desktop, mobile, webp, avif, width, height, duplicate,
+      near_duplicate_of, warning}
+
+    Keyword options override DEFAULT_OPTIONS (sizes, qualities, feature flags).
+    """
+    options = _with_settings(options)
+    rejection, info = _check_upload(image_file, max_file_size_mb)
+    if rejection is not None:
+        return rejection
+
+    try:
+        variants = render_variants(info["upload"].path, _render_options(options, info))
+    except Exception:
+        release_hash(info["hash"])
+        raise
+    finally:
+        info["upload"].cleanup()
+    return _build_result(image_file.name, variants, info)
+
+
+def process_images_batch(files, workers=None, max_file_size_mb=8, **options):
+    """
+    Run the pipeline over several files, spreading the CPU-bound stages
+    across a process pool. Returns one result dict per file, in order.
+
+    Scanning, hashing and the duplicate check stay in this process and run
+    before anything is dispatched. Hashes are claimed atomically, so two
+    identical files (in one batch or in concurrent workers sharing the
+    cache) are never both encoded. Near-duplicates within the batch are
+    encoded too (the earlier file may yet fail) and flagged.
+    """
+    options = _with_settings(options)
+    results = [None] * len(files)
+    pending = {}
+    try:
+        _run_batch(files, workers, max_file_size_mb, options, results, pending)
+    except BaseException:
+        # Release the claims of files that never got a result, so another
+        # upload of the same file (or this job's retry) isn't left waiting
+        for i, info in pending.items():
+            if results[i] is None:
+                release_hash(info["hash"])
+                info["upload"].cleanup()
+        raise
+    return results
+
+
+def _run_batch(files, workers, max_file_size_mb, options, results, pending):
+    """process_images_batch(), filling in results and pending as it goes."""
+    accepted = MultiIndexHash()
+
+    for i, image_file in enumerate(files):
+        rejection, info = _check_upload(image_file, max_file_size_mb)
+        if rejection is not None:
+            results[i] = rejection
+            continue
+        if info["near_duplicate_of"] is None:
+            similar = accepted.search(info["dhash"], NEAR_DUPLICATE_DISTANCE)
+            if similar:
+                j = min(similar)[1]
+                if same_photo(_upload_copy(info["upload"]), _upload_copy(pending[j]["upload"])):
+                    info["near_duplicate_of"] = pending[j]["hash"]
+        accepted.add(info["dhash"], i)
+        pending[i] = info
+
+    def collect(i, compute):
+        info = pending[i]
+        try:
+            variants = compute()
+        except Exception as exc:
+            release_hash(info["hash"])
+            results[i] = {"error": f"Image processing failed: {exc}", "hash": info["hash"]}
+        else:
+            results[i] = _build_result(files[i].name, variants, info)
+        finally:
+            info["upload"].cleanup()
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers <= 1 or len(pending) <= 1:
+        for i, info in pending.items():
+            collect(i, lambda: render_variants(info["upload"].path, _render_options(options, info)))
+        return
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as pool:
+        futures = {
+            i: pool.submit(render_variants, info["upload"].path, _render_options(options, info))
+            for i, info in pending.items()
+        }
+        for i, future in futures.items():
+            collect(i, future.result)
@@ -0,0 +1,85 @@
+# ingest_utils.py
+"""
+Single-pass upload ingest.
+
+Each chunk of an upload is fed to the SHA-256 hasher, the malware scanner
+and a temp file on disk as it is read, so an upload is read once and never
+held in memory as a whole. Later stages decode from the temp file through a
+read-only memory map.
+"""
+import hashlib
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .security_utils import CHUNK_SIZE, scan_stream_for_malware
+
+
+class IngestedUpload:
+    """An upload spooled to disk together with its hash and scan verdict."""
+
+    def __init__(self, name, path, sha256, size, scan_result):
+        self.name = name
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        self.scan_result = scan_result
+
+    def cleanup(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def _chunks(file):
+    file.seek(0)
+    if hasattr(file, "chunks"):
+        return file.chunks(CHUNK_SIZE)
+    return iter(lambda: file.read(CHUNK_SIZE), b"")
+
+
+def ingest_upload(file):
+    """Read file once, teeing every chunk to the hasher, scanner and a temp file."""
+    hasher = hashlib.sha256()
+    size = 0
+    _, ext = os.path.splitext(file.name or "")
+    tmp = tempfile.NamedTemporaryFile(
+        prefix="ingest-", suffix=ext, delete=False,
+        dir=getattr(settings, "FILE_UPLOAD_TEMP_DIR", None),
+    )
+
+    def tee():
+        nonlocal size
+        for chunk in _chunks(file):
+            hasher.update(chunk)
+            tmp.write(chunk)
+            size += len(chunk)
+            yield chunk
+
+    def rescan():
+        # The whole upload has been spooled by the time a rescan is needed
+        tmp.flush()
+        with open(tmp.name, "rb") as spooled:
+            yield from iter(lambda: spooled.read(CHUNK_SIZE), b"")
+
+    try:
+        with tmp:
+            scan_result = scan_stream_for_malware(tee(), rescan=rescan)
+    except BaseException:
+        os.unlink(tmp.name)
+        raise
+    finally:
+        file.seek(0)
+
+    return IngestedUpload(file.name, tmp.name, hasher.hexdigest(), size, scan_result)
+
+
+@contextmanager
+def open_mapped(path):
+    """Open path as a read-only memory map that PIL can decode from."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        yield mapped
@@ -0,0 +1,246 @@
+# jobs.py
+"""
+Database-backed queue for the upload image pipeline.
+
+Views only store the raw originals (enqueue_images); the process_images
+management command claims jobs and builds the PropertyImage variants.
+
+An original is kept only while its job may still run, or when it became
+the source of a new blob (thumbnails are rendered from it). Failed,
+duplicate and cancelled jobs delete theirs. A job whose file another
+upload is still encoding waits (CLAIM_WAIT) and then reuses that blob.
+"""
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .blobs import attach_blob, collect_garbage, store_blob
+from .cache_utils import release_hash
+from .image_utils import process_images_batch
+from .models import ImageBlob, ImageJob, Property
+from .page_cache import touch_listing
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3
+STALE_AFTER = timedelta(minutes=10)
+CLAIM_WAIT = timedelta(seconds=30)
+# Doubled after every failed attempt
+RETRY_DELAY = timedelta(seconds=30)
+
+
+def enqueue_images(prop, files):
+    """Store the uploaded originals and mark the listing as processing."""
+    if not files:
+        return []
+    with transaction.atomic():
+        jobs = [ImageJob.objects.create(property=prop, original=f) for f in files]
+        Property.touch(prop.pk, images_processing=True)
+        touch_listing(prop.pk)
+    prop.images_processing = True
+    return jobs
+
+
+def discard_original(name):
+    """Delete an upload's original unless a blob renders thumbnails from it."""
+    if name and not ImageBlob.objects.filter(original=name).exists():
+        ImageJob._meta.get_field('original').storage.delete(name)
+
+
+def _discard_job_original(job):
+    name = job.original.name
+    ImageJob.objects.filter(pk=job.pk).update(original='')
+    transaction.on_commit(lambda: discard_original(name))
+
+
+def cancel_jobs(prop, reason='Replaced by a newer upload.'):
+    """
+    Cancel prop's queued and running jobs, e.g. because its photos are being
+    replaced. A running job finds out when it finishes and attaches nothing.
+    """
+    for job in prop.image_jobs.filter(status__in=[ImageJob.PENDING, ImageJob.RUNNING]):
+        cancelled = ImageJob.objects.filter(pk=job.pk, status=job.status).update(
+            status=ImageJob.CANCELLED, error=reason, updated_at=timezone.now()
+        )
+        # A running job's original is still being read; its worker discards it
+        if cancelled and job.status == ImageJob.PENDING:
+            _discard_job_original(job)
+
+
+def requeue_stale_jobs(stale_after=STALE_AFTER):
+    """Hand jobs left RUNNING by a crashed worker back to the queue."""
+    cutoff = timezone.now() - stale_after
+    return ImageJob.objects.filter(status=ImageJob.RUNNING, updated_at__lt=cutoff).update(
+        status=ImageJob.PENDING, updated_at=timezone.now()
+    )
+
+
+def claim_next_job():
+    """
+    Atomically move the oldest pending job to RUNNING and return it.
+
+    The claim is a conditional UPDATE, so concurrent workers never pick the
+    same job even on databases without SELECT ... FOR UPDATE SKIP LOCKED.
+    """
+    while True:
+        job = (ImageJob.objects.filter(status=ImageJob.PENDING, run_after__lte=timezone.now())
+               .order_by('created_at', 'id').select_related('property').first())
+        if job is None:
+            return None
+        claimed = ImageJob.objects.filter(pk=job.pk, status=ImageJob.PENDING).update(
+            status=ImageJob.RUNNING, attempts=F('attempts') + 1, updated_at=timezone.now()
+        )
+        if claimed:
+            job.status = ImageJob.RUNNING
+            job.attempts += 1
+            return job
+
+
+def _finish(job, status, error=''):
+    """Move a running job on; False if it was cancelled or deleted meanwhile."""
+    finished = ImageJob.objects.filter(pk=job.pk, status=ImageJob.RUNNING).update(
+        status=status, error=error, updated_at=timezone.now()
+    )
+    if finished:
+        job.status, job.error = status, error
+    return bool(finished)
+
+
+def _wait_for_claim(job):
+    """Hand a running job back to the queue, without using up an attempt."""
+    now = timezone.now()
+    ImageJob.objects.filter(pk=job.pk, status=ImageJob.RUNNING).update(
+        status=ImageJob.PENDING, attempts=F('attempts') - 1, run_after=now + CLAIM_WAIT,
+        error="Waiting for the same photo in another upload.", updated_at=now,
+    )
+
+
+def _retry_or_fail(job, exc, max_attempts):
+    status = ImageJob.FAILED if job.attempts >= max_attempts else ImageJob.PENDING
+    # Give a passing outage (e.g. clamd restarting) time to end
+    ImageJob.objects.filter(pk=job.pk).update(
+        run_after=timezone.now() + RETRY_DELAY * 2 ** (job.attempts - 1)
+    )
+    if not _finish(job, status, str(exc)) or status == ImageJob.FAILED:
+        _discard_job_original(job)
+
+
+def _refresh_property(prop):
+    prop.refresh_cover_image()
+    busy = prop.image_jobs.filter(status__in=[ImageJob.PENDING, ImageJob.RUNNING]).exists()
+    Property.touch(prop.pk, images_processing=busy)
+    prop.images_processing = busy
+    touch_listing(prop.pk)
+
+
+def _apply_result(job, processed):
+    prop = job.property
+    blob = None
+    if "error" in processed:
+        _finish(job, ImageJob.FAILED, processed["error"])
+    elif processed.get("duplicate"):
+        # Reuse the stored variants unless this listing already has them
+        blob = ImageBlob.objects.filter(hash=processed["hash"]).first()
+        if blob is None:
+            # Claimed by an upload that hasn't stored it yet (or failed since)
+            _wait_for_claim(job)
+            return
+        if prop.images.filter(blob=blob).exists():
+            _finish(job, ImageJob.DONE, "Duplicate image skipped.")
+        else:
+            with transaction.atomic():
+                if _finish(job, ImageJob.DONE):
+                    attach_blob(prop, blob)
+    elif (processed.get("near_duplicate_of")
+          and prop.images.filter(blob__hash=processed["near_duplicate_of"]).exists()):
+        # A resized copy of a photo this listing already has
+        release_hash(processed["hash"])
+        _finish(job, ImageJob.DONE, "Duplicate image skipped.")
+    else:
+        blob = store_blob(processed, original=job.original.name)
+        warning = processed.get("warning") or ''
+        if blob.near_duplicate_of_id:
+            logger.warning("Image blob %s looks like blob %s of another listing",
+                           blob.pk, blob.near_duplicate_of_id)
+            warning = " ".join(filter(None, [warning, "Looks like a photo of another listing."]))
+        with transaction.atomic():
+            if _finish(job, ImageJob.DONE, warning):
+                attach_blob(prop, blob)
+            elif blob.original.name == job.original.name:
+                # Cancelled while running: drop the blob we just stored, and
+                # let a waiting upload of the same file encode it instead
+                transaction.on_commit(lambda: collect_garbage([blob.pk]))
+                transaction.on_commit(lambda: release_hash(processed["hash"]))
+
+    if blob is None or blob.original.name != job.original.name:
+        _discard_job_original(job)
+
+
+def run_jobs(jobs, workers=1, max_attempts=MAX_ATTEMPTS):
+    """
+    Build the variants for claimed jobs and attach them to their listings.
+    With workers > 1 the CPU-bound stages run in a process pool.
+    """
+    opened = []
+    for job in jobs:
+        try:
+            opened.append((job, job.original.open('rb')))
+        except Exception as exc:
+            logger.exception("Image job %s could not read its original", job.pk)
+            _retry_or_fail(job, exc, max_attempts)
+
+    files = [f for _, f in opened]
+    try:
+        results = process_images_batch(files, workers=workers)
+    except Exception as exc:
+        logger.exception("Image batch failed")
+        for job, _ in opened:
+            _retry_or_fail(job, exc, max_attempts)
+        results = []
+    finally:
+        for f in files:
+            f.close()
+
+    for (job, _), processed in zip(opened, results):
+        try:
+            _apply_result(job, processed)
+        except Exception as exc:
+            logger.exception("Image job %s could not store its result", job.pk)
+            if "error" not in processed and not processed.get("duplicate"):
+                # This job holds the claim; don't keep other uploads waiting on it
+                release_hash(processed["hash"])
+            _retry_or_fail(job, exc, max_attempts)
+
+    for prop in {job.property_id: job.property for job in jobs}.values():
+        _refresh_property(prop)
+    return jobs
+
+
+def run_job(job, max_attempts=MAX_ATTEMPTS):
+    return run_jobs([job], max_attempts=max_attempts)[0]
+
+
+def process_pending(limit=None, max_attempts=MAX_ATTEMPTS, workers=1):
+    """
+    Drain the queue (or up to limit jobs); returns the number of jobs run.
+    Jobs are claimed `workers` at a time so a batch can fill the pool.
+    """
+    count = 0
+    while limit is None or count < limit:
+        batch_size = max(workers, 1)
+        if limit is not None:
+            batch_size = min(batch_size, limit - count)
+        jobs = []
+        while len(jobs) < batch_size:
+            job = claim_next_job()
+            if job is None:
+                break
+            jobs.append(job)
+        if not jobs:
+            break
+        run_jobs(jobs, workers=workers, max_attempts=max_attempts)
+        count += len(jobs)
+    return count
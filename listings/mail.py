@@ -0,0 +1,86 @@
+# mail.py
+"""
+Outgoing email, queued in the database so a request never waits on the mail
+server and nothing is lost if the process stops before the mail is sent.
+
+send_mail_later() stores the message; the send_queued_mail command claims
+and sends it, the way process_images works through image jobs. A failed
+send is logged and retried after a growing delay, up to MAX_ATTEMPTS.
+"""
+import logging
+from datetime import timedelta
+
+from django.core.mail import send_mail
+from django.db.models import F
+from django.utils import timezone
+
+from .models import QueuedMail
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+RETRY_DELAY = timedelta(minutes=1)  # doubled after each failed attempt
+STALE_AFTER = timedelta(minutes=10)
+
+
+def send_mail_later(subject, message, from_email, recipient_list):
+    """Queue send_mail() for the mail worker and return at once."""
+    return QueuedMail.objects.create(
+        subject=subject, message=message, from_email=from_email or '',
+        recipients='\n'.join(recipient_list),
+    )
+
+
+def requeue_stale_mail(stale_after=STALE_AFTER):
+    """Hand mail left RUNNING by a crashed worker back to the queue."""
+    cutoff = timezone.now() - stale_after
+    return QueuedMail.objects.filter(status=QueuedMail.RUNNING, updated_at__lt=cutoff).update(
+        status=QueuedMail.PENDING, updated_at=timezone.now()
+    )
+
+
+def claim_next_mail():
+    """Atomically move the oldest mail that is due to RUNNING and return it."""
+    while True:
+        mail = (QueuedMail.objects.filter(status=QueuedMail.PENDING, send_after__lte=timezone.now())
+                .order_by('send_after', 'id').first())
+        if mail is None:
+            return None
+        claimed = QueuedMail.objects.filter(pk=mail.pk, status=QueuedMail.PENDING).update(
+            status=QueuedMail.RUNNING, attempts=F('attempts') + 1, updated_at=timezone.now()
+        )
+        if claimed:
+            mail.status = QueuedMail.RUNNING
+            mail.attempts += 1
+            return mail
+
+
+def send_queued(mail, max_attempts=MAX_ATTEMPTS):
+    """Send a claimed mail; True if it went out."""
+    try:
+        send_mail(mail.subject, mail.message, mail.from_email or None, mail.recipient_list)
+    except Exception as exc:
+        logger.exception("Sending mail %s (%r) to %s failed", mail.pk, mail.subject, mail.recipient_list)
+        if mail.attempts >= max_attempts:
+            changes = {'status': QueuedMail.FAILED}
+        else:
+            delay = RETRY_DELAY * 2 ** (mail.attempts - 1)
+            changes = {'status': QueuedMail.PENDING, 'send_after': timezone.now() + delay}
+        QueuedMail.objects.filter(pk=mail.pk).update(error=str(exc), updated_at=timezone.now(), **changes)
+        mail.status, mail.error = changes['status'], str(exc)
+        return False
+    QueuedMail.objects.filter(pk=mail.pk).update(status=QueuedMail.SENT, error='', updated_at=timezone.now())
+    mail.status = QueuedMail.SENT
+    return True
+
+
+def send_pending(limit=None, max_attempts=MAX_ATTEMPTS):
+    """Try to send the mail that is due (or up to limit of it); returns how many were tried."""
+    count = 0
+    while limit is None or count < limit:
+        mail = claim_next_mail()
+        if mail is None:
+            break
+        send_queued(mail, max_attempts)
+        count += 1
+    return count
@@ -0,0 +1,88 @@
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connection, transaction
+
+from listings.models import Property
+from listings.pagination import paginate_keyset
+
+
+class Command(BaseCommand):
+    help = ("Hammer the database with concurrent listing reads and read-then-write "
+            "transactions, and report throughput and lock errors. Only the database is "
+            "loaded, no views; for HTTP throughput use load_report. Writes bump "
+            "listing versions (invalidating cached pages) and change nothing else.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--untuned', action='store_true',
+                            help="Compare against plain SQLite: rollback journal, deferred "
+                                 "transactions, a connection per request.")
+
+    def untune(self):
+        settings_dict = connection.settings_dict
+        if settings_dict['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError("--untuned only applies to SQLite.")
+        # Shared by every thread's connection; journal_mode sticks to the file
+        settings_dict['CONN_MAX_AGE'] = 0
+        settings_dict['OPTIONS'] = {'init_command': 'PRAGMA journal_mode=DELETE'}
+
+    def read(self):
+        list(paginate_keyset(Property.objects.filter(available=True).select_related('cover_image')))
+
+    def write(self, pk):
+        with transaction.atomic():
+            Property.objects.filter(pk=pk).values_list('version', flat=True).get()
+            Property.touch(pk)
+
+    def worker(self, op, args, deadline, counts, lock):
+        done = errors = 0
+        while time.monotonic() < deadline:
+            try:
+                op(*args())
+                done += 1
+            except OperationalError:
+                errors += 1
+            finally:
+                # What request_finished does after every request
+                close_old_connections()
+        connection.close()
+        with lock:
+            counts['done'] += done
+            counts['errors'] += errors
+
+    def handle(self, *args, **options):
+        pks = list(Property.objects.values_list('pk', flat=True))
+        if not pks:
+            raise CommandError("No listings to load.")
+        if options['untuned']:
+            self.untune()
+        connection.close()
+
+        results = {kind: {'done': 0, 'errors': 0} for kind in ('reads', 'writes')}
+        lock = threading.Lock()
+        deadline = time.monotonic() + options['seconds']
+        threads = [
+            threading.Thread(target=self.worker,
+                             args=(self.read, lambda: (), deadline, results['reads'], lock))
+            for _ in range(options['readers'])
+        ] + [
+            threading.Thread(target=self.worker,
+                             args=(self.write, lambda: (random.choice(pks),), deadline,
+                                   results['writes'], lock))
+            for _ in range(options['writers'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.stdout.write(f"{options['readers']} readers, {options['writers']} writers, "
+                          f"{options['seconds']:g}s, {'untuned' if options['untuned'] else 'tuned'}")
+        for kind, counts in results.items():
+            self.stdout.write(f"{kind:<8} {counts['done'] / options['seconds']:>8.0f}/s "
+                              f"{counts['errors']:>6} locked")
@@ -0,0 +1,82 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from listings.image_utils import AVIF_AVAILABLE, DEFAULT_OPTIONS, encode_to_target
+from listings.models import ImageBlob
+from listings.quality_utils import SSIMReference
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+class Command(BaseCommand):
+    help = ("Compare fixed-quality and SSIM-targeted encoding over a sample of real "
+            "images: total bytes and encode time per format. Only the encoder settings are "
+            "measured; for the rest of the image pipeline use perf_report.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*',
+                            help="Image files or directories. Defaults to the stored originals.")
+        parser.add_argument('--limit', type=int, default=50,
+                            help="Use at most this many images.")
+        parser.add_argument('--ssim', type=float, default=DEFAULT_OPTIONS["desktop_ssim"],
+                            help="SSIM target for the searched encodings.")
+
+    def corpus(self, paths, limit):
+        if not paths:
+            for blob in ImageBlob.objects.order_by('-pk')[:limit]:
+                source = blob.original or blob.desktop
+                yield source.name, source.open('rb')
+            return
+
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                for root, _, names in os.walk(path):
+                    files.extend(os.path.join(root, n) for n in sorted(names)
+                                 if n.lower().endswith(IMAGE_EXTENSIONS))
+            else:
+                files.append(path)
+        for path in files[:limit]:
+            yield path, open(path, 'rb')
+
+    def handle(self, *args, **options):
+        formats = [('JPEG', 'jpeg_quality'), ('WEBP', 'webp_quality')]
+        if AVIF_AVAILABLE:
+            formats.append(('AVIF', 'avif_quality'))
+        size = (DEFAULT_OPTIONS["max_width"], DEFAULT_OPTIONS["max_height"])
+
+        totals = {(fmt, mode): [0, 0.0] for fmt, _ in formats for mode in ('fixed', 'searched')}
+        count = 0
+        for name, f in self.corpus(options['paths'], options['limit']):
+            with f:
+                try:
+                    img = Image.open(f)
+                    img.draft('RGB', size)
+                    img = img.convert('RGB')
+                except OSError:
+                    self.stderr.write(f"Skipping unreadable {name}")
+                    continue
+            img.thumbnail(size, Image.LANCZOS)
+            reference = SSIMReference(img)
+            count += 1
+
+            for fmt, quality_key in formats:
+                for mode, target in (('fixed', None), ('searched', options['ssim'])):
+                    started = time.perf_counter()
+                    data, _ = encode_to_target(img, fmt, target, DEFAULT_OPTIONS[quality_key], reference)
+                    totals[fmt, mode][0] += len(data)
+                    totals[fmt, mode][1] += time.perf_counter() - started
+
+        if not count:
+            raise CommandError("No images to report on.")
+
+        self.stdout.write(f"{count} image(s) at up to {size[0]}x{size[1]}, SSIM target {options['ssim']}")
+        self.stdout.write(f"{'format':<6} {'mode':<9} {'total KB':>10} {'avg KB':>8} {'ms/image':>9}")
+        for (fmt, mode), (nbytes, seconds) in totals.items():
+            self.stdout.write(
+                f"{fmt:<6} {mode:<9} {nbytes / 1024:>10.1f} {nbytes / 1024 / count:>8.1f} "
+                f"{seconds * 1000 / count:>9.0f}"
+            )
@@ -0,0 +1,109 @@
+import asyncio
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from listings.models import Property
+
+
+class Command(BaseCommand):
+    help = ("Compare requests/sec and response size of the JSON API against the HTML "
+            "pages it replaces for the mobile client, through the full request stack "
+            "(in-process or against a running server). For one code path in isolation "
+            "use perf_report; for database contention, db_load_report.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help="Requests per endpoint.")
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help="Requests in flight at once.")
+        parser.add_argument('--base-url',
+                            help="Load a running server (e.g. http://127.0.0.1:8000) instead of "
+                                 "calling the views in-process.")
+        parser.add_argument('--host', default='localhost',
+                            help="Host header for in-process requests.")
+        parser.add_argument('--path', action='append', dest='paths', default=[],
+                            help="Only load this path (repeatable), e.g. to compare the same "
+                                 "pages served by uvicorn and gunicorn.")
+        parser.add_argument('--asgi', action='store_true',
+                            help="Call the views in-process through the ASGI handler, "
+                                 "--concurrency requests at a time on one event loop.")
+
+    def fetcher(self, options):
+        if options['base_url']:
+            base = options['base_url'].rstrip('/')
+
+            def fetch(path):
+                with urllib.request.urlopen(base + path) as response:
+                    return len(response.read())
+            return fetch
+
+        def fetch(path):
+            response = Client(HTTP_HOST=options['host']).get(path)
+            if response.status_code != 200:
+                raise CommandError(f"{path} returned {response.status_code}")
+            return len(response.content)
+        return fetch
+
+    async def run_asgi(self, path, requests, concurrency):
+        client = AsyncClient()
+        slots = asyncio.Semaphore(concurrency)
+
+        async def fetch():
+            async with slots:
+                response = await client.get(path)
+            if response.status_code != 200:
+                raise CommandError(f"{path} returned {response.status_code}")
+            return len(response.content)
+
+        # The ASGI test client always sends Host: testserver
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            await fetch()  # warm up
+            started = time.perf_counter()
+            sizes = await asyncio.gather(*(fetch() for _ in range(requests)))
+        return requests / (time.perf_counter() - started), sum(sizes) / len(sizes)
+
+    def run(self, fetch, path, requests, concurrency):
+        if fetch is None:
+            return asyncio.run(self.run_asgi(path, requests, concurrency))
+        fetch(path)  # warm up
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            sizes = list(pool.map(fetch, [path] * requests))
+        return requests / (time.perf_counter() - started), sum(sizes) / len(sizes)
+
+    def handle(self, *args, **options):
+        fetch = None if options['asgi'] else self.fetcher(options)
+        self.stdout.write(f"{options['requests']} requests per endpoint, {options['concurrency']} at a time")
+        if options['paths']:
+            self.stdout.write(f"{'path':<40} {'req/s':>8} {'avg KB':>8}")
+            for path in options['paths']:
+                rate, size = self.run(fetch, path, options['requests'], options['concurrency'])
+                self.stdout.write(f"{path:<40} {rate:>8.0f} {size / 1024:>8.1f}")
+            return
+
+        prop = Property.objects.filter(available=True).order_by('-created_at').first()
+        if prop is None:
+            raise CommandError("No listings to request.")
+
+        pairs = [
+            ('listing page', reverse('home') + '?show=all', reverse('api-property-list')),
+            ('one listing', reverse('property_detail', args=[prop.pk]),
+             reverse('api-property-detail', args=[prop.pk])),
+        ]
+        self.stdout.write(f"{'endpoint':<24} {'req/s':>8} {'avg KB':>8}")
+        for label, html_path, api_path in pairs:
+            results = {}
+            for kind, path in (('html', html_path), ('api', api_path)):
+                results[kind] = self.run(fetch, path, options['requests'], options['concurrency'])
+                rate, size = results[kind]
+                self.stdout.write(f"{label + ' ' + kind:<24} {rate:>8.0f} {size / 1024:>8.1f}")
+            self.stdout.write(
+                f"  api: {results['api'][0] / results['html'][0]:.1f}x the requests/sec, "
+                f"{results['api'][1] / results['html'][1]:.0%} of the bytes"
+            )
@@ -0,0 +1,486 @@
+import hashlib
+import os
+import pickle
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image, ImageDraw
+
+from listings.autocomplete import LocationIndex, LocationTrie, location_index
+from listings.cache_utils import release_hash
+from listings.image_utils import process_images_batch, render_variants
+from listings.ingest_utils import ingest_upload, open_mapped
+from listings.models import Property, normalize_location
+from listings.pagination import encode_cursor, get_page_size, paginate_keyset
+from listings.phash_utils import dhash
+from listings.search import (
+    FTS_TABLE, MAX_RESULTS, FallbackSearchBackend, _terms, search_properties,
+)
+from listings.security_utils import scan_image_for_malware
+
+LOCATIONS = ['Kilimani', 'Westlands', 'Kasarani', 'Rongai', 'Thika', 'Ngara', 'Karen', 'Langata',
+             'South C', 'Athi River', 'Ruiru', 'Kileleshwa']
+WORDS = ("spacious sunny modern quiet secure balcony parking borehole gated compound near "
+         "shops school tarmac road wifi furnished").split()
+# About one listing in a thousand mentions each of these
+RARE_WORDS = ['jacuzzi', 'rooftop', 'sauna']
+LISTING_SCENARIOS = {'search', 'pages', 'fts', 'autocomplete', 'page_cache'}
+
+# Run in a fresh interpreter per measurement, so ru_maxrss is this run's peak.
+# Prints the milliseconds and peak RSS growth (KiB) of upscaling a WxH source
+# and fitting it in the 1200px desktop box, the old way or the new one.
+UPSCALE_RUN = '''
+import resource, sys, time
+from PIL import Image
+from listings.upscale_utils import ai_upscale
+
+size, mode = tuple(int(d) for d in sys.argv[1].split('x')), sys.argv[2]
+img = Image.radial_gradient('L').resize(size).convert('RGB')
+img.load()
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+started = time.perf_counter()
+if mode == 'old':
+    # Every source doubled, then shrunk back down
+    img = img.resize((img.width * 2, img.height * 2), Image.LANCZOS)
+else:
+    img = ai_upscale(img, (1200, 1200))
+img.thumbnail((1200, 1200), Image.LANCZOS)
+elapsed = time.perf_counter() - started
+print(elapsed * 1000, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before)
+'''
+
+
+class CountingFile(File):
+    """A File that counts the bytes read from it."""
+
+    bytes_read = 0
+
+    def read(self, *args):
+        data = super().read(*args)
+        self.bytes_read += len(data)
+        return data
+
+
+class Command(BaseCommand):
+    help = ("Time one listing, image or cache code path against the code it replaced, "
+            "single-threaded, on the configured database. --listings adds synthetic "
+            "listings for the run and rolls them back afterwards. Encoder output size is "
+            "encoder_report's job; throughput under concurrent load is load_report's (HTTP) "
+            "and db_load_report's (database locking).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=['search', 'pages', 'batch', 'ingest', 'picture', 'upscale', 'fts',
+                                                 'autocomplete', 'page_cache'])
+        parser.add_argument('--listings', type=int, default=0,
+                            help="Add this many synthetic listings for the run (rolled back).")
+        parser.add_argument('--repeat', type=int, default=20,
+                            help="Runs per timing; the median is reported.")
+        parser.add_argument('--images', type=int, default=16,
+                            help="Synthetic photos for the image scenarios.")
+        parser.add_argument('--size', default='2400x1800',
+                            help="Pixel size of the synthetic photos, WxH.")
+        parser.add_argument('--photo', action='append', default=[],
+                            help="Use this photo file instead of synthetic ones (repeatable).")
+
+    def timed(self, fn, repeat):
+        """Median milliseconds per call of fn, after one warm-up call."""
+        fn()
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - started)
+        return statistics.median(times) * 1000
+
+    def seed(self, count):
+        rng = random.Random(1)
+        now = timezone.now()
+        # Keep our created_at values instead of bulk_create stamping them all alike
+        created_at = Property._meta.get_field('created_at')
+        created_at.auto_now_add = False
+        try:
+            self._seed(rng, now, count)
+        finally:
+            created_at.auto_now_add = True
+
+    def _seed(self, rng, now, count):
+        batch = []
+        for i in range(count):
+            location = rng.choice(LOCATIONS)
+            batch.append(Property(
+                title=' '.join(rng.sample(WORDS, 3)) + ' apartment',
+                description=' '.join(rng.choices(WORDS, k=25)
+                                     + ([rng.choice(RARE_WORDS)] if rng.random() < 0.003 else [])),
+                location=location, location_key=normalize_location(location),
+                price=rng.randrange(5000, 150000, 500),
+                bedrooms=rng.choice(Property.PROPERTY_TYPES)[0],
+                owner_name=f'landlord{i % 500}', owner_phone='0700000000',
+                available=rng.random() < 0.7,
+                created_at=now - timedelta(seconds=30 * (count - i)),
+            ))
+            if len(batch) == 5000:
+                self._insert(batch)
+                batch = []
+        self._insert(batch)
+
+    def _insert(self, batch):
+        created = Property.objects.bulk_create(batch)
+        if connection.vendor == 'sqlite':
+            # bulk_create skips the signals that keep the FTS table in step
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f'INSERT INTO {FTS_TABLE} (rowid, title, description, location) VALUES (%s, %s, %s, %s)',
+                    [(p.pk, p.title, p.description, p.location) for p in created],
+                )
+
+    def photos(self, options, seed=0):
+        """
+        Uploads for the image scenarios: the --photo files, or else photo-like
+        JPEGs of a shaded gradient with blocks of colour and grain.
+        """
+        if options['photo']:
+            uploads = []
+            for path in options['photo']:
+                with open(path, 'rb') as f:
+                    uploads.append(SimpleUploadedFile(os.path.basename(path), f.read(),
+                                                      content_type='image/jpeg'))
+            return uploads
+        size = tuple(int(d) for d in options['size'].split('x'))
+        rng = random.Random(seed)
+        uploads = []
+        for i in range(options['images']):
+            img = Image.radial_gradient('L').resize(size).convert('RGB')
+            draw = ImageDraw.Draw(img)
+            for _ in range(12):
+                x, y = rng.randrange(size[0]), rng.randrange(size[1])
+                draw.rectangle((x, y, x + size[0] // 6, y + size[1] // 6),
+                               fill=tuple(rng.randrange(256) for _ in range(3)))
+            img = Image.blend(img, Image.effect_noise(size, 40).convert('RGB'), 0.15)
+            buf = BytesIO()
+            img.save(buf, 'JPEG', quality=92)
+            uploads.append(SimpleUploadedFile(f'photo{i}.jpg', buf.getvalue(), content_type='image/jpeg'))
+        return uploads
+
+    def plan(self, qs):
+        """How a queryset reads the table: SEARCH or SCAN, and the index used."""
+        match = re.search(r'(SEARCH|SCAN) \w+(?: USING (?:COVERING )?INDEX (\w+))?', qs.explain())
+        return ' '.join(filter(None, match.groups())) if match else '?'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['listings']:
+                self.seed(options['listings'])
+            if options['scenario'] in LISTING_SCENARIOS:
+                total = Property.objects.count()
+                if not total:
+                    raise CommandError("No listings; pass --listings to add synthetic ones.")
+                self.stdout.write(f"{options['scenario']}: {total} listings, "
+                                  f"median of {options['repeat']} runs")
+            getattr(self, f"report_{options['scenario']}")(options)
+            transaction.set_rollback(True)
+
+    # ---------------------------------------------------------
+    # search: filtered listing lookups, case-folded iexact/icontains vs indexed keys
+    # ---------------------------------------------------------
+    def report_search(self, options):
+        available = Property.objects.filter(available=True)
+        pks = list(available.order_by('pk').values_list('pk', flat=True))
+        samples = [available.get(pk=pks[i]) for i in (0, len(pks) // 2, len(pks) - 1)]
+
+        self.stdout.write(f"{'search':<36} {'old ms':>8} {'new ms':>8}  plan (old / new)")
+        for prop in samples:
+            location, bedrooms, price = prop.location.lower(), prop.bedrooms, prop.price
+            old = available.filter(
+                Q(location__iexact=location) | Q(location__icontains=location),
+                bedrooms__iexact=bedrooms, price__lte=price, price__gte=price * 0.8,
+            )
+            new = available.filter(
+                location_key__in=[normalize_location(location)],
+                bedrooms=Property.normalize_bedrooms(bedrooms),
+                price__lte=price, price__gte=(price * 8 + 9) // 10,
+            )
+
+            def run_old():
+                # The old view checked exists(), then rendered the matches
+                if old.exists():
+                    list(old.order_by('-created_at')[:24])
+
+            def run_new():
+                list(paginate_keyset(new))
+
+            self.stdout.write(
+                f"{f'{location} / {bedrooms} / {price}':<36} "
+                f"{self.timed(run_old, options['repeat']):>8.2f} {self.timed(run_new, options['repeat']):>8.2f}"
+                f"  {self.plan(old.order_by('-created_at')[:24])}"
+                f" / {self.plan(new.order_by('-created_at', '-id')[:25])}"
+            )
+
+    # ---------------------------------------------------------
+    # pages: OFFSET vs keyset pagination of the show-all feed, by page depth
+    # ---------------------------------------------------------
+    def report_pages(self, options):
+        feed = Property.objects.filter(available=True).select_related('cover_image')
+        ordered = feed.order_by('-created_at', '-id')
+        total, size = feed.count(), get_page_size()
+        pages = [n for n in (1, 10, 100, 1000, 10000) if (n - 1) * size < total]
+
+        self.stdout.write(f"show-all feed, {total} available, {size} per page")
+        self.stdout.write(f"{'page':>6} {'OFFSET ms':>10} {'keyset ms':>10}  keyset plan")
+        for n in pages:
+            offset = (n - 1) * size
+            if n == 1:
+                cursor, seek = None, ordered[:size + 1]
+            else:
+                before = ordered[offset - 1]
+                cursor = encode_cursor('n', before)
+                seek = ordered.filter(Q(created_at__lt=before.created_at)
+                                      | Q(created_at=before.created_at, id__lt=before.pk),
+                                      created_at__lte=before.created_at)[:size + 1]
+            self.stdout.write(
+                f"{n:>6} {self.timed(lambda: list(ordered[offset:offset + size]), options['repeat']):>10.2f} "
+                f"{self.timed(lambda: paginate_keyset(feed, cursor), options['repeat']):>10.2f}  {self.plan(seek)}"
+            )
+
+        # Before pagination, every grid rendered the whole feed
+        self.stdout.write(f"whole feed (unpaginated): {self.timed(lambda: list(ordered.all()), 3):.0f} ms")
+
+    # ---------------------------------------------------------
+    # batch: upload batch throughput as the worker pool grows
+    # ---------------------------------------------------------
+    def report_batch(self, options):
+        uploads = self.photos(options)
+        self.stdout.write(f"{len(uploads)} photos of {options['size']}, {os.cpu_count()} CPU(s)")
+        self.stdout.write(f"{'workers':>7} {'seconds':>8} {'images/s':>9}")
+        for workers in (1, 2, 4, 8):
+            started = time.perf_counter()
+            results = process_images_batch(uploads, workers=workers)
+            elapsed = time.perf_counter() - started
+            failed = [r for r in results if r.get("error") or r.get("duplicate")]
+            if failed:
+                raise CommandError(f"Batch didn't encode every photo: {failed[0]}")
+            # Let the next run encode them again rather than skip them as duplicates
+            for result in results:
+                release_hash(result["hash"])
+            self.stdout.write(f"{workers:>7} {elapsed:>8.2f} {len(uploads) / elapsed:>9.2f}")
+
+    # ---------------------------------------------------------
+    # ingest: time and peak memory of reading an upload once vs once per step
+    # ---------------------------------------------------------
+    def report_ingest(self, options):
+        upload = self.photos({**options, 'images': 1})[0]
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as spooled:
+            # Large uploads reach the view spooled to disk, like this
+            spooled.write(upload.read())
+            spooled.flush()
+
+            def whole_file(f):
+                # What the pipeline did before: a pass each to hash, scan and
+                # dHash the upload, then the whole file as bytes for encoding,
+                # pickled again to reach a pool worker
+                hasher = hashlib.sha256()
+                for chunk in f.chunks():
+                    hasher.update(chunk)
+                f.seek(0)
+                scan_image_for_malware(f)
+                f.seek(0)
+                dhash(Image.open(f))
+                f.seek(0)
+                data = f.read()
+                pickle.dumps(data)
+
+            def streamed(f):
+                ingested = ingest_upload(f)
+                try:
+                    with open_mapped(ingested.path) as mapped:
+                        dhash(Image.open(mapped))
+                    pickle.dumps(ingested.path)
+                finally:
+                    ingested.cleanup()
+
+            size = os.path.getsize(spooled.name)
+            self.stdout.write(f"one {size / 2 ** 20:.1f} MB JPEG upload ({options['size']})")
+            self.stdout.write(f"{'ingest':<12} {'MB read':>8} {'peak MB':>8} {'ms':>8}")
+            for label, ingest in (('whole file', whole_file), ('streamed', streamed)):
+                with open(spooled.name, 'rb') as fp:
+                    f = CountingFile(fp, name='upload.jpg')
+                    tracemalloc.start()
+                    ingest(f)
+                    _, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+                    read = f.bytes_read
+
+                def run():
+                    with open(spooled.name, 'rb') as fp:
+                        ingest(File(fp, name='upload.jpg'))
+
+                self.stdout.write(f"{label:<12} {read / 2 ** 20:>8.1f} {peak / 2 ** 20:>8.2f} "
+                                  f"{self.timed(run, options['repeat']):>8.1f}")
+
+    # ---------------------------------------------------------
+    # picture: bytes phones and desktops download per photo, by the formats they accept
+    # ---------------------------------------------------------
+    def report_picture(self, options):
+        variants = [render_variants(upload.read()) for upload in self.photos(options)]
+
+        def old_pick(variant, phone, formats):
+            # WebP source first, then the mobile media query, then the desktop <img>
+            if 'webp' in formats:
+                return 'webp'
+            return 'mobile' if phone else 'desktop'
+
+        def new_pick(variant, phone, formats):
+            # Mobile media query first, then AVIF (if encoded), WebP, the desktop <img>
+            if phone:
+                return 'mobile'
+            for fmt in ('avif', 'webp'):
+                if fmt in formats and variant[fmt]:
+                    return fmt
+            return 'desktop'
+
+        clients = [
+            ('phone, AVIF+WebP', True, {'avif', 'webp'}),
+            ('phone, WebP', True, {'webp'}),
+            ('phone, JPEG only', True, set()),
+            ('desktop, AVIF+WebP', False, {'avif', 'webp'}),
+            ('desktop, WebP', False, {'webp'}),
+            ('desktop, JPEG only', False, set()),
+        ]
+        source = ', '.join(options['photo']) or f"{len(variants)} photos of {options['size']}"
+        self.stdout.write(f"{source}: KB per photo downloaded")
+        self.stdout.write(f"{'client':<20} {'old':>14} {'new':>14}")
+        for label, phone, formats in clients:
+            cells = []
+            for pick in (old_pick, new_pick):
+                fmts = [pick(v, phone, formats) for v in variants]
+                kb = statistics.mean(len(v[fmt]) for v, fmt in zip(variants, fmts)) / 1024
+                cells.append(f"{kb:.1f} {'/'.join(sorted(set(fmts)))}")
+            self.stdout.write(f"{label:<20} {cells[0]:>14} {cells[1]:>14}")
+
+    # ---------------------------------------------------------
+    # upscale: time and peak memory of fitting each source size to the 1200px box
+    # ---------------------------------------------------------
+    def report_upscale(self, options):
+        self.stdout.write("upscale to the 1200px box; median ms, peak RSS growth, "
+                          f"{options['repeat']} fresh processes each")
+        self.stdout.write(f"{'source':>10} {'old ms':>8} {'old MB':>7} {'new ms':>8} {'new MB':>7}")
+        for size in ('480x360', '1000x750', '2400x1800', '4000x3000'):
+            cells = []
+            for mode in ('old', 'new'):
+                runs = []
+                for _ in range(options['repeat']):
+                    out = subprocess.run([sys.executable, '-c', UPSCALE_RUN, size, mode],
+                                         cwd=settings.BASE_DIR, check=True,
+                                         capture_output=True, text=True).stdout.split()
+                    runs.append((float(out[0]), int(out[1]) / 1024))
+                cells.append(f"{statistics.median(ms for ms, _ in runs):>8.0f} "
+                              f"{statistics.median(mb for _, mb in runs):>7.0f}")
+            self.stdout.write(f"{size:>10} {cells[0]} {cells[1]}")
+
+    # ---------------------------------------------------------
+    # fts: icontains on every column vs the ranked full-text index
+    # ---------------------------------------------------------
+    def report_fts(self, options):
+        fallback = FallbackSearchBackend()
+
+        def run_old(text):
+            # What other databases still do: icontains on every column, newest first
+            ids = fallback.ranked_ids(_terms(text), MAX_RESULTS, available=True)
+            Property.objects.in_bulk(ids)
+            return ids
+
+        def run_new(text):
+            return search_properties(text, Property.objects.filter(available=True), available=True)
+
+        queries = [('rare word', 'jacuzzi'), ('common word', 'balcony'),
+                   ('two words', 'quiet borehole'), ('prefix', 'furn'),
+                   ('no match', 'helipad'), ('misspelt location', 'kilimanii')]
+        self.stdout.write(f"{'query':<30} {'LIKE hits':>9} {'LIKE ms':>8} {'FTS hits':>8} {'FTS ms':>8}")
+        for label, text in queries:
+            self.stdout.write(
+                f"{f'{label} ({text})':<30} {len(run_old(text)):>9} "
+                f"{self.timed(lambda: run_old(text), options['repeat']):>8.1f} {len(run_new(text)):>8} "
+                f"{self.timed(lambda: run_new(text), options['repeat']):>8.1f}"
+            )
+
+    # ---------------------------------------------------------
+    # autocomplete: location suggestions from the prefix trie vs a LIKE query
+    # ---------------------------------------------------------
+    def report_autocomplete(self, options):
+        repeat = options['repeat']
+        build = self.timed(LocationIndex()._build, 3)
+        self.stdout.write(f"trie build from the database: {build:.1f} ms")
+
+        def per_call(fn, calls=1000):
+            return self.timed(lambda: [fn() for _ in range(calls)], 3) * 1000 / calls
+
+        client = Client()
+        url = reverse('location_autocomplete')
+        location_index.reset()
+        self.stdout.write(f"{'prefix':<8} {'trie us':>8} {'request ms':>10} {'LIKE ms':>8}")
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for prefix in ('ki', 'kile', 'athi r', 'riv', 'zz'):
+                # What a lookup without the trie would run (and it only matches the first word)
+                like = (Property.objects.filter(available=True, location_key__startswith=prefix)
+                        .values('location_key').annotate(n=Count('id')).order_by('-n')[:8])
+                self.stdout.write(
+                    f"{prefix:<8} {per_call(lambda: location_index.suggest(prefix)):>8.1f} "
+                    f"{self.timed(lambda: client.get(url, {'q': prefix}), repeat):>10.2f} "
+                    f"{self.timed(lambda: list(like.all()), repeat):>8.2f}"
+                )
+
+        # Far more distinct locations than listings here have
+        rng = random.Random(2)
+        syllables = 'ka ki ku ma mi mu na ni ri ro ga ge to tha ny la wa'.split()
+        names = {' '.join(''.join(rng.choices(syllables, k=rng.randint(2, 4))).title()
+                          for _ in range(rng.randint(1, 2))) for _ in range(20000)}
+        trie = LocationTrie()
+        started = time.perf_counter()
+        trie.load((normalize_location(name), name, rng.randrange(500)) for name in names)
+        self.stdout.write(f"{len(names)} synthetic locations: build {time.perf_counter() - started:.1f} s, "
+                          + ', '.join(f"'{p}' {per_call(lambda: trie.suggest(p)):.1f} us"
+                                      for p in ('k', 'ki', 'kama', 'zz')))
+
+    # ---------------------------------------------------------
+    # page_cache: page times for anonymous and logged-in clients, caching off vs on
+    # ---------------------------------------------------------
+    def report_page_cache(self, options):
+        repeat = options['repeat']
+        prop = Property.objects.filter(available=True).latest('created_at')
+        pages = [
+            ('home', reverse('home')),
+            ('home, show all', reverse('home') + '?show=all'),
+            ('home, search', reverse('home') + f'?location={prop.location}&bedrooms={prop.bedrooms}'),
+            ('property detail', reverse('property_detail', args=[prop.pk])),
+            ('about', reverse('about')),
+        ]
+        anonymous, member = Client(), Client()
+        member.force_login(User.objects.create_user('perf_report_user', password='perf-report'))
+
+        self.stdout.write(f"{'page':<16} {'anon off':>9} {'anon hit':>9} {'user off':>9} {'user hit':>9}  (ms)")
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for label, url in pages:
+                cells = []
+                for client in (anonymous, member):
+                    for timeout in (0, 600):
+                        with override_settings(PAGE_CACHE_TIMEOUT=timeout):
+                            # The warm-up call fills the cache; the timed ones are hits
+                            cells.append(self.timed(lambda: client.get(url), repeat))
+                self.stdout.write(f"{label:<16} " + ' '.join(f"{ms:>9.2f}" for ms in cells))
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from listings.jobs import MAX_ATTEMPTS, process_pending, requeue_stale_jobs
+
+
+class Command(BaseCommand):
+    help = "Run the background worker that builds image variants for uploaded listings."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Drain the queue once and exit instead of polling.")
+        parser.add_argument('--sleep', type=float, default=2.0,
+                            help="Seconds to wait between polls when the queue is empty.")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Processes used for the CPU-bound image stages.")
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS,
+                            help="Give up on a job after this many failed runs.")
+
+    def handle(self, *args, **options):
+        while True:
+            requeued = requeue_stale_jobs()
+            if requeued:
+                self.stdout.write(f"Requeued {requeued} stale job(s).")
+
+            done = process_pending(max_attempts=options['max_attempts'],
+                                   workers=options['workers'])
+            if done:
+                self.stdout.write(f"Processed {done} image job(s).")
+
+            if options['once']:
+                return
+            if not done:
+                time.sleep(options['sleep'])
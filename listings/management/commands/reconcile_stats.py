@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from listings.stats import reconcile
+
+
+class Command(BaseCommand):
+    help = ("Recount the monitor's counters and listing stats from the tables and fix any "
+            "drift. Safe to run at any time; schedule it (e.g. hourly from cron).")
+
+    def handle(self, *args, **options):
+        drifted = reconcile()
+        for name, stored, counted in drifted:
+            self.stdout.write(f"{name}: {stored} -> {counted}")
+        self.stdout.write(f"{len(drifted)} number(s) corrected.")
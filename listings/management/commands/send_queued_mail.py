@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from listings.mail import MAX_ATTEMPTS, requeue_stale_mail, send_pending
+
+
+class Command(BaseCommand):
+    help = "Run the background worker that sends queued email (contact messages)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Send what is due once and exit instead of polling.")
+        parser.add_argument('--sleep', type=float, default=5.0,
+                            help="Seconds to wait between polls when nothing is due.")
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS,
+                            help="Give up on a mail after this many failed sends.")
+
+    def handle(self, *args, **options):
+        while True:
+            requeued = requeue_stale_mail()
+            if requeued:
+                self.stdout.write(f"Requeued {requeued} stale mail(s).")
+
+            done = send_pending(max_attempts=options['max_attempts'])
+            if done:
+                self.stdout.write(f"Processed {done} mail(s).")
+
+            if options['once']:
+                return
+            if not done:
+                time.sleep(options['sleep'])
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:06
+
+import re
+
+from django.db import migrations, models
+
+
+def normalize_location(value):
+    # Frozen copy of listings.models.normalize_location as of this migration
+    return re.sub(r'\s+', ' ', (value or '').strip()).casefold()
+
+
+def fill_location_key(apps, schema_editor):
+    Property = apps.get_model('listings', 'Property')
+    for prop in Property.objects.only('pk', 'location').iterator():
+        Property.objects.filter(pk=prop.pk).update(location_key=normalize_location(prop.location))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='property',
+            name='location_key',
+            field=models.CharField(default='', editable=False, max_length=120),
+        ),
+        migrations.RunPython(fill_location_key, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(fields=['available', 'bedrooms', 'price', 'created_at'], name='property_search_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(fields=['available', 'location_key', 'bedrooms', 'price'], name='property_location_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_cover_image(apps, schema_editor):
+    Property = apps.get_model('listings', 'Property')
+    PropertyImage = apps.get_model('listings', 'PropertyImage')
+    for prop in Property.objects.only('pk').iterator():
+        cover = PropertyImage.objects.filter(property=prop).order_by('pk').first()
+        if cover is not None:
+            Property.objects.filter(pk=prop.pk).update(cover_image=cover)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0002_property_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='property',
+            name='cover_image',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='listings.propertyimage'),
+        ),
+        migrations.RunPython(fill_cover_image, migrations.RunPython.noop),
+    ]
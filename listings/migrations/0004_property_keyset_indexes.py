@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0003_property_cover_image'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(fields=['available', 'created_at', 'id'], name='property_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(fields=['owner_name', 'created_at', 'id'], name='property_owner_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(fields=['created_at', 'id'], name='property_recent_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0004_property_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='property',
+            name='images_processing',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.CreateModel(
+            name='ImageJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original', models.FileField(upload_to='property_uploads/')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='image_jobs', to='listings.property')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='imagejob_queue_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0005_image_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.CharField(max_length=64, unique=True)),
+                ('desktop', models.ImageField(upload_to='property_images/')),
+                ('mobile', models.ImageField(upload_to='property_images/')),
+                ('webp', models.ImageField(upload_to='property_images/')),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='propertyimage',
+            name='blob',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='images', to='listings.imageblob'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:13
+
+from django.db import migrations, models
+
+
+def fill_dhash(apps, schema_editor):
+    from PIL import Image
+    from listings.phash_utils import dhash, to_signed
+
+    ImageBlob = apps.get_model('listings', 'ImageBlob')
+    for blob in ImageBlob.objects.filter(dhash__isnull=True).iterator():
+        try:
+            with blob.desktop.open('rb') as f:
+                value = dhash(Image.open(f))
+        except (OSError, ValueError):
+            continue
+        ImageBlob.objects.filter(pk=blob.pk).update(dhash=to_signed(value))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0006_image_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageblob',
+            name='dhash',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_dhash, migrations.RunPython.noop),
+    ]
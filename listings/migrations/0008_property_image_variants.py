@@ -0,0 +1,116 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:19
+
+from django.db import migrations, models
+
+
+def _size(field):
+    from PIL import Image
+
+    try:
+        with field.open('rb') as f:
+            return Image.open(f).size
+    except (OSError, ValueError):
+        return None, None
+
+
+def group_variants(apps, schema_editor):
+    """Fold the separate desktop/mobile/WebP rows into one row per photo."""
+    Property = apps.get_model('listings', 'Property')
+    PropertyImage = apps.get_model('listings', 'PropertyImage')
+    ImageBlob = apps.get_model('listings', 'ImageBlob')
+
+    for blob in ImageBlob.objects.iterator():
+        width, height = _size(blob.desktop)
+        mobile_width, mobile_height = _size(blob.mobile)
+        dims = dict(width=width, height=height, mobile_width=mobile_width, mobile_height=mobile_height)
+        rows = PropertyImage.objects.filter(blob=blob)
+        rows.exclude(image=blob.desktop.name).delete()
+        rows.update(mobile=blob.mobile.name, webp=blob.webp.name, **dims)
+        ImageBlob.objects.filter(pk=blob.pk).update(ref_count=rows.count(), **dims)
+
+    # Rows saved before blobs existed: <base>_desktop.jpg, <base>_mobile.jpg, <base>.webp
+    legacy = PropertyImage.objects.filter(blob__isnull=True)
+    for row in legacy.filter(image__endswith='_desktop.jpg').iterator():
+        base = row.image.name[:-len('_desktop.jpg')]
+        siblings = legacy.filter(property_id=row.property_id)
+        mobile = siblings.filter(image=base + '_mobile.jpg').first()
+        webp = siblings.filter(image=base + '.webp').first()
+        row.width, row.height = _size(row.image)
+        if mobile is not None:
+            row.mobile = mobile.image.name
+            row.mobile_width, row.mobile_height = _size(mobile.image)
+            mobile.delete()
+        if webp is not None:
+            row.webp = webp.image.name
+            webp.delete()
+        row.save()
+
+    for row in legacy.filter(width__isnull=True).iterator():
+        width, height = _size(row.image)
+        PropertyImage.objects.filter(pk=row.pk).update(width=width, height=height)
+
+    # Covers may have pointed at a removed variant row
+    for prop in Property.objects.only('pk').iterator():
+        cover = PropertyImage.objects.filter(property=prop).order_by('pk').first()
+        Property.objects.filter(pk=prop.pk).update(cover_image=cover)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0007_image_blob_dhash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageblob',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='imageblob',
+            name='mobile_height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='imageblob',
+            name='mobile_width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='imageblob',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='propertyimage',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='propertyimage',
+            name='mobile',
+            field=models.ImageField(blank=True, editable=False, upload_to='property_images/'),
+        ),
+        migrations.AddField(
+            model_name='propertyimage',
+            name='mobile_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='propertyimage',
+            name='mobile_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='propertyimage',
+            name='webp',
+            field=models.ImageField(blank=True, editable=False, upload_to='property_images/'),
+        ),
+        migrations.AddField(
+            model_name='propertyimage',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(group_variants, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0008_property_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageblob',
+            name='original',
+            field=models.FileField(blank=True, upload_to='property_uploads/'),
+        ),
+    ]
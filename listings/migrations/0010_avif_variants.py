@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0009_image_blob_original'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageblob',
+            name='avif',
+            field=models.FileField(blank=True, upload_to='property_images/'),
+        ),
+        migrations.AddField(
+            model_name='propertyimage',
+            name='avif',
+            field=models.FileField(blank=True, editable=False, upload_to='property_images/'),
+        ),
+    ]
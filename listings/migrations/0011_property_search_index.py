@@ -0,0 +1,44 @@
+from django.db import migrations
+
+FTS_TABLE = 'listings_property_fts'
+PG_INDEX = 'property_fts_idx'
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "title, description, location, tokenize='unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, title, description, location) "
+            "SELECT id, title, description, location FROM listings_property"
+        )
+    elif vendor == 'postgresql':
+        from django.contrib.postgres.indexes import GinIndex
+        from django.contrib.postgres.search import SearchVector
+
+        # Must stay identical to listings.search.search_vector()
+        vector = SearchVector('title', 'description', 'location', config='simple')
+        Property = apps.get_model('listings', 'Property')
+        schema_editor.add_index(Property, GinIndex(vector, name=PG_INDEX))
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif vendor == 'postgresql':
+        schema_editor.execute(f"DROP INDEX IF EXISTS {PG_INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0010_avif_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
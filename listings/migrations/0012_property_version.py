@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0011_property_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='property',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0012_property_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Counter',
+            fields=[
+                ('name', models.CharField(max_length=40, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ListingStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('day', 'Day added'), ('location', 'Location'), ('bedrooms', 'Bedroom type')], max_length=10)),
+                ('bucket', models.CharField(max_length=120)),
+                ('label', models.CharField(max_length=120)),
+                ('listings', models.IntegerField(default=0)),
+                ('available', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('dimension', 'bucket'), name='listingstat_bucket_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0013_listing_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='imagejob',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='pending', max_length=10),
+        ),
+    ]
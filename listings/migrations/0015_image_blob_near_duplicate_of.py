@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0014_image_job_cancelled'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageblob',
+            name='near_duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='listings.imageblob'),
+        ),
+    ]
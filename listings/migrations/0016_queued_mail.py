@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:32
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0015_image_blob_near_duplicate_of'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedMail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255)),
+                ('message', models.TextField()),
+                ('from_email', models.CharField(blank=True, max_length=254)),
+                ('recipients', models.TextField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('send_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'send_after'], name='queuedmail_queue_idx')],
+            },
+        ),
+    ]
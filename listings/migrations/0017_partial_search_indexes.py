@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0016_queued_mail'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='property',
+            name='property_search_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='property',
+            name='property_location_idx',
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(condition=models.Q(('available', True)), fields=['bedrooms', 'price', 'created_at'], name='property_search_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(condition=models.Q(('available', True)), fields=['location_key', 'bedrooms', 'price'], name='property_location_idx'),
+        ),
+    ]
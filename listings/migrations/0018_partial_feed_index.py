@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0017_partial_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='property',
+            name='property_feed_idx',
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(condition=models.Q(('available', True)), fields=['created_at', 'id'], name='property_feed_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:26
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0018_partial_feed_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagejob',
+            name='run_after',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
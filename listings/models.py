@@ -1,4 +1,14 @@
-from django.db import models
+import re
+
+from django.db import models, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+
+def normalize_location(value):
+    """Case-folded, whitespace-collapsed form of a location used for indexed lookups."""
+    return re.sub(r'\s+', ' ', (value or '').strip()).casefold()
+
 
 class Property(models.Model):
     PROPERTY_TYPES = [
@@ -15,20 +25,262 @@ class Property(models.Model):
     title       = models.CharField(max_length=120)
     description = models.TextField()
     location    = models.CharField(max_length=120)
+    location_key = models.CharField(max_length=120, editable=False, default='')
     price       = models.PositiveIntegerField()
     bedrooms    = models.CharField(max_length=20, choices=PROPERTY_TYPES)
     owner_name  = models.CharField(max_length=60)
     owner_phone = models.CharField(max_length=15)
     created_at  = models.DateTimeField(auto_now_add=True)
     available   = models.BooleanField(default=True)
+    cover_image = models.ForeignKey('PropertyImage', null=True, blank=True, editable=False,
+                                    on_delete=models.SET_NULL, related_name='+')
+    images_processing = models.BooleanField(default=False, editable=False)
+    # Bumped on every change to the listing or its photos (API ETags)
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    class Meta:
+        # Searches and the feed only cover available listings. Django writes
+        # that filter as a bare WHERE "available" on SQLite, which can't seek
+        # a leading available column; partial indexes match it as written.
+        indexes = [
+            models.Index(fields=['bedrooms', 'price', 'created_at'], condition=models.Q(available=True),
+                         name='property_search_idx'),
+            models.Index(fields=['location_key', 'bedrooms', 'price'], condition=models.Q(available=True),
+                         name='property_location_idx'),
+            models.Index(fields=['created_at', 'id'], condition=models.Q(available=True),
+                         name='property_feed_idx'),
+            models.Index(fields=['owner_name', 'created_at', 'id'], name='property_owner_feed_idx'),
+            models.Index(fields=['created_at', 'id'], name='property_recent_idx'),
+        ]
 
     def __str__(self):
         return f"{self.title} – {self.location}"
 
+    def save(self, *args, **kwargs):
+        self.location_key = normalize_location(self.location)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            extra = {'version'} | ({'location_key'} if 'location' in update_fields else set())
+            kwargs['update_fields'] = {*update_fields, *extra}
+        if not self._state.adding:
+            # Counted in the database so concurrent writers never share a version
+            self.version = F('version') + 1
+        # The dashboard counters (post_save, see stats.py) commit with the row
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+        if not isinstance(self.version, int):
+            del self.version  # read back on next access
+
+    @classmethod
+    def touch(cls, pk, **changes):
+        """Update listing pk in place (no save() or signals), counting a new version."""
+        cls.objects.filter(pk=pk).update(version=F('version') + 1, **changes)
+
+    def refresh_cover_image(self):
+        """Point cover_image at the first image so listing grids need no extra query."""
+        self.cover_image = self.images.order_by('pk').first()
+        Property.touch(self.pk, cover_image=self.cover_image)
+
+    @classmethod
+    def normalize_bedrooms(cls, value):
+        """
+        Map free-form bedroom input ("2 Bedrooms", "two bedroom", "bedsitter")
+        onto the stored choice value, or None if it matches no choice.
+        """
+        key = normalize_location(value)
+        if not key:
+            return None
+        for choice, _ in cls.PROPERTY_TYPES:
+            if key == choice.casefold():
+                return choice
+        match = re.fullmatch(r'(\d+)\s*bedrooms?', key)
+        if match:
+            words = ['one', 'two', 'three', 'four', 'five', 'six']
+            n = int(match.group(1))
+            if 1 <= n <= len(words):
+                return f"{words[n - 1].capitalize()} bedroom"
+        if key.endswith('bedrooms'):
+            return cls.normalize_bedrooms(key[:-1])
+        return None
+
+
+class ImageBlob(models.Model):
+    """
+    Content-addressed set of encoded variants, shared by every PropertyImage
+    made from the same source file. ref_count tracks those PropertyImage rows.
+    """
+
+    hash = models.CharField(max_length=64, unique=True)
+    desktop = models.ImageField(upload_to='property_images/')
+    mobile = models.ImageField(upload_to='property_images/')
+    webp = models.ImageField(upload_to='property_images/')
+    # Empty when Pillow has no AVIF support
+    avif = models.FileField(upload_to='property_images/', blank=True)
+    # Uploaded source file; on-demand thumbnails are rendered from it
+    original = models.FileField(upload_to='property_uploads/', blank=True)
+    # 64-bit perceptual dHash (stored signed) for near-duplicate lookups
+    dhash = models.BigIntegerField(null=True, blank=True)
+    # Stored blob this one looks like a resized/recompressed copy of, when
+    # that blob belongs to another listing; flagged for review, never merged
+    near_duplicate_of = models.ForeignKey(
+        'self', on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    # Pixel sizes of the desktop (and WebP) and mobile variants
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    mobile_width = models.PositiveIntegerField(null=True, blank=True)
+    mobile_height = models.PositiveIntegerField(null=True, blank=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Image blob {self.hash[:12]} ({self.ref_count} refs)"
+
 
 class PropertyImage(models.Model):
+    """
+    One photo of a listing. image is the desktop JPEG; pipeline-built photos
+    also carry the mobile JPEG, WebP and (optionally) AVIF variants.
+    """
+
     property = models.ForeignKey(Property, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='property_images/')
+    mobile = models.ImageField(upload_to='property_images/', blank=True, editable=False)
+    webp = models.ImageField(upload_to='property_images/', blank=True, editable=False)
+    avif = models.FileField(upload_to='property_images/', blank=True, editable=False)
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    mobile_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    mobile_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    blob = models.ForeignKey(ImageBlob, null=True, blank=True, editable=False,
+                             on_delete=models.PROTECT, related_name='images')
+
+    def __str__(self):
+        return f"Image for {self.property.title}"
+
+    def save(self, *args, **kwargs):
+        # Admin uploads only set image; read its size once so templates can
+        # reserve space for it
+        if self.image and self.width is None:
+            try:
+                self.width, self.height = self.image.width, self.image.height
+            except (OSError, ValueError):
+                pass
+        super().save(*args, **kwargs)
+
+
+class ImageJob(models.Model):
+    """An uploaded original waiting for the image worker to build its variants."""
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+        (CANCELLED, 'Cancelled'),
+    ]
+
+    property = models.ForeignKey(Property, on_delete=models.CASCADE, related_name='image_jobs')
+    original = models.FileField(upload_to='property_uploads/')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    # Not claimed before this, e.g. while another upload encodes the same file
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='imagejob_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_status_display()} image job for {self.property.title}"
+
+
+class QueuedMail(models.Model):
+    """
+    An outgoing email, stored by the request and sent by the
+    send_queued_mail worker (see mail.py).
+    """
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    # Blank sends from DEFAULT_FROM_EMAIL
+    from_email = models.CharField(max_length=254, blank=True)
+    # One address per line
+    recipients = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    # Failed sends are retried no earlier than this
+    send_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'send_after'], name='queuedmail_queue_idx'),
+        ]
+
+    @property
+    def recipient_list(self):
+        return self.recipients.splitlines()
+
+    def __str__(self):
+        return f"{self.get_status_display()} mail {self.subject!r}"
+
+
+class Counter(models.Model):
+    """A running total for the monitor, kept up to date by signals (see stats.py)."""
+
+    name = models.CharField(max_length=40, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} = {self.value}"
+
+
+class ListingStat(models.Model):
+    """Listings, and how many are available, per day added, location or bedroom type."""
+
+    DAY = 'day'
+    LOCATION = 'location'
+    BEDROOMS = 'bedrooms'
+    DIMENSION_CHOICES = [
+        (DAY, 'Day added'),
+        (LOCATION, 'Location'),
+        (BEDROOMS, 'Bedroom type'),
+    ]
+
+    dimension = models.CharField(max_length=10, choices=DIMENSION_CHOICES)
+    bucket = models.CharField(max_length=120)
+    label = models.CharField(max_length=120)
+    listings = models.IntegerField(default=0)
+    available = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'bucket'], name='listingstat_bucket_uniq'),
+        ]
 
     def __str__(self):
-        return f"Image for {self.property.title}"
\ No newline at end of file
+        return f"{self.get_dimension_display()} {self.label}: {self.listings}"
@@ -0,0 +1,215 @@
+# page_cache.py
+"""
+Rendered-page caching for the public listing pages.
+
+Keys carry versions that signals bump whenever a listing or its images
+change: one shared version for pages that show many listings (the home
+grid) and one per property for its detail page. Nothing is ever deleted;
+entries under an old version just stop being asked for and expire.
+
+Anonymous visitors get whole pages from the cache. Logged-in users get
+pages rendered for them around a cached listing grid. Hits and misses
+are counted per page for the monitor. Anything rendered for the cache
+reads the primary database: a lagging replica would store old rows under
+the new version.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.safestring import mark_safe
+
+from config.replicas import use_primary
+from .cache_utils import aget_or_compute
+
+DEFAULT_TIMEOUT = 60 * 10
+LISTINGS_VERSION_KEY = 'listings_version'
+TRACKED = ('home', 'listing_grid', 'property_detail', 'about')
+
+
+def get_timeout():
+    """Seconds to keep a rendered page; 0 turns page caching off."""
+    return getattr(settings, 'PAGE_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+# -------------------------------------------------------------
+# VERSIONS
+# -------------------------------------------------------------
+def _property_version_key(pk):
+    return f'property_version_{pk}'
+
+
+def _get_version(key):
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock so a version lost to eviction is never reused
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def _bump_versions(pk):
+    for key in (LISTINGS_VERSION_KEY, _property_version_key(pk)):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), None)
+
+
+def listings_version():
+    return _get_version(LISTINGS_VERSION_KEY)
+
+
+def property_version(pk):
+    return _get_version(_property_version_key(pk))
+
+
+def touch_listing(pk):
+    """
+    Invalidate every cached page showing listing pk. Inside a transaction the
+    versions are bumped again on commit, so a page rendered from the old rows
+    in the meantime is not kept either.
+    """
+    _bump_versions(pk)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _bump_versions(pk))
+
+
+# -------------------------------------------------------------
+# METRICS
+# -------------------------------------------------------------
+def _stat_key(name, outcome):
+    return f'page_cache_{outcome}_{name}'
+
+
+def record(name, hit):
+    key = _stat_key(name, 'hits' if hit else 'misses')
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, None)
+
+
+def cache_stats():
+    """[{'name', 'hits', 'misses', 'hit_rate'}, ...] for each cached page."""
+    keys = [_stat_key(name, outcome) for name in TRACKED for outcome in ('hits', 'misses')]
+    counts = cache.get_many(keys)
+    stats = []
+    for name in TRACKED:
+        hits = counts.get(_stat_key(name, 'hits'), 0)
+        misses = counts.get(_stat_key(name, 'misses'), 0)
+        total = hits + misses
+        stats.append({
+            'name': name,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else None,
+        })
+    return stats
+
+
+# -------------------------------------------------------------
+# CACHING
+# -------------------------------------------------------------
+def _cache_key(kind, name, parts):
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()
+    return f'{kind}_{name}_{digest}'
+
+
+async def acached_fragment(name, parts, render):
+    """
+    HTML from render() (a coroutine function), shared by every request whose
+    key parts match.
+    """
+    timeout = get_timeout()
+    if not timeout:
+        return await render()
+    rendered = []
+
+    async def compute():
+        rendered.append(True)
+        with use_primary():
+            return await render()
+
+    html = await aget_or_compute(_cache_key('fragment', name, parts), compute, timeout)
+    await sync_to_async(record)(name, not rendered)
+    return mark_safe(html)
+
+
+def _lookup(name, key, request, args, kwargs):
+    cache_key = _cache_key('page', name, [request.path, *key(request, *args, **kwargs)])
+    cached = cache.get(cache_key)
+    record(name, cached is not None)
+    return cache_key, cached
+
+
+def _cached_response(cached):
+    content, content_type = cached
+    return HttpResponse(content, content_type=content_type)
+
+
+def _should_store(request, response):
+    # Never share a response carrying cookies or a CSRF token
+    return (response.status_code == 200 and not response.streaming and not response.cookies
+            and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE'))
+
+
+def _may_be_logged_in(request):
+    # Logging in puts the user id in the session. Looking for it, rather than
+    # loading the user, saves a query on pages that never show the user.
+    return SESSION_KEY in request.session
+
+
+async def _amay_be_logged_in(request):
+    return await request.session.ahas_key(SESSION_KEY)
+
+
+def cache_anonymous_page(name, key=lambda request, *args, **kwargs: []):
+    """
+    Serve the whole response from the cache for visitors who aren't logged
+    in. key(request, *args, **kwargs) returns whatever else the page depends
+    on (versions included), and is read before the view runs. Works on sync
+    and async views alike.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                timeout = get_timeout()
+                if (not timeout or request.method not in ('GET', 'HEAD')
+                        or await _amay_be_logged_in(request)):
+                    return await view(request, *args, **kwargs)
+
+                cache_key, cached = await sync_to_async(_lookup)(name, key, request, args, kwargs)
+                if cached is not None:
+                    return _cached_response(cached)
+                with use_primary():
+                    response = await view(request, *args, **kwargs)
+                if _should_store(request, response):
+                    await cache.aset(cache_key, (response.content, response['Content-Type']), timeout)
+                return response
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            timeout = get_timeout()
+            if (not timeout or request.method not in ('GET', 'HEAD')
+                    or _may_be_logged_in(request)):
+                return view(request, *args, **kwargs)
+
+            cache_key, cached = _lookup(name, key, request, args, kwargs)
+            if cached is not None:
+                return _cached_response(cached)
+            with use_primary():
+                response = view(request, *args, **kwargs)
+            if _should_store(request, response):
+                cache.set(cache_key, (response.content, response['Content-Type']), timeout)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,127 @@
+# pagination.py
+import base64
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 24
+
+
+class KeysetPage:
+    """One page of a keyset-paginated queryset plus the cursors around it."""
+
+    def __init__(self, object_list, next_cursor=None, prev_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+
+def get_page_size():
+    return getattr(settings, 'LISTINGS_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+
+
+def encode_cursor(direction, obj):
+    payload = json.dumps([direction, obj.created_at.isoformat(), obj.pk])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Return (direction, created_at, pk), or None for a missing or malformed token."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        direction, created_at, pk = json.loads(raw)
+        if direction not in ('n', 'p'):
+            return None
+        return direction, datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, TypeError):
+        return None
+
+
+def _seek(queryset, decoded, page_size):
+    """The query for the page after/before decoded (None: the first page), and its direction."""
+    if decoded is None:
+        return queryset.order_by('-created_at', '-id')[:page_size + 1], None
+
+    # The plain created_at bound is implied by the OR, but with bound
+    # parameters SQLite can only seek the index on a term like it; without
+    # it every page scans from the newest row.
+    direction, created_at, pk = decoded
+    if direction == 'n':
+        return (
+            queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk),
+                            created_at__lte=created_at)
+            .order_by('-created_at', '-id')[:page_size + 1]
+        ), direction
+    return (
+        queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk),
+                        created_at__gte=created_at)
+        .order_by('created_at', 'id')[:page_size + 1]
+    ), direction
+
+
+def _to_page(rows, direction, page_size):
+    """The KeysetPage for rows fetched by _seek(), or None to serve the first page instead."""
+    if direction is None:
+        next_cursor = encode_cursor('n', rows[page_size - 1]) if len(rows) > page_size else None
+        return KeysetPage(rows[:page_size], next_cursor=next_cursor)
+
+    if direction == 'n':
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        return KeysetPage(
+            rows,
+            next_cursor=encode_cursor('n', rows[-1]) if has_more else None,
+            prev_cursor=encode_cursor('p', rows[0]) if rows else None,
+        )
+
+    if len(rows) <= page_size:
+        # Walked back to the start: serve the canonical first page.
+        return None
+    rows = rows[:page_size][::-1]
+    return KeysetPage(
+        rows,
+        next_cursor=encode_cursor('n', rows[-1]),
+        prev_cursor=encode_cursor('p', rows[0]),
+    )
+
+
+def paginate_keyset(queryset, cursor=None, page_size=None):
+    """
+    Seek-paginate queryset newest first on (created_at, id).
+
+    Each page is a single indexed range scan of page_size + 1 rows, so the
+    cost of page N does not depend on N the way OFFSET does.
+    """
+    page_size = page_size or get_page_size()
+    query, direction = _seek(queryset, decode_cursor(cursor), page_size)
+    page = _to_page(list(query), direction, page_size)
+    return page if page is not None else paginate_keyset(queryset, None, page_size)
+
+
+async def apaginate_keyset(queryset, cursor=None, page_size=None):
+    """paginate_keyset() for async views."""
+    page_size = page_size or get_page_size()
+    query, direction = _seek(queryset, decode_cursor(cursor), page_size)
+    page = _to_page([row async for row in query], direction, page_size)
+    return page if page is not None else await apaginate_keyset(queryset, None, page_size)
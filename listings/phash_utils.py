@@ -0,0 +1,152 @@
+# phash_utils.py
+"""
+Perceptual hashing for near-duplicate detection.
+
+A 64-bit dHash survives resizing and recompression, so two uploads of the
+same photo land within a few bits of each other. Stored hashes are kept in
+a multi-index hash table, which answers "everything within Hamming
+distance d" without comparing against every stored hash.
+"""
+import threading
+from itertools import combinations
+
+from PIL import Image
+
+HASH_SIZE = 8
+NEAR_DUPLICATE_DISTANCE = 6
+_SIGN_BIT = 1 << 63
+
+
+def dhash(img):
+    """64-bit difference hash of a PIL image."""
+    if hasattr(img, "draft"):
+        img.draft("L", ((HASH_SIZE + 1) * 8, HASH_SIZE * 8))
+    small = img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+    pixels = small.tobytes()
+
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def to_signed(value):
+    """Fit an unsigned 64-bit hash into a BigIntegerField."""
+    return value - (1 << 64) if value & _SIGN_BIT else value
+
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+class MultiIndexHash:
+    """
+    Multi-index hashing over 64-bit hashes with Hamming distance.
+
+    Each hash is split into CHUNKS 16-bit substrings, each with its own
+    table. Two hashes within distance r must agree on some chunk to within
+    r // CHUNKS bits (pigeonhole), so a query only probes those
+    near-identical buckets and verifies the few candidates it finds.
+    """
+
+    CHUNKS = 4
+    CHUNK_BITS = 64 // CHUNKS
+    _MASK = (1 << CHUNK_BITS) - 1
+
+    def __init__(self):
+        self._tables = [{} for _ in range(self.CHUNKS)]
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _chunks(self, value):
+        return [(value >> (i * self.CHUNK_BITS)) & self._MASK for i in range(self.CHUNKS)]
+
+    def add(self, value, key):
+        self._size += 1
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            table.setdefault(chunk, []).append((value, key))
+
+    def _probes(self, chunk, radius):
+        yield chunk
+        for r in range(1, radius + 1):
+            for bits in combinations(range(self.CHUNK_BITS), r):
+                flipped = chunk
+                for bit in bits:
+                    flipped ^= 1 << bit
+                yield flipped
+
+    def search(self, value, max_distance):
+        """Return [(distance, key), ...] for every stored hash within max_distance."""
+        radius = max_distance // self.CHUNKS
+        found = {}
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            for probe in self._probes(chunk, radius):
+                for stored, key in table.get(probe, ()):
+                    if key not in found:
+                        distance = hamming(value, stored)
+                        if distance <= max_distance:
+                            found[key] = distance
+        return [(distance, key) for key, distance in found.items()]
+
+
+class PerceptualIndex:
+    """
+    Process-wide multi-index hash of ImageBlob dHashes.
+
+    Built lazily and topped up with recently stored blobs, so blobs saved by
+    other workers are picked up without a full reload. Matches are re-checked
+    against the table, so collected blobs never match.
+    """
+
+    # Blobs can commit out of pk order, so each refresh re-reads this many
+    # pks below the newest one already indexed.
+    REFRESH_OVERLAP = 1000
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._hashes = MultiIndexHash()
+        self._loaded = set()
+        self._last_pk = 0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        from .models import ImageBlob
+
+        with self._lock:
+            rows = (ImageBlob.objects
+                    .filter(pk__gt=self._last_pk - self.REFRESH_OVERLAP, dhash__isnull=False)
+                    .order_by('pk').values_list('pk', 'dhash'))
+            for pk, value in rows.iterator():
+                if pk not in self._loaded:
+                    self._loaded.add(pk)
+                    self._hashes.add(to_unsigned(value), pk)
+                self._last_pk = max(self._last_pk, pk)
+
+    def nearest(self, value, max_distance=NEAR_DUPLICATE_DISTANCE):
+        """Return the closest live ImageBlob within max_distance, or None."""
+        from .models import ImageBlob
+
+        self.refresh()
+        candidates = self._hashes.search(value, max_distance)
+        if not candidates:
+            return None
+        live = ImageBlob.objects.in_bulk([pk for _, pk in candidates])
+        matches = [
+            (hamming(value, to_unsigned(blob.dhash)), blob.pk, blob)
+            for blob in live.values() if blob.dhash is not None
+        ]
+        matches = [m for m in matches if m[0] <= max_distance]
+        return min(matches)[2] if matches else None
+
+
+perceptual_index = PerceptualIndex()
@@ -1,34 +1,234 @@
 # security_utils.py
-import subprocess
+import queue
+import socket
+import struct
+import threading
+
+from django.conf import settings
+
+DEFAULT_CLAMD_SOCKET = "/var/run/clamav/clamd.ctl"
+CHUNK_SIZE = 64 * 1024
+
+
+class ClamdUnavailable(Exception):
+    """clamd could not be reached or dropped the connection mid-scan."""
+
+
+class ClamdClient:
+    """
+    Minimal clamd client speaking INSTREAM over a Unix socket.
+
+    Connections are opened in IDSESSION mode and kept in a small pool, so a
+    scan costs one round trip instead of a clamscan process that reloads the
+    whole signature database. Uploads are streamed chunk by chunk.
+    """
+
+    def __init__(self, path, timeout=30, pool_size=4):
+        self.path = path
+        self.timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        # Set once clamd has returned a verdict: from then on it is deployed,
+        # and a scan that can't complete is retried later rather than skipped
+        self.answered = False
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+            sock.sendall(b"zIDSESSION\0")
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait(), True
+        except queue.Empty:
+            return self._connect(), False
+
+    def _release(self, sock):
+        try:
+            self._pool.put_nowait(sock)
+        except queue.Full:
+            sock.close()
+
+    @staticmethod
+    def _read_reply(sock):
+        reply = b""
+        while not reply.endswith(b"\0"):
+            data = sock.recv(4096)
+            if not data:
+                raise ConnectionError("clamd closed the connection")
+            reply += data
+        # Session replies look like "<id>: stream: OK"
+        return reply[:-1].decode(errors="replace").split(": ", 1)[-1]
+
+    def _scan(self, sock, chunks):
+        sock.sendall(b"zINSTREAM\0")
+        for chunk in chunks:
+            for start in range(0, len(chunk), CHUNK_SIZE):
+                piece = chunk[start:start + CHUNK_SIZE]
+                sock.sendall(struct.pack("!L", len(piece)) + piece)
+        sock.sendall(struct.pack("!L", 0))
+        return self._read_reply(sock)
+
+    def scan_stream(self, chunks, rewind=None):
+        """
+        Scan an iterable of byte chunks; returns clamd's verdict, e.g.
+        "stream: OK" or "stream: Eicar-Test-Signature FOUND".
+
+        A pooled connection may have been closed by clamd's idle timeout;
+        the scan is then retried once on a new connection. The first chunk
+        is held so it can be resent as long as no other has been read. After
+        that a retry needs rewind, which must return a fresh chunk iterable.
+        """
+        chunks = iter(chunks)
+        held = next(chunks, b"")
+        for attempt in range(2):
+            try:
+                sock, pooled = self._acquire()
+            except OSError as exc:
+                raise ClamdUnavailable(str(exc)) from exc
+            pulled = False
+
+            def stream():
+                nonlocal pulled
+                yield held
+                for chunk in chunks:
+                    pulled = True
+                    yield chunk
+
+            try:
+                verdict = self._scan(sock, stream())
+            except OSError as exc:
+                sock.close()
+                if attempt == 0 and pooled and (not pulled or rewind is not None):
+                    if pulled:
+                        chunks = iter(rewind())
+                        held = next(chunks, b"")
+                    continue
+                raise ClamdUnavailable(str(exc)) from exc
+            self.answered = True
+            self._release(sock)
+            return verdict
+
+    def scan_file(self, file):
+        """Stream a (Django) file to clamd without reading it into memory."""
+        def chunks():
+            file.seek(0)
+            if hasattr(file, "chunks"):
+                return file.chunks(CHUNK_SIZE)
+            return iter(lambda: file.read(CHUNK_SIZE), b"")
+
+        try:
+            return self.scan_stream(chunks(), rewind=chunks)
+        finally:
+            file.seek(0)
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_clamd_client():
+    path = getattr(settings, "CLAMD_SOCKET", DEFAULT_CLAMD_SOCKET)
+    with _clients_lock:
+        if path not in _clients:
+            _clients[path] = ClamdClient(path)
+        return _clients[path]
+
+
+def _verdict_result(verdict):
+    if verdict.endswith(" OK"):
+        return True
+    if verdict.endswith(" FOUND"):
+        return "Malicious content detected!"
+    return f"Malware scan failed: {verdict}"
+
+
+def _check_header(header):
+    # Check for suspicious file headers
+    if b"MZ" in header or b"PK" in header:
+        return "File looks suspicious."
+    return True
+
+
+def _unscanned(client, error, header):
+    # The header check is only a stand-in where clamd isn't running at all.
+    # Once it has answered, losing it (a restart, a timeout) is transient:
+    # the caller retries the upload later instead of rejecting it.
+    if client.answered:
+        raise error
+    return _check_header(header)
+
 
 def scan_image_for_malware(file):
     """
-    Scan uploaded image using ClamAV or fallback.
+    Scan uploaded image using the clamd daemon or fallback.
+
+    Returns True or the reason the file is rejected. Raises
+    ClamdUnavailable if clamd, having answered before, can't be reached.
     """
 
+    client = get_clamd_client()
+
     # --------- ClamAV Scan ----------
     try:
-        process = subprocess.run(
-            ["clamscan", "-"],
-            input=file.read(),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        file.seek(0)
-
-        if "OK" in process.stdout.decode():
-            return True
-        else:
-            return "Malicious content detected!"
-    except Exception:
-        pass
+        return _verdict_result(client.scan_file(file))
+    except ClamdUnavailable as exc:
+        error = exc
 
     # --------- Fallback basic scan ----------
-    # Check for suspicious file headers
+    file.seek(0)
     header = file.read(32)
     file.seek(0)
+    return _unscanned(client, error, header)
 
-    if b"MZ" in header or b"PK" in header:
-        return "File looks suspicious."
 
-    return True
+def scan_stream_for_malware(chunks, rescan=None):
+    """
+    Same checks as scan_image_for_malware for a one-shot chunk iterator.
+
+    The iterator is always consumed to the end, even if clamd goes away
+    mid-stream, so callers can tee it into other consumers. If the scan
+    fails after part of the stream was sent, rescan() (when given) returns
+    the same bytes again, e.g. from a copy the caller spooled to disk.
+    Raises ClamdUnavailable as scan_image_for_malware does.
+    """
+    header = bytearray()
+
+    def watch():
+        for chunk in chunks:
+            if len(header) < 32:
+                header.extend(chunk[:32 - len(header)])
+            yield chunk
+
+    client = get_clamd_client()
+    stream = watch()
+    try:
+        verdict = client.scan_stream(stream)
+    except ClamdUnavailable as exc:
+        verdict, error = None, exc
+
+    # Drain whatever the scanner didn't read
+    for _ in stream:
+        pass
+
+    if verdict is None and rescan is not None:
+        try:
+            verdict = client.scan_stream(rescan(), rewind=rescan)
+        except ClamdUnavailable as exc:
+            error = exc
+
+    if verdict is not None:
+        return _verdict_result(verdict)
+    return _unscanned(client, error, bytes(header))
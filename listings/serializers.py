@@ -0,0 +1,47 @@
+# serializers.py
+from rest_framework import serializers
+
+from .models import Property, PropertyImage
+
+
+def requested_fields(request):
+    """Field names from ?fields=a,b,c, or None to return every field."""
+    value = request.query_params.get('fields') if request is not None else None
+    if not value:
+        return None
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class SparseFieldsMixin:
+    """Leaves out every field not named in the request's ?fields=."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        wanted = requested_fields(self.context.get('request'))
+        if wanted:
+            for name in set(self.fields) - wanted:
+                self.fields.pop(name)
+
+
+class PropertyImageSerializer(serializers.ModelSerializer):
+    """One photo with all of its variants; missing variants are null."""
+
+    class Meta:
+        model = PropertyImage
+        fields = ['image', 'mobile', 'webp', 'avif', 'width', 'height', 'mobile_width', 'mobile_height']
+
+
+class PropertySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    cover_image = PropertyImageSerializer(read_only=True)
+
+    class Meta:
+        model = Property
+        fields = ['id', 'title', 'location', 'price', 'bedrooms', 'available',
+                  'images_processing', 'created_at', 'version', 'cover_image']
+
+
+class PropertyDetailSerializer(PropertySerializer):
+    images = PropertyImageSerializer(many=True, read_only=True)
+
+    class Meta(PropertySerializer.Meta):
+        fields = PropertySerializer.Meta.fields + ['description', 'images']
@@ -0,0 +1,114 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .autocomplete import location_index
+from .blobs import release_blob
+from .cache_utils import get_computed
+from .jobs import discard_original
+from .models import ImageJob, Property, PropertyImage
+from .page_cache import touch_listing
+from .search import LOCATIONS_CACHE_KEY, forget_locations, get_search_backend
+from .stats import VALUE_FIELDS, listing_changed, listing_values, user_count_changed
+
+
+@receiver(post_delete, sender=PropertyImage)
+def release_image_blob(sender, instance, **kwargs):
+    if instance.blob_id is not None:
+        release_blob(instance.blob_id)
+
+
+@receiver(post_delete, sender=ImageJob)
+def discard_job_original(sender, instance, **kwargs):
+    # A running job's worker discards the original itself when it finishes
+    if instance.status != ImageJob.RUNNING:
+        name = instance.original.name
+        transaction.on_commit(lambda: discard_original(name))
+
+
+@receiver(post_save, sender=Property)
+@receiver(post_delete, sender=Property)
+def expire_property_pages(sender, instance, **kwargs):
+    touch_listing(instance.pk)
+
+
+@receiver(post_save, sender=PropertyImage)
+@receiver(post_delete, sender=PropertyImage)
+def expire_image_pages(sender, instance, **kwargs):
+    Property.touch(instance.property_id)
+    touch_listing(instance.property_id)
+
+
+@receiver(post_save, sender=Property)
+def index_property(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'title', 'description', 'location'} & set(update_fields):
+        return
+    get_search_backend().index(instance)
+    if instance.location_key not in get_computed(LOCATIONS_CACHE_KEY, {}):
+        forget_locations()
+
+
+@receiver(post_delete, sender=Property)
+def unindex_property(sender, instance, **kwargs):
+    get_search_backend().remove(instance.pk)
+
+
+LISTING_FIELDS = {'location', 'available', 'bedrooms'}
+
+
+def _touches_listing(update_fields):
+    return update_fields is None or bool(LISTING_FIELDS & set(update_fields))
+
+
+@receiver(pre_save, sender=Property)
+def remember_listing(sender, instance, update_fields=None, **kwargs):
+    instance._listed = None
+    if instance.pk is not None and _touches_listing(update_fields):
+        instance._listed = Property.objects.filter(pk=instance.pk).values(*VALUE_FIELDS).first()
+
+
+@receiver(post_save, sender=Property)
+def count_listed_location(sender, instance, update_fields=None, **kwargs):
+    if not _touches_listing(update_fields):
+        return
+    listed = getattr(instance, '_listed', None)
+    before = (listed['location_key'], listed['location']) if listed and listed['available'] else None
+    after = (instance.location_key, instance.location) if instance.available else None
+    if before != after:
+        changes = []
+        if before:
+            changes.append((*before, -1))
+        if after:
+            changes.append((*after, 1))
+        # A rolled-back save must not leave its counts in the trie
+        transaction.on_commit(lambda: location_index.apply(changes))
+
+
+@receiver(post_delete, sender=Property)
+def uncount_listed_location(sender, instance, **kwargs):
+    if instance.available:
+        changes = [(instance.location_key, instance.location, -1)]
+        transaction.on_commit(lambda: location_index.apply(changes))
+
+
+@receiver(post_save, sender=Property)
+def count_listing(sender, instance, update_fields=None, **kwargs):
+    if _touches_listing(update_fields):
+        listing_changed(getattr(instance, '_listed', None), listing_values(instance))
+
+
+@receiver(post_delete, sender=Property)
+def uncount_listing(sender, instance, **kwargs):
+    listing_changed(listing_values(instance), None)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def count_user(sender, created, **kwargs):
+    if created:
+        user_count_changed(1)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def uncount_user(sender, **kwargs):
+    user_count_changed(-1)
@@ -0,0 +1,176 @@
+# stats.py
+"""
+Monitor dashboard numbers, maintained as rows change so the page reads a
+few small rows instead of counting whole tables.
+
+Counter rows hold the totals. ListingStat rows hold listings, and how many
+of them are available, per day added, location and bedroom type. Signals
+apply the difference each save or delete makes, inside the transaction
+that makes it (Property.save() and deletes are atomic). Writes that skip
+save() or the signals, such as QuerySet.update() or raw SQL, make the
+numbers drift; the reconcile_stats command recounts everything and
+reports what it corrected.
+"""
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, F, Max, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Counter, ListingStat, Property
+
+PROPERTIES = 'properties'
+AVAILABLE = 'available_properties'
+USERS = 'users'
+COUNTERS = (PROPERTIES, AVAILABLE, USERS)
+VALUE_FIELDS = ('available', 'location_key', 'location', 'bedrooms', 'created_at')
+RECENT_DAYS = 14
+TOP_LOCATIONS = 10
+
+
+def listing_values(prop):
+    return {name: getattr(prop, name) for name in VALUE_FIELDS}
+
+
+def _contributions(values):
+    """{(dimension, bucket): (label, listings, available)} a listing adds to the stats."""
+    if values is None:
+        return {}
+    available = int(values['available'])
+    day = timezone.localdate(values['created_at']).isoformat()
+    return {
+        (ListingStat.DAY, day): (day, 1, available),
+        (ListingStat.LOCATION, values['location_key']): (values['location'], 1, available),
+        (ListingStat.BEDROOMS, values['bedrooms']): (values['bedrooms'], 1, available),
+    }
+
+
+def _bump(name, delta):
+    """Add delta to a counter; False if the counter doesn't exist yet."""
+    return not delta or bool(Counter.objects.filter(name=name).update(value=F('value') + delta))
+
+
+def _apply(key, label, listings, available):
+    dimension, bucket = key
+    changes = {'listings': F('listings') + listings, 'available': F('available') + available}
+    if label is not None:
+        changes['label'] = label
+    rows = ListingStat.objects.filter(dimension=dimension, bucket=bucket)
+    if not rows.update(**changes):
+        _, created = ListingStat.objects.get_or_create(
+            dimension=dimension, bucket=bucket,
+            defaults={'label': label or bucket, 'listings': listings, 'available': available},
+        )
+        if not created:  # another writer got there first
+            rows.update(**changes)
+
+
+def listing_changed(before, after):
+    """
+    Count a listing going from values before to values after (as from
+    listing_values(); None when there is no row).
+    """
+    counts = {
+        PROPERTIES: (after is not None) - (before is not None),
+        AVAILABLE: bool(after and after['available']) - bool(before and before['available']),
+    }
+    if not all([_bump(name, delta) for name, delta in counts.items()]):
+        # Never counted (a new database): count everything, this change included
+        reconcile()
+        return
+
+    old, new = _contributions(before), _contributions(after)
+    for key in old.keys() | new.keys():
+        old_label, old_listings, old_available = old.get(key, (None, 0, 0))
+        label, listings, available = new.get(key, (None, 0, 0))
+        if listings != old_listings or available != old_available or label not in (None, old_label):
+            _apply(key, label, listings - old_listings, available - old_available)
+
+
+def user_count_changed(delta):
+    if not _bump(USERS, delta):
+        reconcile()
+
+
+# -------------------------------------------------------------
+# RECONCILING
+# -------------------------------------------------------------
+def _recount():
+    """(counters, stats) counted from the tables, shaped like the stored rows."""
+    listings = Property.objects.all()
+    counters = {
+        PROPERTIES: listings.count(),
+        AVAILABLE: listings.filter(available=True).count(),
+        USERS: get_user_model().objects.count(),
+    }
+    counts = {'listings': Count('pk'), 'available': Count('pk', filter=Q(available=True))}
+    stats = {}
+    for row in listings.annotate(day=TruncDate('created_at')).values('day').annotate(**counts):
+        day = row['day'].isoformat()
+        stats[ListingStat.DAY, day] = (day, row['listings'], row['available'])
+    for row in listings.values('location_key').annotate(label=Max('location'), **counts):
+        stats[ListingStat.LOCATION, row['location_key']] = (row['label'], row['listings'], row['available'])
+    for row in listings.values('bedrooms').annotate(**counts):
+        stats[ListingStat.BEDROOMS, row['bedrooms']] = (row['bedrooms'], row['listings'], row['available'])
+    return counters, stats
+
+
+def reconcile():
+    """
+    Recount every counter and stat from the tables and store the results.
+    Returns [(name, stored, counted)] for each number that had drifted.
+    """
+    drifted = []
+    with transaction.atomic():
+        counters, stats = _recount()
+
+        stored = dict(Counter.objects.values_list('name', 'value'))
+        for name, value in counters.items():
+            if stored.get(name) != value:
+                drifted.append((name, stored.get(name), value))
+                Counter.objects.update_or_create(name=name, defaults={'value': value})
+
+        rows = {(row.dimension, row.bucket): row for row in ListingStat.objects.all()}
+        created, changed = [], []
+        for (dimension, bucket), (label, listings, available) in stats.items():
+            row = rows.pop((dimension, bucket), None)
+            if row is None:
+                drifted.append((f'{dimension} {label}', None, (listings, available)))
+                created.append(ListingStat(dimension=dimension, bucket=bucket, label=label,
+                                           listings=listings, available=available))
+            elif (row.label, row.listings, row.available) != (label, listings, available):
+                if (row.listings, row.available) != (listings, available):
+                    drifted.append((f'{dimension} {label}', (row.listings, row.available),
+                                    (listings, available)))
+                row.label, row.listings, row.available = label, listings, available
+                changed.append(row)
+        # What's left has no listings any more
+        for row in rows.values():
+            if row.listings or row.available:
+                drifted.append((f'{row.dimension} {row.label}', (row.listings, row.available), None))
+
+        ListingStat.objects.bulk_create(created)
+        ListingStat.objects.bulk_update(changed, ['label', 'listings', 'available'])
+        ListingStat.objects.filter(pk__in=[row.pk for row in rows.values()]).delete()
+    return drifted
+
+
+# -------------------------------------------------------------
+# DASHBOARD
+# -------------------------------------------------------------
+def dashboard():
+    """The monitor's numbers: counters, then listings per day, location and bedroom type."""
+    counters = dict(Counter.objects.values_list('name', 'value'))
+    if len(counters) < len(COUNTERS):
+        reconcile()
+        counters = dict(Counter.objects.values_list('name', 'value'))
+    stats = ListingStat.objects.filter(listings__gt=0)
+    return {
+        'total_props': counters[PROPERTIES],
+        'available': counters[AVAILABLE],
+        'total_users': counters[USERS],
+        'listings_per_day': stats.filter(dimension=ListingStat.DAY).order_by('-bucket')[:RECENT_DAYS],
+        'listings_per_location': stats.filter(dimension=ListingStat.LOCATION)
+                                      .order_by('-listings', 'label')[:TOP_LOCATIONS],
+        'listings_per_bedrooms': stats.filter(dimension=ListingStat.BEDROOMS).order_by('-listings', 'label'),
+    }
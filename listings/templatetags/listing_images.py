@@ -0,0 +1,11 @@
+from django import template
+
+from listings.html_utils import build_picture_tag
+
+register = template.Library()
+
+
+@register.simple_tag
+def picture(image, sizes="100vw", alt="Property image", css_class=""):
+    """{% picture image sizes="(max-width: 768px) 100vw, 33vw" alt=prop.title %}"""
+    return build_picture_tag(image, sizes=sizes, alt=alt, css_class=css_class)
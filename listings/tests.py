@@ -1,3 +1,1454 @@
-from django.test import TestCase
+import hashlib
+import os
+import random
+import shutil
+import socketserver
+import struct
+import tempfile
+import threading
+import time
+import types
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from PIL import Image, ImageChops, ImageDraw
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import Profile
+from config.cache_backends import SharedFileBasedCache, caches_from_url
+from config.database import sqlite_database
+from config.replicas import PIN_SESSION_KEY
+from . import image_utils, mail as listings_mail
+from .autocomplete import LocationTrie, location_index
+from .cache_utils import CLAIM_TIMEOUT, claim_hash, get_face_boxes, get_or_compute, release_hash
+from .image_utils import (
+    AVIF_AVAILABLE, _decode_near, encode_image, encode_to_target, process_images_batch,
+    render_variants, resize_and_optimize_image,
+)
+from .ingest_utils import ingest_upload
+from .jobs import STALE_AFTER, claim_next_job, enqueue_images, process_pending, run_jobs
+from .models import ImageBlob, ImageJob, Property, PropertyImage, QueuedMail
+from .page_cache import cache_stats
+from .pagination import _seek, apaginate_keyset, decode_cursor, paginate_keyset
+from .phash_utils import MultiIndexHash, dhash, hamming, perceptual_index
+from .quality_utils import SSIMReference
+from .search import correct_location, search_properties
+from .stats import dashboard, reconcile
+from .security_utils import ClamdUnavailable, get_clamd_client, scan_image_for_malware
+from .thumbnails import ThumbnailCache, get_thumbnail
+from .upscale_utils import LanczosUpscaler, ai_upscale
+
+
+def make_property(owner='landlord', with_image=True, **kwargs):
+    fields = {
+        'title': 'Flat',
+        'description': 'Nice flat',
+        'location': 'Kilimani',
+        'price': 10000,
+        'bedrooms': 'One bedroom',
+        'owner_name': owner,
+        'owner_phone': '0700000000',
+    }
+    fields.update(kwargs)
+    prop = Property.objects.create(**fields)
+    if with_image:
+        PropertyImage.objects.create(property=prop, image='property_images/flat.jpg')
+        prop.refresh_cover_image()
+    return prop
+
+
+def make_jpeg(name='photo.jpg', size=(64, 48), seed=0):
+    rng = random.Random(seed)
+    pixels = bytes(rng.randrange(256) for _ in range(size[0] * size[1] * 3))
+    buf = BytesIO()
+    Image.frombytes('RGB', size, pixels).save(buf, 'JPEG')
+    return SimpleUploadedFile(name, buf.getvalue(), content_type='image/jpeg')
+
+
+def make_photo(name='photo.jpg', size=(320, 240), seed=0, texture=0):
+    """Smooth, photo-like JPEG: a gradient with a few blocks, optionally under fine noise."""
+    rng = random.Random(seed)
+    img = Image.radial_gradient('L').resize(size).convert('RGB')
+    draw = ImageDraw.Draw(img)
+    for _ in range(6):
+        x, y = rng.randrange(size[0] - 40), rng.randrange(size[1] - 40)
+        draw.rectangle((x, y, x + rng.randrange(20, 60), y + rng.randrange(20, 60)),
+                       fill=tuple(rng.randrange(256) for _ in range(3)))
+    if texture:
+        img = Image.blend(img, Image.effect_noise(size, texture).convert('RGB'), 0.3)
+    buf = BytesIO()
+    img.save(buf, 'JPEG', quality=90)
+    return SimpleUploadedFile(name, buf.getvalue(), content_type='image/jpeg')
+
+
+def resized_copy(upload, size, quality=50):
+    buf = BytesIO()
+    Image.open(upload).resize(size).save(buf, 'JPEG', quality=quality)
+    upload.seek(0)
+    return SimpleUploadedFile(f'small_{upload.name}', buf.getvalue(), content_type='image/jpeg')
+
+
+class MediaRootMixin:
+    """Point MEDIA_ROOT at a throwaway directory for tests that store files."""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        cache.clear()
+        perceptual_index.reset()
+
+
+@override_settings(PAGE_CACHE_TIMEOUT=0)
+class ListingGridQueryTests(TestCase):
+    """The listing grids must cost the same number of queries however many cards they show."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('landlord', password='pass12345')
+        Profile.objects.create(user=self.user, user_type='landlord')
+
+    def assertConstantQueries(self, url, login=False):
+        if login:
+            self.client.force_login(self.user)
+        make_property()
+        cache.clear()
+        self.client.get(url)  # warm per-process caches
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(url)
+        baseline = len(ctx.captured_queries)
+
+        for _ in range(5):
+            make_property()
+        with self.assertNumQueries(baseline):
+            response = self.client.get(url)
+        self.assertContains(response, 'property_images/flat.jpg', count=6)
+
+    def test_home_show_all(self):
+        self.assertConstantQueries(reverse('home') + '?show=all')
+
+    def test_home_search(self):
+        self.assertConstantQueries(
+            reverse('home') + '?location=kilimani&bedrooms=1+Bedroom&price=10000'
+        )
+
+    def test_my_properties(self):
+        self.assertConstantQueries(reverse('my_properties'), login=True)
+
+    def test_search_seeks_the_location_index(self):
+        self.client.get(reverse('home') + '?location=kilimani&bedrooms=1+Bedroom&price=10000')
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('home') + '?location=kilimani&bedrooms=1+Bedroom&price=10000')
+        search = next(q['sql'] for q in ctx.captured_queries if '"location_key" IN' in q['sql'])
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {search}')
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('SEARCH listings_property USING INDEX property_location_idx', plan)
+
+    def test_cover_image_cleared_with_image(self):
+        prop = make_property()
+        prop.images.all().delete()
+        prop.refresh_from_db()
+        self.assertIsNone(prop.cover_image)
+
+
+class SharedCacheTests(TestCase):
+    """get_or_compute against a file cache shared the way workers share Redis."""
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location, ignore_errors=True)
+
+    def worker_cache(self):
+        # A separate backend instance per "worker", all on the same directory
+        return SharedFileBasedCache(self.location, {})
+
+    def test_caches_from_url(self):
+        self.assertEqual(caches_from_url('file:///var/tmp/c')['default']['LOCATION'], '/var/tmp/c')
+        self.assertEqual(caches_from_url('redis://localhost:6379/0')['default']['BACKEND'],
+                         'django.core.cache.backends.redis.RedisCache')
+        self.assertEqual(caches_from_url('')['default']['BACKEND'],
+                         'django.core.cache.backends.locmem.LocMemCache')
+        with self.assertRaises(ValueError):
+            caches_from_url('memcached://localhost')
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+
+        def compute():
+            calls.append(True)
+            time.sleep(0.2)
+            return 'value'
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                get_or_compute('key', compute, 60, backend=self.worker_cache())))
+            for _ in range(8)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, ['value'] * 8)
+        self.assertEqual(len(calls), 1)
+
+    def test_early_expiry(self):
+        backend = self.worker_cache()
+
+        def slow(value):
+            time.sleep(0.01)
+            return value
+
+        get_or_compute('key', lambda: slow(1), 60, backend=backend)
+        # Never early with beta 0, always with a huge one
+        self.assertEqual(get_or_compute('key', lambda: slow(2), 60, beta=0, backend=backend), 1)
+        self.assertEqual(get_or_compute('key', lambda: slow(2), 60, beta=1e9, backend=backend), 2)
+
+        # While another worker is refreshing, the current value is served
+        self.assertTrue(backend.add('compute_lock_key', True, 60))
+        self.assertEqual(get_or_compute('key', lambda: slow(3), 60, beta=1e9, backend=backend), 2)
+
+    def test_abandoned_lock_times_out(self):
+        backend = self.worker_cache()
+        backend.add('compute_lock_key', True, 60)
+        self.assertEqual(get_or_compute('key', lambda: 'mine', 60, lock_timeout=0.2, backend=backend), 'mine')
+
+
+class SqliteTuningTests(TestCase):
+
+    def test_connection_pragmas(self):
+        with connection.cursor() as cursor:
+            self.assertEqual(cursor.execute('PRAGMA synchronous').fetchone(), (1,))  # NORMAL
+            self.assertEqual(cursor.execute('PRAGMA cache_size').fetchone(), (-32000,))
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+    def test_file_databases_use_wal(self):
+        path = os.path.join(tempfile.mkdtemp(), 'db.sqlite3')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        options = sqlite_database(path)['OPTIONS']
+        wrapper = type(connections['default'])({**connection.settings_dict, 'NAME': path, 'OPTIONS': options})
+        wrapper.connect()
+        try:
+            self.assertEqual(wrapper.connection.execute('PRAGMA journal_mode').fetchone(), ('wal',))
+        finally:
+            wrapper.close()
+
+
+def replicate():
+    """Test stand-in for replication: copy the primary over the replica."""
+    connections['default'].ensure_connection()
+    connections['replica'].ensure_connection()
+    connections['default'].connection.backup(connections['replica'].connection)
+
+
+@override_settings(PAGE_CACHE_TIMEOUT=0)
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    A second SQLite file as the replica, updated only when replicate() is
+    called. It is registered after the test databases are set up, so the
+    test runner doesn't try to create it.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.replica_dir = tempfile.mkdtemp()
+        connections.settings['replica'] = {
+            **connections['default'].settings_dict,
+            'NAME': os.path.join(cls.replica_dir, 'replica.sqlite3'),
+        }
+        cls.databases = {*cls.databases, 'replica'}
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        del cls.databases
+        shutil.rmtree(cls.replica_dir)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user = User.objects.create_user('landlord', password='pass12345')
+        Profile.objects.create(user=self.user, user_type='landlord')
+        self.prop = make_property(title='Garden flat', with_image=False)
+        replicate()
+
+    def test_listing_pages_read_the_replica(self):
+        make_property(title='Roof flat', with_image=False)
+        home = reverse('home') + '?show=all'
+        self.assertNotContains(self.client.get(home), 'Roof flat')
+        self.assertNotContains(async_to_sync(AsyncClient().get)(home), 'Roof flat')
+        replicate()
+        self.assertContains(self.client.get(home), 'Roof flat')
+        # Outside a request everything reads the primary
+        Property.objects.filter(pk=self.prop.pk).update(title='Attic flat')
+        self.assertEqual(Property.objects.get(pk=self.prop.pk).title, 'Attic flat')
+
+    @override_settings(PAGE_CACHE_TIMEOUT=600)
+    def test_cached_renders_read_the_primary(self):
+        cache.clear()
+        prop = make_property(title='Roof flat', with_image=False)
+        # The replica hasn't caught up, but these are stored under the new version
+        self.assertContains(self.client.get(reverse('home') + '?show=all'), 'Roof flat')
+        self.assertContains(self.client.get(reverse('property_detail', args=[prop.pk])), 'Roof flat')
+        self.assertContains(self.client.get(reverse('api-property-list')), 'Roof flat')
+        self.assertContains(self.client.get(reverse('api-property-detail', args=[prop.pk])), 'Roof flat')
+        self.client.force_login(self.user)
+        self.assertContains(self.client.get(reverse('home') + '?q=roof'), 'Roof flat')
+
+    def test_landlord_reads_own_edits(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('edit_property', args=[self.prop.pk]), {
+            'title': 'Roof flat', 'description': 'Nice flat', 'location': 'Kilimani',
+            'price': 10000, 'bedrooms': 'One bedroom', 'owner_name': 'landlord',
+            'owner_phone': '0700000000',
+        })
+        self.assertRedirects(response, reverse('my_properties'), fetch_redirect_response=False)
+        self.assertContains(self.client.get(reverse('my_properties')), 'Roof flat')
+        self.assertContains(self.client.get(reverse('property_detail', args=[self.prop.pk])), 'Roof flat')
+
+        # Once the window has passed, the session reads the (still lagging) replica
+        session = self.client.session
+        session[PIN_SESSION_KEY] = time.time() - 1
+        session.save()
+        self.assertContains(self.client.get(reverse('my_properties')), 'Garden flat')
+
+    def test_get_requests_that_write_do_not_pin(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('my_properties'))
+        self.assertNotIn(PIN_SESSION_KEY, self.client.session)
+
+
+# The test cache is one process's LocMem, where page caching is off by default
+@override_settings(PAGE_CACHE_TIMEOUT=600)
+class PageCacheTests(MediaRootMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('tenant', password='pass12345')
+        Profile.objects.create(user=self.user, user_type='tenant')
+
+    def stats(self, name):
+        return next(s for s in cache_stats() if s['name'] == name)
+
+    def test_anonymous_pages_cached_until_a_listing_changes(self):
+        prop = make_property(title='Garden flat')
+        home = reverse('home') + '?show=all'
+        detail = reverse('property_detail', args=[prop.pk])
+        for url in (home, detail):
+            self.client.get(url)
+            with self.assertNumQueries(0):
+                self.assertContains(self.client.get(url), 'Garden flat')
+
+        # Unrelated and reordered parameters share the entry
+        with self.assertNumQueries(0):
+            self.client.get(home + '&utm_source=mail')
+
+        prop.title = 'Roof flat'
+        prop.save()
+        for url in (home, detail):
+            self.assertContains(self.client.get(url), 'Roof flat')
+        self.assertEqual(self.stats('home'), {'name': 'home', 'hits': 2, 'misses': 2, 'hit_rate': 0.5})
+
+        prop.images.all().delete()
+        self.assertContains(self.client.get(detail), 'Roof flat')
+        self.assertNotContains(self.client.get(home), 'property_images/flat.jpg')
+
+    @override_settings(LISTINGS_PAGE_SIZE=1)
+    def test_page_links_carry_only_the_search(self):
+        make_property(title='Garden flat')
+        make_property(title='Roof flat')
+        self.client.get(reverse('home') + '?show=%20all&utm_source=TRACKER&location=+')
+        response = self.client.get(reverse('home') + '?show=all')
+        self.assertContains(response, '?show=all&amp;cursor=')
+        self.assertNotContains(response, 'TRACKER')
+
+    def test_logged_in_users_share_the_listing_grid(self):
+        make_property(title='Garden flat')
+        url = reverse('home') + '?location=kilimani&bedrooms=1+Bedroom&price=10000'
+        self.client.get(url)
+        self.client.force_login(self.user)
+        with self.assertNumQueries(2):  # session, user with its profile
+            response = self.client.get(url)
+        self.assertContains(response, 'Garden flat')
+        self.assertContains(response, 'Hi, tenant!')
+        self.assertEqual(self.stats('listing_grid')['hits'], 1)
+
+        make_property(title='Balcony flat')
+        self.assertContains(self.client.get(url), 'Balcony flat')
+
+    def test_logged_in_users_skip_the_page_cache_without_loading_the_user(self):
+        self.client.get(reverse('about'))
+        self.client.force_login(self.user)
+        with self.assertNumQueries(1):  # session only
+            response = self.client.get(reverse('about'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stats('about')['hits'], 0)
+
+    def test_processed_photos_replace_placeholder(self):
+        prop = make_property(with_image=False)
+        enqueue_images(prop, [make_jpeg()])
+        url = reverse('property_detail', args=[prop.pk])
+        self.assertContains(self.client.get(url), 'still being processed')
+        process_pending()
+        response = self.client.get(url)
+        self.assertNotContains(response, 'still being processed')
+        self.assertContains(response, prop.images.get().webp.url)
+
+    def test_monitor_shows_hit_rates(self):
+        self.client.get(reverse('about'))
+        self.client.get(reverse('about'))
+        self.assertContains(self.client.get(reverse('monitor')), '<tr><td>about</td><td>1</td><td>1</td><td>50%</td></tr>', html=True)
+
+
+class PropertyApiTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_list_pages_newest_first_with_cover_variants(self):
+        props = [make_property(title=f'Flat {i}') for i in range(3)]
+        make_property(title='Let', available=False)
+        with self.settings(LISTINGS_PAGE_SIZE=2):
+            with self.assertNumQueries(1):
+                page = self.client.get(reverse('api-property-list')).json()
+            self.assertEqual([r['id'] for r in page['results']], [props[2].pk, props[1].pk])
+            self.assertEqual(page['results'][0]['cover_image']['image'],
+                             'http://testserver/media/property_images/flat.jpg')
+            self.assertIsNone(page['results'][0]['cover_image']['webp'])
+            rest = self.client.get(page['next']).json()
+        self.assertEqual([r['id'] for r in rest['results']], [props[0].pk])
+        self.assertNotIn('description', page['results'][0])
+
+    def test_sparse_fields(self):
+        prop = make_property()
+        response = self.client.get(reverse('api-property-list'), {'fields': 'id,price'})
+        self.assertEqual(response.json()['results'], [{'id': prop.pk, 'price': 10000}])
+        response = self.client.get(reverse('api-property-detail', args=[prop.pk]), {'fields': 'title,images'})
+        self.assertEqual(set(response.json()), {'title', 'images'})
+
+    def test_detail_etag_follows_row_version(self):
+        prop = make_property()
+        url = reverse('api-property-detail', args=[prop.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.json()['description'], 'Nice flat')
+        etag = response['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        version = Property.objects.get(pk=prop.pk).version
+        prop.price = 9000
+        prop.save()
+        self.assertEqual(prop.version, version + 1)  # counted by the database, read back
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.json()['price'], 9000)
+        etag = response['ETag']
+
+        PropertyImage.objects.create(property=prop, image='property_images/second.jpg')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(len(response.json()['images']), 2)
+        self.assertEqual(self.client.get(reverse('api-property-detail', args=[0])).status_code, 404)
+
+    def test_list_etag_and_payload_size(self):
+        prop = make_property()
+        url = reverse('api-property-list')
+        response = self.client.get(url)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        prop.title = 'Renamed'
+        prop.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.json()['results'][0]['title'], 'Renamed')
+
+        html = self.client.get(reverse('home') + '?show=all')
+        self.assertLess(len(response.content) * 5, len(html.content))
+
+
+class AsyncViewTests(MediaRootMixin, TestCase):
+    """The search, detail and autocomplete views under ASGI."""
+
+    def setUp(self):
+        super().setUp()
+        self.async_client = AsyncClient()
+        self.prop = make_property(title='Garden flat')
+
+    async def test_search_and_detail(self):
+        response = await self.async_client.get(
+            reverse('home') + '?location=kilimani&bedrooms=1+Bedroom&price=10000')
+        self.assertContains(response, 'Garden flat')
+        response = await self.async_client.get(reverse('home') + '?q=garden')
+        self.assertContains(response, 'Garden flat')
+        response = await self.async_client.get(reverse('property_detail', args=[self.prop.pk]))
+        self.assertContains(response, 'property_images/flat.jpg')
+        response = await self.async_client.get(reverse('property_detail', args=[self.prop.pk + 1]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_logged_in_home(self):
+        user = await User.objects.acreate_user('landlord', password='pass12345')
+        await Profile.objects.acreate(user=user, user_type='landlord')
+        await self.async_client.aforce_login(user)
+        response = await self.async_client.get(reverse('home') + '?show=all')
+        self.assertTrue(response.context['is_landlord'])
+        self.assertContains(response, 'Garden flat')
+
+    async def test_autocomplete(self):
+        response = await self.async_client.get(reverse('location_autocomplete'), {'q': 'kil'})
+        self.assertEqual(response.json()['results'][0], {'name': 'Kilimani', 'count': 1})
+
+
+class ContactTests(TestCase):
+
+    def test_mail_is_queued_and_sent_by_the_worker(self):
+        response = self.client.post(reverse('contact'), {
+            'name': 'Wanjiru', 'email': 'w@example.com', 'message': 'Is it still free?',
+        })
+        self.assertRedirects(response, reverse('contact'))
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(QueuedMail.objects.get().status, QueuedMail.PENDING)
+
+        call_command('send_queued_mail', '--once', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('Is it still free?', mail.outbox[0].body)
+        self.assertEqual(QueuedMail.objects.get().status, QueuedMail.SENT)
+
+    def test_failures_are_logged_and_retried(self):
+        queued = listings_mail.send_mail_later('Hi', 'Body', 'a@example.com', ['b@example.com'])
+        with mock.patch('listings.mail.send_mail', side_effect=OSError('no route')), \
+                self.assertLogs('listings.mail', 'ERROR'):
+            self.assertEqual(listings_mail.send_pending(max_attempts=2), 1)
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.error), (QueuedMail.PENDING, 'no route'))
+        # Not due again until the retry delay has passed
+        self.assertEqual(listings_mail.send_pending(), 0)
+
+        QueuedMail.objects.update(send_after=timezone.now())
+        with mock.patch('listings.mail.send_mail', side_effect=OSError('no route')), \
+                self.assertLogs('listings.mail', 'ERROR'):
+            listings_mail.send_pending(max_attempts=2)
+        self.assertEqual(QueuedMail.objects.get().status, QueuedMail.FAILED)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_stale_running_mail_is_requeued(self):
+        listings_mail.send_mail_later('Hi', 'Body', None, ['b@example.com'])
+        self.assertIsNotNone(listings_mail.claim_next_mail())
+        self.assertIsNone(listings_mail.claim_next_mail())
+        QueuedMail.objects.update(updated_at=timezone.now() - listings_mail.STALE_AFTER * 2)
+        self.assertEqual(listings_mail.requeue_stale_mail(), 1)
+        listings_mail.send_pending()
+        self.assertEqual(mail.outbox[0].from_email, settings.DEFAULT_FROM_EMAIL)
+
+
+class MonitorStatsTests(TestCase):
+
+    def stats(self, key):
+        return [(s.label, s.listings, s.available) for s in dashboard()[key]]
+
+    def test_counts_follow_saves_and_deletes(self):
+        User.objects.create_user('tenant', password='pass12345')
+        garden = make_property(title='Garden flat', with_image=False)
+        make_property(title='Roof flat', location='Westlands', bedrooms='Bedsitter', with_image=False)
+        garden.available = False
+        garden.save()
+        numbers = dashboard()
+        self.assertEqual((numbers['total_props'], numbers['available'], numbers['total_users']), (2, 1, 1))
+        self.assertEqual(self.stats('listings_per_location'), [('Kilimani', 1, 0), ('Westlands', 1, 1)])
+
+        garden.location = 'Lavington'
+        garden.available = True
+        garden.save()
+        self.assertEqual(self.stats('listings_per_location'), [('Lavington', 1, 1), ('Westlands', 1, 1)])
+        garden.delete()
+        self.assertEqual(self.stats('listings_per_bedrooms'), [('Bedsitter', 1, 1)])
+        self.assertEqual(self.stats('listings_per_day'), [(timezone.localdate().isoformat(), 1, 1)])
+        self.assertEqual(dashboard()['total_props'], 1)
+        self.assertEqual(reconcile(), [])
+
+    def test_reconcile_fixes_drift(self):
+        make_property(with_image=False)
+        Property.objects.update(available=False)  # no signals
+        out = StringIO()
+        call_command('reconcile_stats', stdout=out)
+        self.assertIn('available_properties: 1 -> 0', out.getvalue())
+        self.assertEqual(dashboard()['available'], 0)
+        self.assertEqual(reconcile(), [])
+
+    def test_monitor_reads_no_more_rows_as_listings_grow(self):
+        make_property(with_image=False)
+        self.client.get(reverse('monitor'))
+        for i in range(5):
+            make_property(location=f'Area {i}', with_image=False)
+        with self.assertNumQueries(5):  # counters, three breakdowns, latest listings
+            response = self.client.get(reverse('monitor'))
+        self.assertContains(response, '<h3>6</h3>', count=2)
+
+
+class NormalizeBedroomsTests(TestCase):
+
+    def test_free_form_input_maps_to_the_stored_choice(self):
+        for value, expected in [
+            ('Two bedroom', 'Two bedroom'),
+            ('  two   BEDROOM ', 'Two bedroom'),
+            ('Two Bedrooms', 'Two bedroom'),
+            ('2 Bedrooms', 'Two bedroom'),
+            ('1bedroom', 'One bedroom'),
+            ('6 bedrooms', 'Six bedroom'),
+            ('bedsitter', 'Bedsitter'),
+            ('single room', 'Single Room'),
+        ]:
+            with self.subTest(value=value):
+                self.assertEqual(Property.normalize_bedrooms(value), expected)
+
+    def test_unknown_input_is_none(self):
+        for value in (None, '', '   ', '0 bedrooms', '7 bedrooms', 'seven bedroom', 'penthouse', 'bedrooms'):
+            with self.subTest(value=value):
+                self.assertIsNone(Property.normalize_bedrooms(value))
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.flat = make_property(title='Sunny flat with balcony', location='Kilimani', with_image=False)
+        self.house = make_property(title='Family house', description='Quiet compound near Kilimani',
+                                   location='Westlands', with_image=False)
+
+    def test_ranked_full_text_search(self):
+        self.assertEqual(search_properties('kilimani'), [self.flat, self.house])
+        self.assertEqual(search_properties('balc'), [self.flat])
+        self.assertEqual(search_properties('sunny house'), [])
+
+    def test_unavailable_listings_dont_use_up_the_limit(self):
+        for _ in range(3):
+            make_property(title='Kilimani Kilimani garden flat', location='Kilimani',
+                          available=False, with_image=False)
+        self.assertEqual(search_properties('kilimani', limit=2, available=True), [self.flat, self.house])
+        response = self.client.get(reverse('home'), {'q': 'kilimani'})
+        self.assertEqual(response.context['properties'], [self.flat, self.house])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.flat.title = 'Penthouse'
+        self.flat.save()
+        self.assertEqual(search_properties('penthouse'), [self.flat])
+        self.assertEqual(search_properties('sunny'), [])
+
+        self.flat.delete()
+        self.assertEqual(search_properties('kilimani'), [self.house])
+
+    def test_misspelt_locations_are_corrected(self):
+        self.assertEqual(correct_location('Kilimanii'), ['kilimani'])
+        self.assertEqual(correct_location('westland'), ['westlands'])
+        self.assertEqual(correct_location('Zanzibar'), [])
+        self.assertEqual(search_properties('westlnads'), [self.house])
+
+        response = self.client.get(reverse('home'), {
+            'location': 'Kilimanii', 'bedrooms': 'One bedroom', 'price': '10000',
+        })
+        self.assertEqual(list(response.context['properties']), [self.flat])
+        self.assertContains(response, 'Showing results for <strong>Kilimani</strong>')
+
+    def test_keyword_search_on_home(self):
+        response = self.client.get(reverse('home'), {'q': 'family'})
+        self.assertEqual(response.context['properties'], [self.house])
+
+
+class LocationAutocompleteTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        location_index.reset()
+
+    def suggest(self, prefix):
+        response = self.client.get(reverse('location_autocomplete'), {'q': prefix})
+        return [(r['name'], r['count']) for r in response.json()['results']]
+
+    def test_ranks_by_listing_count_and_matches_word_starts(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            make_property(location='Kileleshwa')
+            make_property(location='Kileleshwa')
+            make_property(location='Kilimani')
+            make_property(location='Kilimani', available=False)
+
+        self.assertEqual(self.suggest('kil'), [('Kileleshwa', 2), ('Kilimani', 1), ('Kilifi', 0)])
+        self.assertEqual(self.suggest('riv'), [('Athi River', 0)])
+        self.assertEqual(self.suggest('k'), [])
+
+    def test_follows_saves_and_deletes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            prop = make_property(location='Kilimani')
+        self.assertEqual(self.suggest('kilim'), [('Kilimani', 1)])
+
+        prop.location = 'Ngara'
+        with self.captureOnCommitCallbacks(execute=True):
+            prop.save()
+        self.assertEqual(self.suggest('kilim'), [('Kilimani', 0)])
+        self.assertEqual(self.suggest('ng'), [('Ngara', 1), ('Ngong', 0)])
+
+        prop.available = False
+        with self.captureOnCommitCallbacks(execute=True):
+            prop.save()
+        self.assertEqual(self.suggest('ngar'), [('Ngara', 0)])
+        with self.captureOnCommitCallbacks(execute=True):
+            make_property(location='Ngara').delete()
+        self.assertEqual(self.suggest('ngar'), [('Ngara', 0)])
+
+    def test_rolled_back_saves_leave_counts_alone(self):
+        prop = make_property(location='Kilimani')
+        self.assertEqual(self.suggest('kilim'), [('Kilimani', 1)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    prop.location = 'Ngara'
+                    prop.save()
+                    make_property(location='Ngara')
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertEqual(self.suggest('kilim'), [('Kilimani', 1)])
+        self.assertEqual(self.suggest('ngar'), [])
+
+    def test_loading_at_once_matches_setting_one_by_one(self):
+        rng = random.Random(3)
+        items = [(f'{a} {b}', f'{a} {b}'.title(), rng.randrange(5))
+                 for a in ('kasa', 'kama', 'kil') for b in ('ni', 'rani', 'rongo')]
+        items += [('kasa ni', 'Kasa Ni', 7), ('', 'Blank', 1)]
+        one_by_one, at_once = LocationTrie(limit=3), LocationTrie(limit=3)
+        for item in items:
+            one_by_one.set(*item)
+        at_once.load(items)
+        for prefix in ('k', 'ka', 'kasa', 'r', 'ron', 'x'):
+            self.assertEqual(at_once.suggest(prefix), one_by_one.suggest(prefix))
+
+    def test_rebuilds_after_changes_from_another_process(self):
+        self.assertEqual(self.suggest('ngar'), [])
+        make_property(location='Ngara')
+        cache.incr('location_trie_version')  # as if another worker saved too
+        self.assertEqual(self.suggest('ngar'), [('Ngara', 1)])
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        self.props = [make_property(with_image=False, title=f'Flat {i}') for i in range(7)]
+        # Newest first, matching the feed order.
+        self.props.reverse()
+
+    def test_walks_forward_and_back(self):
+        qs = Property.objects.all()
+        first = paginate_keyset(qs, page_size=3)
+        self.assertEqual(list(first), self.props[:3])
+        self.assertFalse(first.has_previous)
+
+        second = paginate_keyset(qs, first.next_cursor, page_size=3)
+        self.assertEqual(list(second), self.props[3:6])
+
+        third = paginate_keyset(qs, second.next_cursor, page_size=3)
+        self.assertEqual(list(third), self.props[6:])
+        self.assertFalse(third.has_next)
+
+        back = paginate_keyset(qs, third.prev_cursor, page_size=3)
+        self.assertEqual(list(back), self.props[3:6])
+        self.assertEqual(list(paginate_keyset(qs, back.prev_cursor, page_size=3)), self.props[:3])
+
+    def test_next_pages_seek_the_feed_index(self):
+        feed = Property.objects.filter(available=True)
+        cursor = paginate_keyset(feed, page_size=3).next_cursor
+        for token in (cursor, paginate_keyset(feed, cursor, page_size=3).prev_cursor):
+            query, _ = _seek(feed, decode_cursor(token), 3)
+            self.assertIn('SEARCH listings_property USING INDEX property_feed_idx', query.explain())
+
+    def test_bad_cursor_serves_first_page(self):
+        page = paginate_keyset(Property.objects.all(), 'not-a-cursor', page_size=3)
+        self.assertEqual(list(page), self.props[:3])
+
+    def test_async_pages_match(self):
+        qs = Property.objects.all()
+        first = async_to_sync(apaginate_keyset)(qs, page_size=3)
+        self.assertEqual(list(first), self.props[:3])
+        second = async_to_sync(apaginate_keyset)(qs, first.next_cursor, page_size=3)
+        self.assertEqual(list(second), list(paginate_keyset(qs, first.next_cursor, page_size=3)))
+        back = async_to_sync(apaginate_keyset)(qs, second.prev_cursor, page_size=3)
+        self.assertEqual(list(back), self.props[:3])
+
+    @override_settings(LISTINGS_PAGE_SIZE=2)
+    def test_home_links_next_page(self):
+        response = self.client.get(reverse('home') + '?show=all')
+        page = response.context['page']
+        self.assertEqual(len(page), 2)
+        self.assertContains(response, f'cursor={page.next_cursor}')
+
+
+class ImageQueueTests(MediaRootMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('landlord', password='pass12345')
+        Profile.objects.create(user=self.user, user_type='landlord')
+        self.client.force_login(self.user)
+
+    def upload(self, *files):
+        return self.client.post(reverse('landlord_upload'), {
+            'title': 'Flat', 'description': 'Nice flat', 'location': 'Kilimani',
+            'price': 10000, 'bedrooms': 'One bedroom', 'owner_name': 'x',
+            'owner_phone': '0700000000', 'images': list(files),
+        })
+
+    def test_upload_only_queues_originals(self):
+        response = self.upload(make_jpeg('a.jpg'), make_jpeg('b.jpg', seed=1))
+        self.assertRedirects(response, reverse('home'))
+
+        prop = Property.objects.get()
+        self.assertTrue(prop.images_processing)
+        self.assertEqual(prop.image_jobs.filter(status=ImageJob.PENDING).count(), 2)
+        self.assertFalse(prop.images.exists())
+
+        response = self.client.get(reverse('home') + '?show=all')
+        self.assertContains(response, 'Processing photos')
+
+    def test_worker_builds_variants(self):
+        self.upload(make_jpeg('a.jpg'))
+        self.assertEqual(process_pending(), 1)
+
+        prop = Property.objects.get()
+        self.assertFalse(prop.images_processing)
+        image = prop.images.get()
+        self.assertEqual(prop.cover_image, image)
+        self.assertEqual((image.width, image.height), Image.open(image.image).size)
+        self.assertTrue(image.mobile.name.endswith('_mobile.jpg'))
+        self.assertTrue(image.webp.name.endswith('.webp'))
+        self.assertEqual(prop.image_jobs.get().status, ImageJob.DONE)
+        self.assertEqual(process_pending(), 0)
+
+    def test_rejected_and_duplicate_originals_are_deleted(self):
+        prop = make_property(with_image=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs = enqueue_images(prop, [
+                make_jpeg('a.jpg'), make_jpeg('copy.jpg'),
+                SimpleUploadedFile('evil.jpg', b'MZ\x90\x00 not an image'),
+            ])
+            process_pending()
+        names = [job.original.name for job in jobs]
+        statuses = [job.status for job in ImageJob.objects.order_by('pk')]
+        self.assertEqual(statuses, [ImageJob.DONE, ImageJob.DONE, ImageJob.FAILED])
+        # The first original is the blob's source; the others are gone
+        self.assertEqual([default_storage.exists(name) for name in names], [True, False, False])
+        self.assertEqual(list(ImageJob.objects.order_by('pk').values_list('original', flat=True)),
+                         [names[0], '', ''])
+
+    def test_waits_while_another_upload_encodes_the_same_file(self):
+        prop = make_property(with_image=False)
+        photo = make_jpeg('a.jpg')
+        img_hash = hashlib.sha256(photo.read()).hexdigest()
+        photo.seek(0)
+        job, = enqueue_images(prop, [photo])
+        claim_hash(img_hash)  # another worker is encoding it and hasn't stored it yet
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(process_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (ImageJob.PENDING, 0))
+        self.assertTrue(default_storage.exists(job.original.name))
+        self.assertTrue(Property.objects.get().images_processing)
+        self.assertEqual(process_pending(), 0)  # not until CLAIM_WAIT has passed
+
+        # That upload failed and let go of the claim: this one encodes the file itself
+        release_hash(img_hash)
+        ImageJob.objects.update(run_after=timezone.now())
+        process_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImageJob.DONE)
+        self.assertEqual(prop.images.get().blob.hash, img_hash)
+
+    def test_claims_expire_before_stale_jobs_are_requeued(self):
+        # Otherwise a job requeued after its worker crashed would wait on its own claim
+        self.assertLess(CLAIM_TIMEOUT, STALE_AFTER.total_seconds())
+
+    def test_replacing_photos_cancels_queued_and_running_jobs(self):
+        prop = make_property(owner='landlord', with_image=False)
+        enqueue_images(prop, [make_jpeg('a.jpg')])
+        running = claim_next_job()
+        queued, = enqueue_images(prop, [make_jpeg('b.jpg', seed=1)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('edit_property', args=[prop.pk]), {
+                'title': 'Flat', 'description': 'Nice flat', 'location': 'Kilimani',
+                'price': 10000, 'bedrooms': 'One bedroom', 'owner_name': 'landlord',
+                'owner_phone': '0700000000', 'images': [make_jpeg('c.jpg', seed=2)],
+            })
+        self.assertFalse(default_storage.exists(queued.original.name))
+
+        # The old run finishes after the edit and must not attach its photo
+        with self.captureOnCommitCallbacks(execute=True):
+            run_jobs([running])
+        self.assertFalse(default_storage.exists(running.original.name))
+        self.assertFalse(prop.images.exists())
+        self.assertEqual(ImageJob.objects.filter(status=ImageJob.CANCELLED).count(), 2)
+
+        process_pending()
+        self.assertEqual(prop.images.count(), 1)
+
+    def test_pages_serve_responsive_pictures(self):
+        self.upload(make_jpeg('a.jpg'))
+        process_pending()
+        image = Property.objects.get().images.get()
+
+        for url in (reverse('home') + '?show=all', reverse('property_detail', args=[image.property_id])):
+            response = self.client.get(url)
+            self.assertContains(response, f'<source media="(max-width: 768px)" srcset="{image.mobile.url}"', 1)
+            self.assertContains(response, f'<source type="image/webp" srcset="{image.webp.url}"', 1)
+            self.assertContains(response, f'width="{image.width}" height="{image.height}" loading="lazy"', 1)
+
+
+class ImageBatchTests(MediaRootMixin, TestCase):
+
+    def test_pool_matches_serial_and_skips_duplicates(self):
+        files = [make_jpeg('a.jpg'), make_jpeg('b.jpg', seed=9), make_jpeg('c.jpg')]
+        results = process_images_batch(files, workers=2, use_ai_upscale=False)
+
+        self.assertEqual([r["duplicate"] for r in results], [False, False, True])
+        self.assertEqual(results[0]["desktop"].name, "a_desktop.jpg")
+        self.assertEqual(Image.open(results[1]["mobile"]).size, (64, 48))
+
+        # The hashes stay claimed, so a later batch sees them as duplicates too
+        again = process_images_batch([make_jpeg('d.jpg', seed=9)], workers=1)
+        self.assertTrue(again[0]["duplicate"])
+
+    def test_worker_runs_batches(self):
+        prop = make_property(with_image=False)
+        enqueue_images(prop, [make_jpeg('a.jpg'), make_jpeg('b.jpg', seed=1)])
+        self.assertEqual(process_pending(workers=2), 2)
+        self.assertEqual(prop.images.count(), 2)
+
+
+class DecodeNearTests(TestCase):
+
+    def test_jpeg_is_decoded_at_a_draft_scale(self):
+        # Fitted in the box it is 600x450; 1/4 scale (1000x750) is the smallest draft covering that
+        img = _decode_near(make_photo(size=(4000, 3000)), (600, 600))
+        self.assertEqual((img.size, img.mode), ((1000, 750), 'RGB'))
+
+    def test_phone_photos_shrink_for_every_served_size(self):
+        photo = make_photo(size=(4000, 3000)).read()
+        for box in settings.THUMBNAIL_SIZES:
+            with self.subTest(box=box):
+                img = _decode_near(BytesIO(photo), box)
+                fitted = min(box[0] / 4000, box[1] / 3000) * 3000
+                self.assertLess(img.width, 4000)
+                self.assertTrue(fitted <= img.height < 2 * fitted)
+
+    def test_other_formats_are_reduced_by_a_whole_factor(self):
+        buf = BytesIO()
+        Image.open(make_photo(size=(4000, 3000))).save(buf, 'PNG')
+        img = _decode_near(buf, (600, 600))
+        self.assertEqual(img.size, (667, 500))
+
+    def test_sources_inside_the_box_are_decoded_whole(self):
+        self.assertEqual(_decode_near(make_photo(size=(320, 240)), (500, 500)).size, (320, 240))
+
+
+class EncoderTests(TestCase):
+
+    def setUp(self):
+        # Smooth gradient with detail, so quality actually changes the score
+        self.img = Image.radial_gradient('L').resize((320, 240)).convert('RGB')
+        self.img.paste(Image.open(make_jpeg(size=(80, 60))), (40, 40))
+
+    def test_quality_search_picks_smallest_passing_setting(self):
+        reference = SSIMReference(self.img)
+        for fmt in ('JPEG', 'WEBP') + (('AVIF',) if AVIF_AVAILABLE else ()):
+            data, quality = encode_to_target(self.img, fmt, 0.98, 95, reference)
+            self.assertGreaterEqual(reference.score(Image.open(BytesIO(data))), 0.98)
+            if quality > 40:
+                below = Image.open(BytesIO(encode_image(self.img, fmt, quality - 1)))
+                self.assertLess(reference.score(below), 0.98)
+
+    def test_quality_search_never_goes_above_the_fixed_quality(self):
+        reference = SSIMReference(self.img)
+        for fmt in ('JPEG', 'WEBP') + (('AVIF',) if AVIF_AVAILABLE else ()):
+            fixed = encode_image(self.img, fmt, 50)
+            # Out of reach at 50: the fixed setting is used as-is
+            data, quality = encode_to_target(self.img, fmt, 0.9999, 50, reference)
+            self.assertEqual((data, quality), (fixed, 50))
+            data, quality = encode_to_target(self.img, fmt, 0.9, 50, reference)
+            self.assertLessEqual(quality, 50)
+            self.assertLessEqual(len(data), len(fixed))
+
+    def test_avif_is_kept_only_when_smaller_than_webp(self):
+        encode = image_utils.encode_to_target
+
+        def avif_size(factor):
+            """encode_to_target, with the AVIF output factor times the WebP's size."""
+            sizes = {}
+
+            def fake(img, fmt, *args):
+                data, quality = encode(img, fmt, *args)
+                sizes[fmt] = len(data)
+                if fmt == 'AVIF':
+                    data = b'\0' * int(sizes['WEBP'] * factor)
+                return data, quality
+            return fake
+
+        source = BytesIO()
+        self.img.save(source, 'PNG')
+        with mock.patch.object(image_utils, 'AVIF_AVAILABLE', True):
+            with mock.patch.object(image_utils, 'encode_to_target', avif_size(1.5)):
+                self.assertEqual(render_variants(source.getvalue())['avif'], b'')
+            with mock.patch.object(image_utils, 'encode_to_target', avif_size(0.5)):
+                self.assertTrue(render_variants(source.getvalue())['avif'])
+
+    def test_jpeg_is_progressive_and_fixed_quality_still_works(self):
+        data, quality = encode_to_target(self.img, 'JPEG', None, 70)
+        self.assertEqual(quality, 70)
+        self.assertTrue(Image.open(BytesIO(data)).info.get('progressive'))
+
+
+class UpscaleTests(TestCase):
+
+    def test_skips_sources_that_already_fill_the_output(self):
+        img = Image.new('RGB', (1600, 900))
+        self.assertIs(ai_upscale(img, (1200, 1200)), img)
+
+    def test_tiles_match_a_whole_image_resize(self):
+        img = Image.open(make_jpeg(size=(300, 200))).convert('RGB')
+        seen = []
+
+        class RecordingUpscaler(LanczosUpscaler):
+            def upscale(self, tile):
+                seen.append(tile.size)
+                return super().upscale(tile)
+
+        out = ai_upscale(img, (1200, 1200), RecordingUpscaler())
+        self.assertEqual(out.size, (600, 400))
+        self.assertTrue(all(w <= 256 + 32 and h <= 256 + 32 for w, h in seen))
+        whole = img.resize((600, 400), Image.LANCZOS)
+        self.assertLessEqual(max(hi for _, hi in ImageChops.difference(out, whole).getextrema()), 2)
+
+
+class FakeFaceRecognition:
+    """Stands in for face_recognition (and numpy); reports one face and the input it saw."""
+
+    def __init__(self):
+        self.shapes = []
+
+    def asarray(self, img):
+        return types.SimpleNamespace(shape=(img.height, img.width, len(img.getbands())))
+
+    def face_locations(self, pixels):
+        self.shapes.append(pixels.shape)
+        height, width = pixels.shape[:2]
+        return [(height // 4, width * 5 // 8, height * 3 // 4, width * 3 // 8)]
+
+
+class FaceCropTests(MediaRootMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.faces = FakeFaceRecognition()
+        for name, value in (('face_recognition', self.faces), ('numpy', self.faces),
+                            ('FACE_LIB_AVAILABLE', True)):
+            patcher = mock.patch.object(image_utils, name, value, create=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.options = {"use_ai_upscale": False, "desktop_ssim": None, "mobile_ssim": None}
+
+    def test_detects_on_downscaled_copy_and_maps_boxes_back(self):
+        data = make_jpeg(size=(960, 720)).read()
+        variants = render_variants(data, self.options)
+
+        self.assertEqual(self.faces.shapes, [(360, 480, 3)])
+        self.assertEqual(variants["faces"], [(0.25, 0.625, 0.75, 0.375)])
+        self.assertEqual(variants["sizes"]["desktop"], (720, 720))
+
+    def test_known_boxes_skip_detection(self):
+        data = make_jpeg(size=(480, 360)).read()
+        boxes = [(0.1, 0.5, 0.5, 0.1)]
+        variants = render_variants(data, {**self.options, "face_boxes": boxes})
+        self.assertEqual(self.faces.shapes, [])
+        self.assertEqual(variants["faces"], boxes)
+        self.assertNotEqual(variants["sizes"]["desktop"], (480, 360))
+
+    def test_no_detection_without_the_library_or_with_cropping_off(self):
+        data = make_jpeg(size=(480, 360)).read()
+        with mock.patch.object(image_utils, 'FACE_LIB_AVAILABLE', False):
+            self.assertIsNone(render_variants(data, self.options)["faces"])
+        self.assertIsNone(render_variants(data, {**self.options, "use_face_preserve_crop": False})["faces"])
+        self.assertEqual(self.faces.shapes, [])
+
+    def test_detector_errors_leave_the_image_uncropped(self):
+        data = make_jpeg(size=(480, 360)).read()
+        with mock.patch.object(self.faces, 'face_locations', side_effect=RuntimeError):
+            with self.assertWarns(UserWarning):
+                variants = render_variants(data, self.options)
+        self.assertIsNone(variants["faces"])
+        self.assertEqual(variants["sizes"]["desktop"], (480, 360))
+
+    def test_boxes_are_cached_by_content_hash(self):
+        first = resize_and_optimize_image(make_jpeg('a.jpg', size=(480, 360)), **self.options)
+        self.assertEqual(get_face_boxes(first["hash"]), [(0.25, 0.625, 0.75, 0.375)])
+
+        release_hash(first["hash"])
+        again = resize_and_optimize_image(make_jpeg('b.jpg', size=(480, 360)), **self.options)
+        self.assertEqual(len(self.faces.shapes), 1)
+        self.assertEqual(again["width"], first["width"])
+
+
+class ImageBlobTests(MediaRootMixin, TestCase):
+
+    def test_identical_uploads_share_one_blob(self):
+        first, second = make_property(with_image=False), make_property(with_image=False)
+        enqueue_images(first, [make_jpeg('a.jpg')])
+        process_pending()
+        enqueue_images(second, [make_jpeg('copy.jpg')])
+        process_pending()
+
+        blob = ImageBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(
+            list(first.images.values_list('image', 'mobile', 'webp')),
+            list(second.images.values_list('image', 'mobile', 'webp')),
+        )
+
+        # Re-uploading to the same listing is still skipped
+        enqueue_images(second, [make_jpeg('again.jpg')])
+        process_pending()
+        self.assertEqual(second.images.count(), 1)
+
+    def test_deleting_last_listing_collects_blob(self):
+        first, second = make_property(with_image=False), make_property(with_image=False)
+        for prop in (first, second):
+            enqueue_images(prop, [make_jpeg('a.jpg')])
+            process_pending()
+        blob = ImageBlob.objects.get()
+        storage, path = blob.desktop.storage, blob.desktop.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(ImageBlob.objects.get().ref_count, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertFalse(storage.exists(path))
+
+
+class PerceptualDedupTests(MediaRootMixin, TestCase):
+
+    def test_index_matches_brute_force(self):
+        rng = random.Random(42)
+        values = [rng.getrandbits(64) for _ in range(2000)]
+        index = MultiIndexHash()
+        for i, value in enumerate(values):
+            index.add(value, i)
+
+        for probe in values[:20] + [rng.getrandbits(64) for _ in range(20)]:
+            expected = sorted((hamming(probe, v), i) for i, v in enumerate(values) if hamming(probe, v) <= 10)
+            self.assertEqual(sorted(index.search(probe, 10)), expected)
+
+    def test_resized_copy_on_another_listing_is_flagged_not_shared(self):
+        first, second = make_property(with_image=False), make_property(with_image=False)
+        enqueue_images(first, [make_photo('a.jpg')])
+        process_pending()
+        stored = ImageBlob.objects.get()
+
+        copy = resized_copy(make_photo('a.jpg'), (200, 150))
+        self.assertLessEqual(hamming(dhash(Image.open(make_photo())), dhash(Image.open(copy))), 6)
+        enqueue_images(second, [copy])
+        with self.assertLogs('listings.jobs', 'WARNING'):
+            process_pending()
+
+        # Each listing keeps its own photo; the copy is flagged for review
+        self.assertEqual(ImageBlob.objects.count(), 2)
+        blob = second.images.get().blob
+        self.assertNotEqual(blob, stored)
+        self.assertEqual(blob.near_duplicate_of, stored)
+        self.assertIn('another listing', second.image_jobs.get().error)
+
+    def test_resized_copy_on_the_same_listing_is_skipped(self):
+        prop = make_property(with_image=False)
+        enqueue_images(prop, [make_photo('a.jpg')])
+        process_pending()
+        enqueue_images(prop, [resized_copy(make_photo('a.jpg'), (200, 150))])
+        process_pending()
+        self.assertEqual(prop.images.count(), 1)
+        self.assertEqual(ImageBlob.objects.count(), 1)
+
+    def test_lookalike_with_different_detail_is_not_a_duplicate(self):
+        first, second = make_property(with_image=False), make_property(with_image=False)
+        enqueue_images(first, [make_photo('a.jpg')])
+        process_pending()
+
+        # Same layout, so the dHash matches, but a different picture up close
+        lookalike = make_photo('b.jpg', texture=80)
+        self.assertLessEqual(hamming(dhash(Image.open(make_photo())), dhash(Image.open(lookalike))), 6)
+        enqueue_images(second, [lookalike])
+        process_pending()
+        self.assertIsNone(second.images.get().blob.near_duplicate_of)
+
+    def test_batch_copy_is_kept_when_the_earlier_file_fails(self):
+        real_render = image_utils.render_variants
+        calls = []
+
+        def render_first_fails(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                raise ValueError("boom")
+            return real_render(*args, **kwargs)
+
+        files = [make_photo('a.jpg'), resized_copy(make_photo('a.jpg'), (200, 150))]
+        with mock.patch.object(image_utils, 'render_variants', render_first_fails):
+            results = process_images_batch(files, workers=1)
+        self.assertIn("error", results[0])
+        self.assertFalse(results[1]["duplicate"])
+        self.assertEqual(results[1]["near_duplicate_of"], results[0]["hash"])
+        self.assertTrue(results[1]["desktop"])
+
+
+class ThumbnailTests(MediaRootMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        prop = make_property(with_image=False)
+        enqueue_images(prop, [make_jpeg('a.jpg', size=(320, 240))])
+        process_pending()
+        self.blob = ImageBlob.objects.get()
+
+    def test_renders_from_original_and_revalidates(self):
+        self.assertTrue(self.blob.original.name.startswith('property_uploads/'))
+        url = reverse('thumbnail', args=[self.blob.hash, 160, 160, 'webp'])
+
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(Image.open(BytesIO(b''.join(response.streaming_content))).size, (160, 120))
+
+        again = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+        self.assertEqual(self.client.get(url.replace('.webp', '.gif')).status_code, 404)
+        for width, height in ((161, 160), (2400, 2400)):
+            response = self.client.get(reverse('thumbnail', args=[self.blob.hash, width, height, 'webp']))
+            self.assertEqual(response.status_code, 404)
+        with override_settings(THUMBNAIL_SIZES=[(161, 160)]):
+            response = self.client.get(reverse('thumbnail', args=[self.blob.hash, 161, 160, 'webp']))
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(reverse('thumbnail', args=['0' * 64, 160, 160, 'jpg'])).status_code, 404)
+
+    def test_transparent_sources_render_on_white(self):
+        from .thumbnails import render_thumbnail
+        source = BytesIO()
+        Image.new('RGBA', (200, 100), (255, 0, 0, 0)).save(source, 'PNG')
+        source.seek(0)
+        img = Image.open(BytesIO(render_thumbnail(source, 160, 160, 'jpg')))
+        self.assertEqual(img.size, (160, 80))
+        self.assertGreater(min(img.convert('L').getextrema()), 245)
+
+    def test_concurrent_requests_build_once(self):
+        from . import thumbnails
+        real_render = thumbnails.render_thumbnail
+        calls = []
+
+        def slow_render(*args):
+            calls.append(args[1:])
+            threading.Event().wait(0.2)
+            return real_render(*args)
+
+        with mock.patch.object(thumbnails, 'render_thumbnail', slow_render):
+            threads = [threading.Thread(target=get_thumbnail, args=(self.blob, 100, 100, 'jpg')) for _ in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(calls, [(100, 100, 'jpg')])
+
+    def test_evicts_least_recently_used(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        thumbs = ThumbnailCache(root, max_bytes=2500)
+
+        paths = [thumbs.path(f"{i:064x}", 10, 10, 'jpg') for i in range(3)]
+        for i, path in enumerate(paths[:2]):
+            thumbs.put(path, b'x' * 1000)
+            os.utime(path, (i, i))
+        thumbs.get(paths[0])
+        thumbs.put(paths[2], b'x' * 1000)
+
+        self.assertEqual([os.path.exists(p) for p in paths], [True, False, True])
+
+
+class FakeClamdHandler(socketserver.BaseRequestHandler):
+    """Speaks enough of the clamd protocol for IDSESSION + INSTREAM."""
+
+    def read_exact(self, n):
+        data = b""
+        while len(data) < n:
+            more = self.request.recv(n - len(data))
+            if not more:
+                raise EOFError
+            data += more
+        return data
+
+    def read_command(self):
+        command = b""
+        while not command.endswith(b"\0"):
+            command += self.read_exact(1)
+        return command[:-1]
+
+    def handle(self):
+        self.server.connections += 1
+        request_id = 0
+        try:
+            if self.read_command() != b"zIDSESSION":
+                return
+            while self.read_command() == b"zINSTREAM":
+                request_id += 1
+                data = b""
+                while True:
+                    (length,) = struct.unpack("!L", self.read_exact(4))
+                    if not length:
+                        break
+                    data += self.read_exact(length)
+                self.server.scanned.append(len(data))
+                if self.server.drop_replies:
+                    # Gone (idle timeout, restart) before answering
+                    self.server.drop_replies -= 1
+                    return
+                verdict = "Eicar-Test-Signature FOUND" if b"EICAR" in data else "OK"
+                self.request.sendall(f"{request_id}: stream: {verdict}\0".encode())
+                if request_id == self.server.scans_per_session:
+                    return
+        except EOFError:
+            pass
+
+
+class ClamdClientTests(MediaRootMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, ignore_errors=True)
+        self.socket_path = os.path.join(tmp, "clamd.sock")
+
+        override = override_settings(CLAMD_SOCKET=self.socket_path)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def start_server(self):
+        server = socketserver.ThreadingUnixStreamServer(self.socket_path, FakeClamdHandler)
+        server.daemon_threads = True
+        server.connections, server.scanned = 0, []
+        server.scans_per_session, server.drop_replies = None, 0
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(get_clamd_client().close)
+        return server
+
+    def test_streams_and_reuses_connection(self):
+        server = self.start_server()
+        big = SimpleUploadedFile("big.jpg", b"\xff\xd8" + b"x" * 300_000)
+
+        self.assertIs(scan_image_for_malware(big), True)
+        self.assertIs(scan_image_for_malware(make_jpeg()), True)
+        self.assertEqual(server.scanned[0], 300_002)
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(big.tell(), 0)
+
+    def test_detects_signature(self):
+        self.start_server()
+        infected = SimpleUploadedFile("x.jpg", b"\xff\xd8 EICAR test")
+        self.assertEqual(scan_image_for_malware(infected), "Malicious content detected!")
+
+    def test_falls_back_to_header_check_when_daemon_down(self):
+        self.assertIs(scan_image_for_malware(make_jpeg()), True)
+        self.assertEqual(
+            scan_image_for_malware(SimpleUploadedFile("x.jpg", b"MZ\x90\x00")),
+            "File looks suspicious.",
+        )
+
+    def test_idle_closed_session_is_redialled(self):
+        server = self.start_server()
+        server.scans_per_session = 1
+        for _ in range(3):
+            upload = ingest_upload(SimpleUploadedFile("x.jpg", b"\xff\xd8 EICAR test"))
+            upload.cleanup()
+            self.assertEqual(upload.scan_result, "Malicious content detected!")
+        self.assertEqual(server.connections, 3)
+
+    def test_dropped_scan_is_rescanned_from_spool(self):
+        server = self.start_server()
+        self.assertIs(scan_image_for_malware(make_jpeg()), True)
+        server.drop_replies = 1
+        payload = b"\xff\xd8" + os.urandom(200_000) + b"EICAR"
+        upload = ingest_upload(SimpleUploadedFile("big.jpg", payload))
+        self.addCleanup(upload.cleanup)
+        self.assertEqual(upload.scan_result, "Malicious content detected!")
+        self.assertEqual(server.scanned[1:], [len(payload), len(payload)])
+
+    def test_no_header_fallback_once_daemon_answered(self):
+        server = self.start_server()
+        self.assertIs(scan_image_for_malware(make_jpeg()), True)
+        server.shutdown()
+        server.server_close()
+        os.unlink(self.socket_path)
+        get_clamd_client().close()
+
+        with self.assertRaises(ClamdUnavailable):
+            ingest_upload(SimpleUploadedFile("x.jpg", b"\xff\xd8 EICAR test"))
+        with self.assertRaises(ClamdUnavailable):
+            scan_image_for_malware(make_jpeg())
+
+    def test_jobs_are_retried_when_clamd_drops_mid_batch(self):
+        server = self.start_server()
+        self.assertIs(scan_image_for_malware(make_jpeg()), True)
+        job, = enqueue_images(make_property(with_image=False), [make_jpeg('a.jpg', seed=4)])
+
+        server.drop_replies = 10  # clamd restarting: every reply is lost
+        with self.captureOnCommitCallbacks(execute=True), self.assertLogs('listings.jobs', 'ERROR'):
+            process_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (ImageJob.PENDING, 1))
+        self.assertTrue(default_storage.exists(job.original.name))
+
+        server.drop_replies = 0
+        ImageJob.objects.update(run_after=timezone.now())
+        process_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImageJob.DONE)
+        self.assertTrue(job.property.images.exists())
+
+    def test_ingest_hashes_scans_and_spools_in_one_pass(self):
+        server = self.start_server()
+        payload = b"\xff\xd8" + os.urandom(300_000)
+        upload = ingest_upload(SimpleUploadedFile("big.jpg", payload))
+        self.addCleanup(upload.cleanup)
+
+        self.assertIs(upload.scan_result, True)
+        self.assertEqual(upload.sha256, hashlib.sha256(payload).hexdigest())
+        self.assertEqual(upload.size, len(payload))
+        self.assertEqual(server.scanned, [len(payload)])
+        with open(upload.path, "rb") as f:
+            self.assertEqual(f.read(), payload)
+
+        upload.cleanup()
+        self.assertFalse(os.path.exists(upload.path))
@@ -0,0 +1,193 @@
+# thumbnails.py
+"""
+On-demand resized variants of stored images.
+
+/media/thumb/<hash>/<w>x<h>.<fmt> is rendered from the blob's original on
+first request and kept in a sharded, size-bounded disk cache, so new sizes
+need no reprocessing of the media library. Only the sizes listed in
+THUMBNAIL_SIZES are served; anything else would let a client make the
+server render and store as many variants as it can name. Builds of the
+same thumbnail are serialised through a lock file, so concurrent requests
+(from any worker process) wait for the first build instead of repeating it.
+"""
+import fcntl
+import hashlib
+import os
+import tempfile
+import threading
+import zlib
+from contextlib import contextmanager
+
+from django.conf import settings
+from PIL import Image
+
+from .image_utils import AVIF_AVAILABLE, DEFAULT_OPTIONS, _decode_near, _flatten, encode_image
+
+# Bump when the encoder settings change, so clients drop stale copies
+THUMBNAIL_VERSION = 3
+# (width, height) boxes served by default; override with THUMBNAIL_SIZES
+SIZES = [(160, 160), (360, 360), (720, 720), (1200, 1200)]
+FORMATS = {
+    'jpg': ('JPEG', 'image/jpeg', DEFAULT_OPTIONS["jpeg_quality"]),
+    'webp': ('WEBP', 'image/webp', DEFAULT_OPTIONS["webp_quality"]),
+}
+if AVIF_AVAILABLE:
+    FORMATS['avif'] = ('AVIF', 'image/avif', DEFAULT_OPTIONS["avif_quality"])
+LOCK_STRIPES = 64
+
+
+def is_served(width, height, fmt):
+    sizes = getattr(settings, 'THUMBNAIL_SIZES', SIZES)
+    return fmt in FORMATS and (width, height) in {tuple(size) for size in sizes}
+
+
+def thumbnail_etag(img_hash, width, height, fmt):
+    key = f"{img_hash}:{width}x{height}:{fmt}:v{THUMBNAIL_VERSION}"
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def render_thumbnail(source, width, height, fmt):
+    """Fit source (a file object) inside width x height; never upscales."""
+    pil_format, _, quality = FORMATS[fmt]
+    img = _flatten(_decode_near(source, (width, height)))
+    img.thumbnail((width, height), Image.LANCZOS)
+    return encode_image(img, pil_format, quality)
+
+
+class ThumbnailCache:
+    """
+    Derived images on local disk under root/<h[:2]>/<h[2:4]>/.
+
+    Reads bump a file's mtime, and once the cache grows past max_bytes the
+    least recently used files are removed until it is back under 90%.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = str(root)
+        self.max_bytes = max_bytes
+        self._size = None
+        self._size_lock = threading.Lock()
+
+    def path(self, img_hash, width, height, fmt):
+        # Versioned, so renders from older encoder settings age out of the cache
+        name = f"{img_hash}_{width}x{height}_v{THUMBNAIL_VERSION}.{fmt}"
+        return os.path.join(self.root, img_hash[:2], img_hash[2:4], name)
+
+    def get(self, path):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    @contextmanager
+    def lock(self, path):
+        stripe = zlib.crc32(os.path.basename(path).encode()) % LOCK_STRIPES
+        lock_dir = os.path.join(self.root, '.locks')
+        os.makedirs(lock_dir, exist_ok=True)
+        with open(os.path.join(lock_dir, str(stripe)), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def put(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+        with self._size_lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(data)
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def _entries(self):
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            for name in filenames:
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield st.st_mtime, st.st_size, path
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Remove least recently used files until the cache is under 90% of max_bytes."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        with self._size_lock:
+            self._size = total
+
+    def discard(self, img_hash):
+        """Drop every cached size of one image."""
+        shard = os.path.join(self.root, img_hash[:2], img_hash[2:4])
+        try:
+            names = os.listdir(shard)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name.startswith(f"{img_hash}_"):
+                try:
+                    os.unlink(os.path.join(shard, name))
+                except FileNotFoundError:
+                    pass
+        with self._size_lock:
+            self._size = None
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_thumbnail_cache():
+    root = getattr(settings, 'THUMBNAIL_CACHE_DIR', None) or os.path.join(settings.MEDIA_ROOT, 'thumb_cache')
+    max_bytes = getattr(settings, 'THUMBNAIL_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+    with _caches_lock:
+        key = (str(root), max_bytes)
+        if key not in _caches:
+            _caches[key] = ThumbnailCache(root, max_bytes)
+        return _caches[key]
+
+
+def get_thumbnail(blob, width, height, fmt):
+    """Return the cache path of blob's thumbnail, building it if needed."""
+    cache = get_thumbnail_cache()
+    path = cache.path(blob.hash, width, height, fmt)
+    if cache.get(path):
+        return path
+
+    with cache.lock(path):
+        # Another request may have built it while we waited
+        if cache.get(path):
+            return path
+        source = blob.original or blob.desktop
+        with source.open('rb') as f:
+            data = render_thumbnail(f, width, height, fmt)
+        cache.put(path, data)
+    return path
@@ -1,16 +1,112 @@
 # upscale_utils.py
-from PIL import Image
-
 """
-Using lightweight ESRGAN model or fallback sharpen
+Upscaling for sources smaller than the largest output size.
+
+The image is processed in fixed-size tiles (with a margin that is cropped
+away after scaling, so tile seams don't show), so the model only ever sees
+TILE_SIZE pixels at a time. Any backend with a `scale` attribute and an
+`upscale(tile)` method can be plugged in: the default is a LANCZOS resize,
+and OnnxUpscaler runs an ESRGAN-lite style model on the CPU.
 """
+from PIL import Image
 
-def ai_upscale(image):
-    try:
-        # Placeholder: integrate ESRGAN-lite model
-        # For now, perform a mild upscale & sharpen
-        w, h = image.size
-        image = image.resize((w * 2, h * 2), Image.LANCZOS)
+TILE_SIZE = 256
+TILE_MARGIN = 16
+
+
+class LanczosUpscaler:
+    """Fallback backend: plain 2x LANCZOS resize."""
+
+    scale = 2
+
+    def upscale(self, tile):
+        return tile.resize((tile.width * self.scale, tile.height * self.scale), Image.LANCZOS)
+
+
+class OnnxUpscaler:
+    """
+    Super-resolution ONNX model run with onnxruntime on the CPU.
+
+    The model must take an NCHW float32 RGB tensor in [0, 1] and return one
+    `scale` times larger in the same layout.
+    """
+
+    def __init__(self, model_path, scale=2, threads=None):
+        import numpy
+        import onnxruntime
+
+        self._np = numpy
+        session_options = onnxruntime.SessionOptions()
+        if threads:
+            session_options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            model_path, session_options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+        self.scale = scale
+
+    def upscale(self, tile):
+        np = self._np
+        data = np.asarray(tile.convert("RGB"), dtype=np.float32).transpose(2, 0, 1)[None] / 255.0
+        out = self.session.run(None, {self.input_name: data})[0][0]
+        out = (np.clip(out, 0.0, 1.0).transpose(1, 2, 0) * 255.0).round().astype(np.uint8)
+        return Image.fromarray(out, "RGB")
+
+
+_upscalers = {}
+
+
+def get_upscaler(model_path=None, scale=2):
+    """Backend for model_path (cached per process); LANCZOS when unset or unusable."""
+    key = (model_path, scale)
+    if key not in _upscalers:
+        backend = LanczosUpscaler()
+        if model_path:
+            try:
+                backend = OnnxUpscaler(model_path, scale=scale)
+            except Exception:
+                # onnxruntime/numpy missing or an unreadable model
+                pass
+        _upscalers[key] = backend
+    return _upscalers[key]
+
+
+def needs_upscale(size, target_size):
+    """True if size fits inside target_size with room to spare on both sides."""
+    return size[0] < target_size[0] and size[1] < target_size[1]
+
+
+def _tiles(length, tile):
+    for start in range(0, length, tile):
+        yield start, min(start + tile, length)
+
+
+def tiled_upscale(image, backend, tile=TILE_SIZE, margin=TILE_MARGIN):
+    """Upscale image tile by tile; peak extra memory is one scaled tile."""
+    scale = backend.scale
+    width, height = image.size
+    out = Image.new(image.mode, (width * scale, height * scale))
+
+    for top, bottom in _tiles(height, tile):
+        for left, right in _tiles(width, tile):
+            # Scale a padded tile, then keep only its centre
+            box = (max(left - margin, 0), max(top - margin, 0),
+                   min(right + margin, width), min(bottom + margin, height))
+            scaled = backend.upscale(image.crop(box))
+            inner = ((left - box[0]) * scale, (top - box[1]) * scale,
+                     (right - box[0]) * scale, (bottom - box[1]) * scale)
+            out.paste(scaled.crop(inner), (left * scale, top * scale))
+    return out
+
+
+def ai_upscale(image, target_size=None, backend=None):
+    """
+    Upscale image if it is smaller than target_size (always, when no target
+    is given). Falls back to the original image on any backend error.
+    """
+    if target_size is not None and not needs_upscale(image.size, target_size):
         return image
+    try:
+        return tiled_upscale(image, backend or get_upscaler())
     except Exception:
         return image
@@ -1,5 +1,10 @@
 from django.urls import path
-from . import views
+from rest_framework.routers import SimpleRouter
+
+from . import api, views
+
+router = SimpleRouter()
+router.register(f'api/{api.API_VERSION}/properties', api.PropertyViewSet, basename='api-property')
 
 urlpatterns = [
     path('', views.home, name='home'),
@@ -12,4 +17,8 @@ urlpatterns = [
     path('logout/', views.logout_view, name='logout'),
     path('property/<int:pk>/edit/', views.edit_property, name='edit_property'),
     path('property/<int:pk>/delete/', views.delete_property, name='delete_property'),
-]
\ No newline at end of file
+    path('locations/autocomplete/', views.location_autocomplete, name='location_autocomplete'),
+    path('media/thumb/<str:img_hash>/<int:width>x<int:height>.<str:fmt>', views.thumbnail, name='thumbnail'),
+]
+
+urlpatterns += router.urls
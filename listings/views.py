@@ -1,22 +1,26 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, aget_object_or_404, get_object_or_404
+from django.template.loader import render_to_string
+from django.http import FileResponse, Http404, JsonResponse, QueryDict
+from django.views.decorators.http import etag, require_safe
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.core.mail import send_mail
 from django.conf import settings
-from django.db.models import Q
 
-from .models import Property, PropertyImage
+from .autocomplete import location_index
+from .models import ImageBlob, Property, normalize_location
 from .forms import PropertyForm
-from accounts.models import Profile
-
-# Remove old utils import if replaced
-# from listings.utils import resize_image  # ❌ remove this
-
-# Correct import for the new image processing function
-from listings.image_utils import resize_and_optimize_image
+from .jobs import cancel_jobs, enqueue_images
+from .mail import send_mail_later
+from .page_cache import acached_fragment, cache_anonymous_page, cache_stats, listings_version, property_version
+from .pagination import apaginate_keyset, paginate_keyset
+from .search import correct_location, known_locations, search_properties
+from .stats import dashboard
+from .thumbnails import FORMATS, get_thumbnail, is_served, thumbnail_etag
 
 # Optional template helper
 from listings.html_utils import build_picture_tag
+from accounts.middleware import aload_user
 
 
 
@@ -34,7 +38,8 @@ def contact(request):
             subject = f'iRent ProSpace message from {name}'
             body    = f'Name: {name}\nEmail: {email}\n\nMessage:\n{message}'
 
-            send_mail(subject, body, settings.DEFAULT_FROM_EMAIL, [settings.DEFAULT_FROM_EMAIL])
+            # Queued for the send_queued_mail worker; the visitor doesn't wait on SMTP
+            send_mail_later(subject, body, settings.DEFAULT_FROM_EMAIL, [settings.DEFAULT_FROM_EMAIL])
             messages.success(request, 'Thank you! Your message has been sent.')
             return redirect('contact')
 
@@ -47,76 +52,126 @@ def contact(request):
 # -------------------------------------------------------------
 # HOME + SEARCH (ULTRA STRICT - EXACT MATCHES ONLY)
 # -------------------------------------------------------------
-def home(request):
-    # Check user type
-    is_landlord = False
-    if request.user.is_authenticated:
-        profile, _ = Profile.objects.get_or_create(user=request.user, defaults={'user_type': 'tenant'})
-        is_landlord = profile.user_type == 'landlord'
-
-    # Get search parameters
-    location = request.GET.get('location', '').strip()
-    bedrooms = request.GET.get('bedrooms', '')
-    price    = request.GET.get('price', '')
-    show_all = request.GET.get('show', '') == 'all'
+SEARCH_PARAMS = ('location', 'bedrooms', 'price', 'show', 'q', 'cursor')
+
+
+def _search_key(params):
+    """The search parameters the results depend on, stripped and in a fixed order."""
+    return [(name, params.get(name, '').strip()) for name in SEARCH_PARAMS]
+
+
+def _search_query(search):
+    """
+    The search alone as a QueryDict for the grid's page links. Cached pages
+    are shared by every request with the same search, so the links mustn't
+    carry anything else from the request that rendered them.
+    """
+    query = QueryDict(mutable=True)
+    for name, value in search.items():
+        if value and name != 'cursor':
+            query[name] = value
+    return query
+
+
+def _correct_location(location):
+    """(location keys to search, their display names if location was misspelt)."""
+    location_keys = correct_location(location)
+    corrected_location = None
+    if location_keys and location_keys[0] != normalize_location(location):
+        corrected_location = ', '.join(known_locations()[key] for key in location_keys)
+    return location_keys, corrected_location
+
+
+async def _listing_results(request):
+    """Context for the listing grid matching the search in request.GET."""
+    # Get search parameters (exactly what the cache keys hold)
+    search   = dict(_search_key(request.GET))
+    location = search['location']
+    bedrooms = search['bedrooms']
+    price    = search['price']
+    show_all = search['show'] == 'all'
+    query    = search['q']
 
     # Start with available properties
     qs = Property.objects.filter(available=True)
 
     # If "show all" button was clicked, show all properties
     if show_all:
-        return render(request, 'listings/home.html', {
-            'properties': qs.order_by('-created_at'),
-            'bedroom_choices': Property.PROPERTY_TYPES,
-            'is_landlord': is_landlord,
-            'show_all': True,
-        })
+        page = await apaginate_keyset(qs.select_related('cover_image'), search['cursor'])
+        return {'properties': page, 'page': page, 'query': _search_query(search)}
+
+    # Keyword search: ranked by relevance, typos in locations tolerated
+    # (the FTS query is raw SQL, so it runs on the sync thread)
+    if query:
+        return {
+            'properties': await sync_to_async(search_properties)(
+                query, qs.select_related('cover_image'), available=True,
+            ),
+            'search_query': query,
+        }
 
     # If ALL THREE criteria are NOT provided, show NO results
     if not (location and bedrooms and price):
-        return render(request, 'listings/home.html', {
-            'properties': Property.objects.none(),
-            'bedroom_choices': Property.PROPERTY_TYPES,
-            'is_landlord': is_landlord,
-            'search_location': location,
-            'search_bedrooms': bedrooms,
-            'search_price': price,
-        })
+        return {'properties': []}
 
     # Parse price
     try:
         price_int = int(price)
     except ValueError:
         # Invalid price - show no results
-        return render(request, 'listings/home.html', {
-            'properties': Property.objects.none(),
-            'bedroom_choices': Property.PROPERTY_TYPES,
-            'is_landlord': is_landlord,
-            'search_location': location,
-            'search_bedrooms': bedrooms,
-            'search_price': price,
-        })
+        return {'properties': []}
 
     # ULTRA STRICT FILTERING - ALL CONDITIONS MUST MATCH
-    filtered_qs = qs.filter(
-        Q(location__iexact=location) |  # Exact location match (case insensitive)
-        Q(location__icontains=location),  # Or contains the location
-        bedrooms__iexact=bedrooms,  # Exact bedroom type match
-        price__lte=price_int,  # Price must be less than or equal to search price
-        price__gte=(price_int * 0.8)  # Price must be at least 80% of search price
-    )
+    # Inputs are case-folded to the stored keys so the lookups are plain
+    # equality/range comparisons that hit the search indexes. A misspelt
+    # location is matched to the closest known one(s).
+    bedroom_choice = Property.normalize_bedrooms(bedrooms)
+    location_keys, corrected_location = await sync_to_async(_correct_location)(location)
 
-    # If no matches with strict criteria, return empty
-    if not filtered_qs.exists():
+    if bedroom_choice is None or not location_keys:
         filtered_qs = Property.objects.none()
+    else:
+        filtered_qs = qs.filter(
+            location_key__in=location_keys,  # Location match (case and typo insensitive)
+            bedrooms=bedroom_choice,  # Exact bedroom type match
+            price__lte=price_int,  # Price must be less than or equal to search price
+            price__gte=(price_int * 8 + 9) // 10  # Price must be at least 80% of search price
+        )
+
+    page = await apaginate_keyset(filtered_qs.select_related('cover_image'), search['cursor'])
+    return {
+        'properties': page,
+        'page': page,
+        'query': _search_query(search),
+        'search_location': location,
+        'corrected_location': corrected_location,
+    }
+
+
+async def _render_listing_grid(request):
+    return render_to_string('listings/listing_grid.html', await _listing_results(request), request)
 
+
+@cache_anonymous_page('home', key=lambda request: [listings_version(), _search_key(request.GET)])
+async def home(request):
+    # Check user type (loaded with the user; see accounts.middleware)
+    await aload_user(request)
+    is_landlord = bool(request.profile and request.profile.is_landlord)
+
+    # The grid is the same for everyone running the same search
+    listing_grid = await acached_fragment(
+        'listing_grid',
+        [await sync_to_async(listings_version)(), _search_key(request.GET), is_landlord],
+        lambda: _render_listing_grid(request),
+    )
+    search = dict(_search_key(request.GET))
     return render(request, 'listings/home.html', {
-        'properties': filtered_qs.order_by('-created_at'),
+        'listing_grid': listing_grid,
         'bedroom_choices': Property.PROPERTY_TYPES,
         'is_landlord': is_landlord,
-        'search_location': location,
-        'search_bedrooms': bedrooms,
-        'search_price': price,
+        'search_location': search['location'],
+        'search_bedrooms': search['bedrooms'],
+        'search_price': search['price'],
     })
 
 
@@ -126,7 +181,7 @@ def home(request):
 
 @login_required
 def landlord_upload(request):
-    if not Profile.objects.filter(user=request.user, user_type='landlord').exists():
+    if not (request.profile and request.profile.is_landlord):
         return redirect('home')
 
     if request.method == 'POST':
@@ -138,29 +193,13 @@ def landlord_upload(request):
             prop.owner_name = request.user.username
             prop.save()
 
-            for f in files:
-                processed = resize_and_optimize_image(f)
-
-                # Malware detection
-                if "error" in processed:
-                    messages.error(request, processed["error"])
-                    continue
-
-                # Duplicate detection
-                if processed.get("duplicate"):
-                    messages.warning(request, "Duplicate image skipped.")
-                    continue
-
-                # Save the processed versions
-                PropertyImage.objects.create(property=prop, image=processed["desktop"])
-                PropertyImage.objects.create(property=prop, image=processed["mobile"])
-                PropertyImage.objects.create(property=prop, image=processed["webp"])
+            # Originals are stored as-is; the process_images worker builds the variants
+            enqueue_images(prop, files)
 
-                # If file was huge, show warning
-                if processed.get("warning"):
-                    messages.warning(request, processed["warning"])
-
-            messages.success(request, "Property uploaded successfully!")
+            if files:
+                messages.success(request, "Property uploaded successfully! Photos will appear once processed.")
+            else:
+                messages.success(request, "Property uploaded successfully!")
             return redirect('home')
 
     else:
@@ -174,13 +213,11 @@ def landlord_upload(request):
 # MONITOR PAGE
 # -------------------------------------------------------------
 def monitor(request):
-    from django.contrib.auth.models import User
-
+    # Totals and breakdowns are kept up to date as rows change; see stats.py
     return render(request, 'listings/monitor.html', {
-        'total_props': Property.objects.count(),
-        'available': Property.objects.filter(available=True).count(),
-        'total_users': User.objects.count(),
-        'recent_props': Property.objects.order_by('-created_at')[:10],
+        **dashboard(),
+        'recent_props': paginate_keyset(Property.objects.all(), request.GET.get('cursor')),
+        'page_cache_stats': cache_stats(),
     })
 
 
@@ -189,11 +226,12 @@ def monitor(request):
 # -------------------------------------------------------------
 @login_required
 def my_properties(request):
-    if not Profile.objects.filter(user=request.user, user_type='landlord').exists():
+    if not (request.profile and request.profile.is_landlord):
         return redirect('home')
 
-    props = Property.objects.filter(owner_name=request.user.username).order_by('-created_at')
-    return render(request, 'listings/my_properties.html', {'properties': props})
+    props = Property.objects.filter(owner_name=request.user.username).select_related('cover_image')
+    page = paginate_keyset(props, request.GET.get('cursor'))
+    return render(request, 'listings/my_properties.html', {'properties': page, 'page': page})
 
 
 # -------------------------------------------------------------
@@ -222,8 +260,8 @@ def edit_property(request, pk):
             # Replace images if new ones uploaded
             if files:
                 prop.images.all().delete()
-                for file in files:
-                    PropertyImage.objects.create(property=prop, image=file)
+                cancel_jobs(prop)
+                enqueue_images(prop, files)
 
             messages.success(request, 'Listing updated successfully.')
             return redirect('my_properties')
@@ -252,10 +290,50 @@ def delete_property(request, pk):
 # -------------------------------------------------------------
 # STATIC PAGES
 # -------------------------------------------------------------
+@cache_anonymous_page('about')
 def about(request):
     return render(request, 'listings/about.html')
 
 
-def property_detail(request, pk):
-    prop = get_object_or_404(Property, pk=pk)
-    return render(request, 'listings/property_detail.html', {'property': prop})
\ No newline at end of file
+@cache_anonymous_page('property_detail', key=lambda request, pk: [property_version(pk)])
+async def property_detail(request, pk):
+    # Everything the template touches is fetched here; it can't query while rendering
+    prop = await aget_object_or_404(Property.objects.prefetch_related('images'), pk=pk)
+    return render(request, 'listings/property_detail.html', {'property': prop})
+
+
+# -------------------------------------------------------------
+# ON-DEMAND THUMBNAILS
+# -------------------------------------------------------------
+@require_safe
+@etag(lambda request, img_hash, width, height, fmt: thumbnail_etag(img_hash, width, height, fmt))
+def thumbnail(request, img_hash, width, height, fmt):
+    """Serve a resized copy of a stored image, rendering it on first request."""
+    if not is_served(width, height, fmt):
+        raise Http404("Unsupported thumbnail.")
+    blob = get_object_or_404(ImageBlob, hash=img_hash)
+    try:
+        path = get_thumbnail(blob, width, height, fmt)
+    except (OSError, ValueError):
+        raise Http404("Source image is unavailable.")
+
+    response = FileResponse(open(path, 'rb'), content_type=FORMATS[fmt][1])
+    # The URL names the exact bytes, so it never needs revalidating
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+# -------------------------------------------------------------
+# LOCATION AUTOCOMPLETE
+# -------------------------------------------------------------
+@require_safe
+async def location_autocomplete(request):
+    """JSON location suggestions for the search box, most listings first."""
+    prefix = request.GET.get('q', '').strip()
+    # Answered from memory, unless the index has to be loaded from the database first
+    results = await sync_to_async(location_index.suggest)(prefix) if len(prefix) >= 2 else []
+    response = JsonResponse({
+        'results': [{'name': name, 'count': count} for name, count in results],
+    })
+    response['Cache-Control'] = 'public, max-age=60'
+    return response